@@ -1,8 +1,29 @@
-from database import get_poll
+from database import get_poll, get_answer_tallies
 from collections import defaultdict
 
-def analyze_responses(poll_id, responses):
-    """Анализировать ответы на опрос"""
+# Баллы стресса за вариант ответа
+STRESS_SCORES = {
+    "Никогда": 0,
+    "Редко": 1,
+    "Иногда": 2,
+    "Часто": 3,
+    "Всегда": 4
+}
+
+# Верхние границы среднего балла и соответствующие уровни
+STRESS_LEVELS = [
+    (1, "Низкий уровень стресса 😊"),
+    (2, "Умеренный уровень стресса 😐"),
+    (3, "Выше среднего уровень стресса 😟"),
+    (None, "Высокий уровень стресса 😰"),
+]
+
+def analyze_responses(poll_id, responses=None):
+    """Анализировать ответы на опрос
+
+    Без responses читает готовые счетчики answer_tallies, то есть
+    работает за O(вопросов × вариантов) независимо от числа ответов.
+    """
     poll = get_poll(poll_id)
     
     if not poll:
@@ -10,16 +31,21 @@ def analyze_responses(poll_id, responses):
     
     analysis = {}
     questions = poll["questions"]
+    tallies = get_answer_tallies(poll_id) if responses is None else None
     
     for q_idx, question in enumerate(questions):
         question_key = f"q_{q_idx}"
-        answer_counts = defaultdict(int)
         
-        # Подсчитываем количество каждого ответа
-        for response in responses:
-            user_answer = response["answers"].get(question_key)
-            if user_answer:
-                answer_counts[user_answer] += 1
+        if tallies is not None:
+            answer_counts = tallies.get(q_idx, {})
+        else:
+            answer_counts = defaultdict(int)
+            
+            # Подсчитываем количество каждого ответа
+            for response in responses:
+                user_answer = response["answers"].get(question_key)
+                if user_answer:
+                    answer_counts[user_answer] += 1
         
         analysis[q_idx] = {
             "question_text": question["text"],
@@ -31,53 +57,50 @@ def analyze_responses(poll_id, responses):
 
 def calculate_stress_level(answers):
     """Пример: вычислить уровень стресса на основе ответов"""
-    stress_scores = {
-        "Никогда": 0,
-        "Редко": 1,
-        "Иногда": 2,
-        "Часто": 3,
-        "Всегда": 4
-    }
-    
     total_score = 0
     count = 0
     
     for key, answer in answers.items():
-        if answer in stress_scores:
-            total_score += stress_scores[answer]
+        if answer in STRESS_SCORES:
+            total_score += STRESS_SCORES[answer]
             count += 1
     
     if count == 0:
         return 0
     
-    average_score = total_score / count
-    
-    if average_score < 1:
-        return "Низкий уровень стресса 😊"
-    elif average_score < 2:
-        return "Умеренный уровень стресса 😐"
-    elif average_score < 3:
-        return "Выше среднего уровень стресса 😟"
-    else:
-        return "Высокий уровень стресса 😰"
+    return stress_level_label(total_score / count)
 
-def generate_report(poll_id, responses):
-    """Генерировать подробный отчет по результатам"""
-    analysis = analyze_responses(poll_id, responses)
-    
-    report = "📋 ПОДРОБНЫЙ ОТЧЕТ\n"
-    report += "=" * 40 + "\n\n"
+def stress_level_label(average_score):
+    """Уровень стресса по среднему баллу"""
+    for upper, label in STRESS_LEVELS:
+        if upper is None or average_score < upper:
+            return label
+
+def report_lines(poll_id, responses=None):
+    """Строки подробного отчета
+
+    Данные читаются сразу, строки форматируются по мере чтения (для
+    постраничного вывода, см. report_pages).
+    """
+    return _report_lines(analyze_responses(poll_id, responses))
+
+def _report_lines(analysis):
+    yield "📋 ПОДРОБНЫЙ ОТЧЕТ"
+    yield "=" * 40
+    yield ""
     
     for q_idx, data in analysis.items():
-        report += f"Вопрос {q_idx + 1}: {data['question_text']}\n"
-        report += f"Всего ответов: {data['total_answered']}\n"
+        yield f"Вопрос {q_idx + 1}: {data['question_text']}"
+        yield f"Всего ответов: {data['total_answered']}"
         
         for answer, count in sorted(data['answer_counts'].items(), key=lambda x: x[1], reverse=True):
             percentage = (count / data['total_answered'] * 100) if data['total_answered'] > 0 else 0
             bar_length = int(percentage / 5)
             bar = "█" * bar_length + "░" * (20 - bar_length)
-            report += f"{answer:20} {bar} {percentage:5.1f}% ({count})\n"
+            yield f"{answer:20} {bar} {percentage:5.1f}% ({count})"
         
-        report += "\n"
-    
-    return report
\ No newline at end of file
+        yield ""
+
+def generate_report(poll_id, responses=None):
+    """Генерировать подробный отчет по результатам"""
+    return "\n".join(report_lines(poll_id, responses)) + "\n"
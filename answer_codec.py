@@ -0,0 +1,211 @@
+"""
+Компактное хранение ответов
+
+Вместо JSON с полными текстами вариантов ответ хранится как BLOB:
+
+    байт 0      версия формата
+    байты 1-4   отпечаток набора вариантов опроса (crc32)
+    байт N+5    номер выбранного варианта вопроса N + 1 (0 - нет ответа)
+
+Отпечаток связывает BLOB с определением опроса: наборы вариантов
+сохраняются в poll_layouts в той же транзакции, что и ответ, поэтому
+старые ответы читаются и после изменения опроса. Два разных набора с
+одним отпечатком - ошибка (LayoutConflict), а не молчаливая подмена.
+
+Версия 1 хранила 16 бит отпечатка (байты 1-2); такие ответы читаются,
+набор вариантов ищется по младшим 16 битам и должен быть однозначным. Ответы, которые нельзя закодировать (неизвестный
+вариант, посторонний ключ), остаются JSON-строкой в той же колонке.
+"""
+import json
+import struct
+import threading
+import zlib
+
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<BI")
+# Заголовок версии 1: отпечаток crc32 & 0xFFFF
+HEADER_V1 = struct.Struct("<BH")
+MAX_OPTIONS = 255
+
+# (poll_id, версия, отпечаток) -> список вариантов по вопросам; наборы
+# неизменны, в кэш попадают только сверенные с poll_layouts
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+
+class LayoutConflict(ValueError):
+    """Под одним отпечатком уже сохранен другой набор вариантов"""
+
+
+def poll_options(questions):
+    """Варианты ответов по вопросам из определения опроса"""
+    return [list(q["options"]) for q in questions]
+
+
+def fingerprint(options) -> int:
+    """Отпечаток набора вариантов"""
+    raw = json.dumps(options, ensure_ascii=False, separators=(",", ":"))
+    return zlib.crc32(raw.encode("utf-8"))
+
+
+def encode(options, answers, fp=None):
+    """Закодировать ответы в BLOB; None, если формат не подходит
+
+    fp - заранее посчитанный отпечаток options (для пакетной перекодировки).
+    """
+    body = bytearray(len(options))
+    for key, answer in answers.items():
+        if not key.startswith("q_"):
+            return None
+        try:
+            q_idx = int(key[2:])
+        except ValueError:
+            return None
+        if not 0 <= q_idx < len(options) or answer not in options[q_idx]:
+            return None
+        option_idx = options[q_idx].index(answer)
+        if option_idx >= MAX_OPTIONS:
+            return None
+        body[q_idx] = option_idx + 1
+
+    if fp is None:
+        fp = fingerprint(options)
+    return HEADER.pack(FORMAT_VERSION, fp) + bytes(body)
+
+
+def header(blob):
+    """(версия, отпечаток) из заголовка BLOB"""
+    if blob[0] == 1:
+        return HEADER_V1.unpack_from(blob)
+    return HEADER.unpack_from(blob)
+
+
+def _cache(key, options):
+    with _layouts_lock:
+        _layouts[key] = options
+
+
+def register_layout(conn, poll_id, options) -> int:
+    """Сохранить набор вариантов опроса; вернуть его отпечаток
+
+    Вызывать в транзакции, которая пишет закодированные ответы.
+    LayoutConflict - под этим отпечатком сохранен другой набор.
+    """
+    fp = fingerprint(options)
+    row = conn.execute(
+        "SELECT options FROM poll_layouts WHERE poll_id = ? AND fingerprint = ?",
+        (poll_id, fp)
+    ).fetchone()
+    if row is None:
+        conn.execute(
+            "INSERT INTO poll_layouts (poll_id, fingerprint, options) VALUES (?, ?, ?)",
+            (poll_id, fp, json.dumps(options, ensure_ascii=False))
+        )
+    elif json.loads(row[0]) != options:
+        raise LayoutConflict(f"Answer layout {fp:#010x} of poll {poll_id} has different options")
+    _cache((poll_id, FORMAT_VERSION, fp), options)
+    return fp
+
+
+def _find_layout(conn, poll_id, version, fp):
+    """Набор вариантов по отпечатку из poll_layouts или None"""
+    if version == FORMAT_VERSION:
+        row = conn.execute(
+            "SELECT options FROM poll_layouts WHERE poll_id = ? AND fingerprint = ?",
+            (poll_id, fp)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Версия 1: 16 бит отпечатка, наборы сверяются по пересчитанному crc32
+    found = []
+    for (raw,) in conn.execute("SELECT options FROM poll_layouts WHERE poll_id = ?", (poll_id,)):
+        options = json.loads(raw)
+        if fingerprint(options) & 0xFFFF == fp and options not in found:
+            found.append(options)
+    if len(found) > 1:
+        raise LayoutConflict(f"Answer layout {fp:#06x} of poll {poll_id} is ambiguous")
+    return found[0] if found else None
+
+
+def _layout(conn, poll_id, version, fp):
+    """Набор вариантов по отпечатку (кэш, затем poll_layouts, затем polls)"""
+    key = (poll_id, version, fp)
+    with _layouts_lock:
+        options = _layouts.get(key)
+    if options is not None:
+        return options
+
+    options = _find_layout(conn, poll_id, version, fp)
+    if options is None:
+        # Опрос добавлен в обход save_poll: сверяем с текущим определением
+        row = conn.execute(
+            "SELECT questions FROM polls WHERE poll_id = ?", (poll_id,)
+        ).fetchone()
+        options = poll_options(json.loads(row[0])) if row else None
+        mask = 0xFFFF if version == 1 else 0xFFFFFFFF
+        if options is None or fingerprint(options) & mask != fp:
+            raise ValueError(f"Unknown answer layout {fp:#x} for poll {poll_id}")
+
+    _cache(key, options)
+    return options
+
+
+def decode(conn, poll_id, value) -> dict:
+    """Раскодировать ответы из BLOB или JSON-строки"""
+    if isinstance(value, str):
+        return json.loads(value)
+
+    if value[0] not in (1, FORMAT_VERSION):
+        raise ValueError(f"Unsupported answer format version {value[0]}")
+    version, fp = header(value)
+
+    options = _layout(conn, poll_id, version, fp)
+    size = HEADER_V1.size if version == 1 else HEADER.size
+    return {
+        f"q_{q_idx}": options[q_idx][code - 1]
+        for q_idx, code in enumerate(value[size:])
+        if code
+    }
+
+
+def rekey_layouts(conn) -> int:
+    """Перевести poll_layouts на полный 32-битный отпечаток; вернуть число наборов"""
+    rows = conn.execute("SELECT poll_id, options, created_at FROM poll_layouts").fetchall()
+    conn.execute("DELETE FROM poll_layouts")
+    conn.executemany("""
+        INSERT OR IGNORE INTO poll_layouts (poll_id, fingerprint, options, created_at)
+        VALUES (?, ?, ?, ?)
+    """, [(poll_id, fingerprint(json.loads(raw)), raw, created_at) for poll_id, raw, created_at in rows])
+    with _layouts_lock:
+        _layouts.clear()
+    return len(rows)
+
+
+def pack_existing(conn, batch_size=5000) -> int:
+    """Перекодировать JSON-ответы в BLOB на месте; вернуть число строк"""
+    layouts = {}
+    for poll_id, questions in conn.execute("SELECT poll_id, questions FROM polls").fetchall():
+        options = poll_options(json.loads(questions))
+        layouts[poll_id] = (options, register_layout(conn, poll_id, options))
+
+    packed = 0
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, poll_id, answers FROM responses
+            WHERE id > ? ORDER BY id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            return packed
+        last_id = rows[-1][0]
+
+        updates = []
+        for row_id, poll_id, value in rows:
+            if not isinstance(value, str) or poll_id not in layouts:
+                continue
+            options, fp = layouts[poll_id]
+            blob = encode(options, json.loads(value), fp)
+            if blob is not None:
+                updates.append((blob, row_id))
+        conn.executemany("UPDATE responses SET answers = ? WHERE id = ?", updates)
+        packed += len(updates)
@@ -0,0 +1,151 @@
+"""
+Векторная аналитика ответов на колоночной матрице
+
+Ответы опроса загружаются в матрицу индексов вариантов (строка -
+респондент, столбец - вопрос, -1 - нет ответа). Распределения,
+перекрестные таблицы и баллы стресса считаются операциями NumPy
+сразу по всем респондентам.
+"""
+import numpy as np
+import pandas as pd
+
+import answer_codec
+from analitycs import STRESS_LEVELS, STRESS_SCORES
+from database import get_poll, iter_raw_answer_chunks, unpack_answers
+
+NO_ANSWER = -1
+
+
+class AnswerMatrix:
+    """Матрица ответов опроса: int16 [респонденты × вопросы]"""
+
+    def __init__(self, poll, matrix):
+        self.poll = poll
+        self.questions = poll["questions"]
+        self.matrix = matrix
+
+    @classmethod
+    def from_responses(cls, poll, responses, chunk_size=10000):
+        """Построить матрицу из итерируемых ответов {"answers": {"q_N": ...}}"""
+        keys = [f"q_{i}" for i in range(len(poll["questions"]))]
+        lookups = [
+            {option: idx for idx, option in enumerate(q["options"])}
+            for q in poll["questions"]
+        ]
+
+        chunks = []
+        buffer = []
+        for response in responses:
+            answers = response["answers"]
+            buffer.append([
+                lookup.get(answers.get(key), NO_ANSWER)
+                for key, lookup in zip(keys, lookups)
+            ])
+            if len(buffer) >= chunk_size:
+                chunks.append(np.array(buffer, dtype=np.int16))
+                buffer = []
+        if buffer or not chunks:
+            chunks.append(np.array(buffer, dtype=np.int16).reshape(-1, len(keys)))
+
+        return cls(poll, np.concatenate(chunks))
+
+    @classmethod
+    def load(cls, poll_id, chunk_size=10000):
+        """Загрузить ответы опроса из БД пачками
+
+        Компактные ответы текущей версии опроса переносятся в матрицу
+        напрямую из байтов BLOB, без построения словарей.
+        """
+        poll = get_poll(poll_id)
+        if not poll:
+            raise ValueError(f"Poll {poll_id} not found")
+
+        n_questions = len(poll["questions"])
+        options = answer_codec.poll_options(poll["questions"])
+        current = answer_codec.HEADER.pack(
+            answer_codec.FORMAT_VERSION, answer_codec.fingerprint(options)
+        )
+
+        packed = []
+        others = []
+        for chunk in iter_raw_answer_chunks(poll_id, chunk_size):
+            for value in chunk:
+                if isinstance(value, bytes) and value.startswith(current):
+                    packed.append(value[len(current):])
+                else:
+                    others.append({"answers": unpack_answers(poll_id, value)})
+
+        codes = np.frombuffer(b"".join(packed), dtype=np.uint8)
+        matrix = codes.reshape(-1, n_questions).astype(np.int16) - 1
+        if others:
+            matrix = np.concatenate([matrix, cls.from_responses(poll, others).matrix])
+        return cls(poll, matrix)
+
+    @property
+    def respondents(self) -> int:
+        return self.matrix.shape[0]
+
+    def counts(self, q_idx) -> np.ndarray:
+        """Число ответов по каждому варианту вопроса"""
+        column = self.matrix[:, q_idx]
+        n_options = len(self.questions[q_idx]["options"])
+        return np.bincount(column[column >= 0], minlength=n_options)
+
+    def distributions(self) -> dict:
+        """Распределения ответов в формате analyze_responses"""
+        analysis = {}
+        for q_idx, question in enumerate(self.questions):
+            counts = self.counts(q_idx)
+            analysis[q_idx] = {
+                "question_text": question["text"],
+                "answer_counts": {
+                    option: int(count)
+                    for option, count in zip(question["options"], counts)
+                    if count
+                },
+                "total_answered": int(counts.sum()),
+            }
+        return analysis
+
+    def crosstab(self, q_a, q_b) -> pd.DataFrame:
+        """Перекрестная таблица ответов на два вопроса"""
+        options_a = self.questions[q_a]["options"]
+        options_b = self.questions[q_b]["options"]
+        a = self.matrix[:, q_a]
+        b = self.matrix[:, q_b]
+        both = (a >= 0) & (b >= 0)
+
+        flat = a[both].astype(np.int64) * len(options_b) + b[both]
+        table = np.bincount(flat, minlength=len(options_a) * len(options_b))
+        return pd.DataFrame(
+            table.reshape(len(options_a), len(options_b)),
+            index=list(options_a),
+            columns=list(options_b),
+        )
+
+    def stress_scores(self) -> np.ndarray:
+        """Средний балл стресса каждого респондента (NaN без оцененных ответов)"""
+        totals = np.zeros(self.respondents, dtype=np.float64)
+        counts = np.zeros(self.respondents, dtype=np.int32)
+
+        for q_idx, question in enumerate(self.questions):
+            # Последний элемент таблицы соответствует индексу -1 (нет ответа)
+            table = np.array(
+                [STRESS_SCORES.get(option, np.nan) for option in question["options"]] + [np.nan]
+            )
+            scores = table[self.matrix[:, q_idx]]
+            scored = ~np.isnan(scores)
+            totals[scored] += scores[scored]
+            counts += scored
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, totals / counts, np.nan)
+
+    def stress_distribution(self) -> dict:
+        """Число респондентов по уровням стресса"""
+        scores = self.stress_scores()
+        scored = scores[~np.isnan(scores)]
+        bounds = [upper for upper, _ in STRESS_LEVELS if upper is not None]
+        levels = np.digitize(scored, bounds)
+        counts = np.bincount(levels, minlength=len(STRESS_LEVELS))
+        return {label: int(count) for (_, label), count in zip(STRESS_LEVELS, counts)}
@@ -0,0 +1,110 @@
+"""
+Асинхронный доступ к БД для обработчиков Telegram
+
+Синхронные функции database.py и click_analytics.py выполняются в
+небольшом пуле потоков, поэтому запись в SQLite не блокирует цикл
+событий python-telegram-bot и не задерживает обновления других чатов.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import click_analytics
+import database
+import metrics
+
+# Потоков для работы с БД (в WAL-режиме чтения идут параллельно)
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+
+_executor = None
+
+
+def _get_executor():
+    """Получить (или создать) пул потоков БД"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=DB_WORKERS,
+            thread_name_prefix="db",
+        )
+    return _executor
+
+
+def _timed(func, submitted):
+    """Вызов в потоке пула с замером ожидания и выполнения"""
+    started = time.perf_counter()
+    metrics.DB_QUEUE_WAIT.observe(started - submitted)
+    try:
+        return func()
+    finally:
+        metrics.DB_QUERY_LATENCY.observe(
+            time.perf_counter() - started, getattr(func.func, "__name__", "unknown")
+        )
+
+
+async def run_db(func, *args, **kwargs):
+    """Выполнить синхронную функцию БД в пуле и дождаться результата"""
+    loop = asyncio.get_running_loop()
+    call = partial(func, *args, **kwargs)
+    if metrics.METRICS_ENABLED:
+        call = partial(_timed, call, time.perf_counter())
+    return await loop.run_in_executor(_get_executor(), call)
+
+
+def shutdown():
+    """Дождаться завершения запросов к БД"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+async def get_poll(poll_id):
+    """Получить опрос по ID"""
+    return await run_db(database.get_poll, poll_id)
+
+
+async def get_all_polls():
+    """Получить список всех опросов"""
+    return await run_db(database.get_all_polls)
+
+
+async def save_response(user_id, poll_id, answers):
+    """Сохранить ответы пользователя"""
+    return await run_db(database.save_response, user_id, poll_id, answers)
+
+
+async def get_responses(poll_id):
+    """Получить все ответы для опроса"""
+    return await run_db(database.get_responses, poll_id)
+
+
+async def get_user_responses(user_id):
+    """Получить все ответы пользователя"""
+    return await run_db(database.get_user_responses, user_id)
+
+
+async def user_already_responded(user_id, poll_id):
+    """Проверить, ответил ли пользователь на опрос"""
+    # Загруженный индекс отвечает сразу, без перехода в поток БД
+    responded = database.peek_user_responded(user_id, poll_id)
+    if responded is not None:
+        return responded
+    return await run_db(database.user_already_responded, user_id, poll_id)
+
+
+async def log_click(user_id: int, button_name: str, callback_data: str = None,
+                    poll_id: str = None, question_idx: int = None):
+    """Логировать клик по кнопке"""
+    # Обычно клик просто встает в очередь буфера, без перехода в поток БД
+    if click_analytics.try_log_click(
+        user_id, button_name, callback_data=callback_data,
+        poll_id=poll_id, question_idx=question_idx,
+    ):
+        return
+    return await run_db(
+        click_analytics.log_click, user_id, button_name,
+        callback_data=callback_data, poll_id=poll_id, question_idx=question_idx,
+    )
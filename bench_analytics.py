@@ -0,0 +1,89 @@
+"""
+Бенчмарк аналитики ответов: цикл по словарям против матрицы NumPy
+
+Запуск: python bench_analytics.py [--sizes 10000,100000,1000000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import analitycs
+import database
+from answer_matrix import AnswerMatrix
+from db_pool import close_all
+from samples import create_sample_polls
+
+
+def _synthetic_responses(poll, n, seed=42):
+    """Сгенерировать n ответов в формате get_responses"""
+    rnd = random.Random(seed)
+    options = [q["options"] for q in poll["questions"]]
+    return [
+        {
+            "user_id": i,
+            "answers": {f"q_{j}": rnd.choice(opts) for j, opts in enumerate(options)},
+            "completed_at": None,
+        }
+        for i in range(n)
+    ]
+
+
+def _timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def _bench(poll_id, n):
+    poll = database.get_poll(poll_id)
+    responses = _synthetic_responses(poll, n)
+
+    def loop():
+        analysis = analitycs.analyze_responses(poll_id, responses)
+        levels = {}
+        for response in responses:
+            level = analitycs.calculate_stress_level(response["answers"])
+            levels[level] = levels.get(level, 0) + 1
+        return analysis, levels
+
+    (loop_analysis, loop_levels), loop_time = _timed(loop)
+    matrix, build_time = _timed(lambda: AnswerMatrix.from_responses(poll, responses))
+
+    def vectorized():
+        return matrix.distributions(), matrix.stress_distribution(), matrix.crosstab(0, 1)
+
+    (vec_analysis, vec_levels, _), vec_time = _timed(vectorized)
+
+    assert {q: d["answer_counts"] for q, d in vec_analysis.items()} == \
+        {q: d["answer_counts"] for q, d in loop_analysis.items()}
+    assert {k: v for k, v in vec_levels.items() if v} == \
+        {k: v for k, v in loop_levels.items() if k != 0}
+
+    print(
+        f"{n:>9} ответов  цикл {loop_time * 1000:9.1f} мс  "
+        f"матрица: сборка {build_time * 1000:9.1f} мс + расчет {vec_time * 1000:7.1f} мс  "
+        f"(расчет x{loop_time / vec_time:6.0f})"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--poll", default="poll_1")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+        create_sample_polls()
+
+        for n in (int(x) for x in args.sizes.split(",")):
+            _bench(args.poll, n)
+
+        close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Рассылка приглашений с падением посередине и продолжением
+
+Во временной БД пользователи нажимали кнопки, часть из них уже прошла
+опрос. Рассылка идет в поддельный Bot API (fake_telegram) с лимитами
+Telegram; часть пользователей заблокировала бота, а еще часть проходит
+опрос уже после создания рассылки. Первый запуск прерывается через
+--crash-after секунд, второй продолжает с того же места.
+
+Проверяется, что никому не пришло два приглашения, что потерянных
+(оставшихся в 'sending') получателей не больше пачки и что статусы
+сходятся с числом получателей.
+
+Запуск: python bench_broadcast.py [--users 500] [--rate 25] [--crash-after 5]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+
+from aiohttp import web
+
+import broadcast
+import click_analytics
+import database
+from db_pool import get_connection, transaction
+from fake_telegram import FakeBotAPI
+from logger import logger
+from samples import create_sample_polls
+
+POLL_ID = "poll_1"
+
+
+def _answers(poll):
+    return {f"q_{i}": question["options"][0] for i, question in enumerate(poll["questions"])}
+
+
+def _fill(args, rnd):
+    """Клики пользователей и ответы тех, кто уже прошел опрос"""
+    users = [100000 + i for i in range(args.users)]
+    with transaction(database.DB_NAME) as conn:
+        conn.executemany(
+            "INSERT INTO clicks (user_id, button_name) VALUES (?, ?)",
+            [(user_id, "start_command") for user_id in users for _ in range(rnd.randint(1, 3))]
+        )
+    poll = database.get_poll(POLL_ID)
+    responders = rnd.sample(users, int(len(users) * args.responded))
+    for user_id in responders:
+        database.save_response(user_id, POLL_ID, _answers(poll))
+    rest = [user_id for user_id in users if user_id not in set(responders)]
+    return users, responders, rest
+
+
+async def run(args, db_path):
+    database.DB_NAME = db_path
+    click_analytics.DB_PATH = db_path
+    database.init_db()
+    create_sample_polls()
+    rnd = random.Random(args.seed)
+    users, responders, rest = _fill(args, rnd)
+
+    blocked = set(rnd.sample(rest, int(len(rest) * args.blocked)))
+    api = FakeBotAPI(args.api_latency_ms / 1000, chat_limit=1, global_limit=30, blocked=blocked)
+    runner = web.AppRunner(api.make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+
+    broadcast_id = broadcast.create_broadcast(POLL_ID, "non-responders")
+    total = broadcast.get_broadcast(broadcast_id)["total"]
+    # Прошли опрос уже после создания рассылки
+    late = rnd.sample([user_id for user_id in rest if user_id not in blocked], args.late)
+    poll = database.get_poll(POLL_ID)
+    for user_id in late:
+        database.save_response(user_id, POLL_ID, _answers(poll))
+    print(f"Пользователей {len(users)}, прошли опрос {len(responders)}, получателей {total}, "
+          f"заблокировали бота {len(blocked)}, прошли после создания {len(late)}")
+
+    bot = broadcast.make_bot("1:fake", f"http://127.0.0.1:{args.api_port}")
+    await bot.initialize()
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(
+            broadcast.run_broadcast(broadcast_id, bot, rate=args.rate, batch=args.batch),
+            timeout=args.crash_after,
+        )
+    except asyncio.TimeoutError:
+        pass
+    first = time.monotonic() - started
+    crashed = broadcast.get_broadcast(broadcast_id)
+    print(f"Прервано через {first:.1f} с: {crashed['counts']}")
+
+    started = time.monotonic()
+    info = await broadcast.run_broadcast(broadcast_id, bot, rate=args.rate, batch=args.batch)
+    second = time.monotonic() - started
+    await bot.shutdown()
+    await runner.cleanup()
+
+    counts = info["counts"]
+    print(f"Продолжено за {second:.1f} с: {info['status']} {counts}")
+
+    conn = get_connection(database.DB_NAME)
+    statuses = dict(conn.execute(
+        "SELECT user_id, status FROM broadcast_recipients WHERE broadcast_id = ?", (broadcast_id,)
+    ).fetchall())
+    duplicates = [chat_id for chat_id, texts in api.texts.items() if len(texts) > 1]
+    delivered = set(api.texts)
+    sent = {user_id for user_id, status in statuses.items() if status == "sent"}
+    unknown = {user_id for user_id, status in statuses.items() if status == "sending"}
+    rate = (counts["sent"] + counts["blocked"] + counts["failed"]) / (first + second)
+    print(f"  повторных приглашений: {len(duplicates)}")
+    print(f"  неизвестно после падения: {len(unknown)} (пачка {args.batch}), "
+          f"из них доставлено {len(unknown & delivered)}")
+    print(f"  заблокировали бота: {counts['blocked']} из {len(blocked)}, пропущено прошедших: {counts['skipped']}")
+    print(f"  статусы сходятся с числом получателей: {sum(counts.values()) == total}")
+    print(f"  скорость {rate:.1f} сообщений/с при лимите {args.rate}, 429 от API: {sum(api.flood.values())}")
+    ok = (not duplicates and len(unknown) <= args.batch and sent <= delivered
+          and delivered <= sent | unknown and sum(counts.values()) == total and not counts["pending"])
+    return 0 if ok else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--responded", type=float, default=0.3, help="доля уже прошедших опрос")
+    parser.add_argument("--blocked", type=float, default=0.05, help="доля заблокировавших бота")
+    parser.add_argument("--late", type=int, default=10, help="прошли опрос после создания рассылки")
+    parser.add_argument("--rate", type=float, default=25.0)
+    parser.add_argument("--batch", type=int, default=broadcast.BROADCAST_BATCH)
+    parser.add_argument("--crash-after", type=float, default=5.0)
+    parser.add_argument("--api-latency-ms", type=float, default=20.0)
+    parser.add_argument("--api-port", type=int, default=8083)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("CRITICAL")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        return asyncio.run(run(args, os.path.join(tmp, "bench.db")))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,123 @@
+"""
+Бенчмарк слоя доступа к БД: соединение на каждый вызов против пула
+
+Запуск: python bench_db.py [--rate 3000] [--seconds 3]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import click_analytics
+import database
+from db_pool import close_all
+from logger import logger
+
+
+def _legacy_get_poll(db_path, poll_id):
+    """get_poll в старом виде: новое соединение на каждый вызов"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM polls WHERE poll_id = ?", (poll_id,))
+    poll = cursor.fetchone()
+    conn.close()
+    return json.loads(poll[4])
+
+
+def _legacy_save_response(db_path, user_id, poll_id, answers):
+    """save_response в старом виде"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO responses (user_id, poll_id, answers)
+        VALUES (?, ?, ?)
+    """, (user_id, poll_id, json.dumps(answers)))
+    conn.commit()
+    conn.close()
+
+
+def _legacy_log_click(db_path, user_id, button_name):
+    """log_click в старом виде"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO clicks (user_id, button_name, callback_data, poll_id, question_idx)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, button_name, None, None, None))
+    conn.commit()
+    conn.close()
+
+
+def _prepare(db_path):
+    """Создать схему и тестовый опрос"""
+    database.DB_NAME = db_path
+    click_analytics.DB_PATH = db_path
+    database.init_db()
+    click_analytics.init_clicks_table()
+    database.save_poll("bench", "Бенчмарк", "", [
+        {"text": "Вопрос", "options": ["Никогда", "Редко", "Иногда"]}
+    ])
+
+
+def _run(name, call, rate, seconds):
+    """Вызывать call с заданной частотой и собрать задержки"""
+    interval = 1.0 / rate
+    total = int(rate * seconds)
+    latencies = []
+    started = time.perf_counter()
+
+    for i in range(total):
+        target = started + i * interval
+        now = time.perf_counter()
+        if now < target:
+            time.sleep(target - now)
+        t0 = time.perf_counter()
+        call(i)
+        latencies.append((time.perf_counter() - t0) * 1e6)
+
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    print(
+        f"{name:28} {total / elapsed:8.0f} calls/s  "
+        f"mean {statistics.mean(latencies):8.1f}us  "
+        f"p50 {p(0.50):8.1f}us  p95 {p(0.95):8.1f}us  p99 {p(0.99):8.1f}us"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=int, default=3000, help="вызовов в секунду")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        _prepare(db_path)
+        answers = {"q_0": "Иногда"}
+
+        cases = [
+            ("get_poll (legacy)", lambda i: _legacy_get_poll(db_path, "bench")),
+            ("get_poll (pool)", lambda i: database.get_poll("bench")),
+            ("save_response (legacy)", lambda i: _legacy_save_response(db_path, i, "bench", answers)),
+            ("save_response (pool)", lambda i: database.save_response(i, "bench", answers)),
+            ("log_click (legacy)", lambda i: _legacy_log_click(db_path, i, "bench")),
+            ("log_click (pool)", lambda i: click_analytics.log_click(i, "bench")),
+        ]
+        for name, call in cases:
+            _run(name, call, args.rate, args.seconds)
+
+        buffer = click_analytics.start_click_buffer()
+        _run("log_click (buffer)", lambda i: click_analytics.log_click(i, "bench"), args.rate, args.seconds)
+        click_analytics.stop_click_buffer()
+        print(f"buffer stats: {buffer.stats()}")
+
+        close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Бенчмарк формата хранения ответов: JSON против компактного BLOB
+
+Заполняет временную БД ответами в старом JSON-формате, замеряет размер
+файла и скорость чтения, перекодирует ответы на месте (как миграция 6)
+и повторяет замеры.
+
+Запуск: python bench_encoding.py [--responses 200000]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import answer_codec
+import database
+from answer_matrix import AnswerMatrix
+from db_pool import close_all, get_connection, transaction
+from samples import create_sample_polls
+
+
+def _fill_json(poll_id, n, seed=42):
+    """Вставить n ответов в старом JSON-формате"""
+    rnd = random.Random(seed)
+    options = [q["options"] for q in database.get_poll(poll_id)["questions"]]
+    rows = [
+        (i, poll_id, json.dumps({f"q_{j}": rnd.choice(opts) for j, opts in enumerate(options)}))
+        for i in range(n)
+    ]
+    with transaction(database.DB_NAME) as conn:
+        conn.executemany(
+            "INSERT INTO responses (user_id, poll_id, answers) VALUES (?, ?, ?)", rows
+        )
+
+
+def _measure(label, poll_id, n):
+    """Размер БД после VACUUM и скорость чтения ответов"""
+    conn = get_connection(database.DB_NAME)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    size = os.path.getsize(database.DB_NAME)
+    payload = conn.execute(
+        "SELECT SUM(LENGTH(CAST(answers AS BLOB))) FROM responses WHERE poll_id = ?", (poll_id,)
+    ).fetchone()[0]
+
+    started = time.perf_counter()
+    decoded = sum(1 for _ in database.iter_responses(poll_id, chunk_size=5000))
+    decode_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matrix = AnswerMatrix.load(poll_id)
+    matrix_time = time.perf_counter() - started
+    assert decoded == matrix.respondents == n
+
+    print(
+        f"{label:6} БД {size / 1024 / 1024:7.2f} МБ  ответы {payload / n:5.1f} Б/строка  "
+        f"декодирование {n / decode_time:9.0f} строк/с  "
+        f"матрица {n / matrix_time:10.0f} строк/с"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--responses", type=int, default=200000)
+    parser.add_argument("--poll", default="poll_1")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+        create_sample_polls()
+
+        _fill_json(args.poll, args.responses)
+        _measure("JSON", args.poll, args.responses)
+
+        started = time.perf_counter()
+        with transaction(database.DB_NAME) as conn:
+            packed = answer_codec.pack_existing(conn)
+        print(f"Перекодировано {packed} строк за {time.perf_counter() - started:.2f} с")
+
+        _measure("BLOB", args.poll, args.responses)
+        close_all()
+
+
+if __name__ == "__main__":
+    main()
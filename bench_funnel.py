@@ -0,0 +1,199 @@
+"""
+Воронка по сессиям: точность, инкрементальное обновление и чтение
+
+Генерирует клики прохождения опроса с известными сессиями: пользователи
+бросают опрос на разных вопросах, нажимают старые кнопки повторно и
+возвращаются к опросу через несколько часов. Клики пишутся пачками,
+как из буфера, и после каждой пачки вызывается funnel.update.
+
+Проверяется, что:
+- инкрементальный результат совпадает с разбором всех кликов разом;
+- число сессий на шагах совпадает с заданным генератором;
+- медиана и p90 времени шагов и прохождения близки к точным.
+
+Сравнивается время отчета: прежний запрос по clicks и чтение агрегатов.
+
+Запуск: python bench_funnel.py [--users 20000] [--batch 500]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import click_analytics
+import database
+import funnel
+from db_pool import get_connection, transaction
+from logger import logger
+from samples import create_sample_polls
+
+POLL_ID = "poll_1"
+
+_OLD_FUNNEL_SQL = """
+    SELECT question_idx, COUNT(DISTINCT user_id) as users
+    FROM clicks
+    WHERE poll_id = ? AND question_idx IS NOT NULL
+    GROUP BY question_idx
+    ORDER BY question_idx
+"""
+
+
+def _ts(at):
+    return datetime.fromtimestamp(at, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _think(rnd):
+    """Время на вопрос: обычно секунды, иногда минуты"""
+    return int(min(rnd.lognormvariate(2.3, 0.8), 900)) + 1
+
+
+def generate(args, questions):
+    """Клики и истинные сессии: reached[шаг], step_times[шаг], completion"""
+    rnd = random.Random(args.seed)
+    base = int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp())
+    clicks = []
+    reached = [0] * (questions + 1)
+    step_times = [[] for _ in range(questions + 1)]
+    completion = []
+
+    def click(user_id, at, button, poll_id=None, question_idx=None):
+        clicks.append((at, user_id, button, poll_id, question_idx))
+
+    for i in range(args.users):
+        user_id = 100000 + i
+        at = base + rnd.randint(0, 86400)
+        click(user_id, at, "start_command")
+        for attempt in range(1 + (rnd.random() < args.restart)):
+            if attempt:
+                # Вернулся после того, как сессия истекла
+                at += funnel.FUNNEL_SESSION_TIMEOUT + rnd.randint(60, 7200)
+            at += rnd.randint(1, 5)
+            click(user_id, at, f"started_poll_{POLL_ID}", POLL_ID)
+            started = last = at
+            reached[0] += 1
+            for q_idx in range(questions):
+                if rnd.random() < args.drop:
+                    break
+                at += _think(rnd)
+                click(user_id, at, f"answer_q{q_idx}", POLL_ID, q_idx)
+                reached[q_idx + 1] += 1
+                step_times[q_idx + 1].append(at - last)
+                last = at
+                if q_idx and rnd.random() < args.double:
+                    # Нажатие на кнопку предыдущего вопроса
+                    at += rnd.randint(0, 2)
+                    click(user_id, at, f"answer_q{q_idx - 1}", POLL_ID, q_idx - 1)
+            else:
+                completion.append(last - started)
+            at += rnd.randint(1, 30)
+            click(user_id, at, "view_results")
+
+    clicks.sort(key=lambda row: row[0])
+    return clicks, reached, step_times, completion
+
+
+def _insert(conn, rows):
+    conn.executemany(
+        "INSERT INTO clicks (user_id, button_name, poll_id, question_idx, clicked_at) VALUES (?, ?, ?, ?, ?)",
+        [(user_id, button, poll_id, q_idx, _ts(at)) for at, user_id, button, poll_id, q_idx in rows]
+    )
+
+
+def _setup(db_path):
+    database.DB_NAME = db_path
+    click_analytics.DB_PATH = db_path
+    database.init_db()
+    create_sample_polls()
+
+
+def _exact(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    rank = q * len(values)
+    return values[max(int(rank + 0.999999) - 1, 0)]
+
+
+def _error(approx, exact):
+    if exact in (None, 0) or approx is None:
+        return 0.0
+    return abs(approx - exact) / exact * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=500, help="кликов в пачке (как CLICK_BATCH_SIZE)")
+    parser.add_argument("--drop", type=float, default=0.12, help="вероятность бросить на вопросе")
+    parser.add_argument("--double", type=float, default=0.05, help="вероятность повторного нажатия")
+    parser.add_argument("--restart", type=float, default=0.1, help="доля вернувшихся к опросу")
+    parser.add_argument("--reads", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        whole_db = os.path.join(tmp, "whole.db")
+        _setup(whole_db)
+        questions = len(database.get_poll(POLL_ID)["questions"])
+        clicks, reached, step_times, completion = generate(args, questions)
+        with transaction(whole_db) as conn:
+            _insert(conn, clicks)
+            started = time.perf_counter()
+            funnel.update(conn)
+            whole_seconds = time.perf_counter() - started
+        whole = funnel.get_funnel(get_connection(whole_db), POLL_ID)
+
+        incremental_db = os.path.join(tmp, "incremental.db")
+        _setup(incremental_db)
+        update_seconds = 0.0
+        for i in range(0, len(clicks), args.batch):
+            with transaction(incremental_db) as conn:
+                _insert(conn, clicks[i:i + args.batch])
+                started = time.perf_counter()
+                funnel.update(conn)
+                update_seconds += time.perf_counter() - started
+        conn = get_connection(incremental_db)
+        result = funnel.get_funnel(conn, POLL_ID)
+        open_sessions = conn.execute("SELECT COUNT(*) FROM funnel_sessions").fetchone()[0]
+
+        print(f"Кликов: {len(clicks)}, сессий: {reached[0]}, вопросов: {questions}")
+        print(f"Разбор всех кликов разом: {whole_seconds:.2f} с; пачками по {args.batch}: "
+              f"{update_seconds:.2f} с ({update_seconds / len(clicks) * 1e6:.1f} мкс на клик), "
+              f"открытых сессий в конце: {open_sessions}")
+        print(f"Пачками = разом: {result == whole}")
+
+        counts_ok = [step["sessions"] for step in result["steps"]] == reached
+        print(f"Сессии на шагах совпадают с генератором: {counts_ok}")
+        print(f"{'шаг':>4} {'сессий':>7} {'конв.%':>7} {'медиана':>8} {'точно':>6} {'p90':>5} {'точно':>6}")
+        worst = 0.0
+        for step in result["steps"][1:]:
+            times = step_times[step["step"]]
+            median, p90 = _exact(times, 0.5), _exact(times, 0.9)
+            worst = max(worst, _error(step["median"], median), _error(step["p90"], p90))
+            print(f"{step['step']:>4} {step['sessions']:>7} {step['conversion']:>7} "
+                  f"{step['median']:>8} {median:>6} {step['p90']:>5} {p90:>6}")
+        total = result["completion"]
+        median, p90 = _exact(completion, 0.5), _exact(completion, 0.9)
+        worst = max(worst, _error(total["median"], median), _error(total["p90"], p90))
+        print(f"Прохождение: {total['sessions']} (точно {len(completion)}), медиана {total['median']} "
+              f"(точно {median}), p90 {total['p90']} (точно {p90}); наибольшая ошибка {worst:.1f}%")
+
+        started = time.perf_counter()
+        for _ in range(args.reads):
+            conn.execute(_OLD_FUNNEL_SQL, (POLL_ID,)).fetchall()
+        old_ms = (time.perf_counter() - started) / args.reads * 1000
+        started = time.perf_counter()
+        for _ in range(args.reads):
+            funnel.get_funnel(conn, POLL_ID)
+        new_ms = (time.perf_counter() - started) / args.reads * 1000
+        print(f"Отчет: запрос по clicks {old_ms:.2f} мс, агрегаты воронки {new_ms:.3f} мс")
+
+    ok = result == whole and counts_ok and total["sessions"] == len(completion) and worst <= 10
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
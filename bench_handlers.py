@@ -0,0 +1,293 @@
+"""
+Нагрузочный бенчмарк обработчиков бота без сети
+
+N синтетических пользователей проходят /start -> список опросов ->
+poll_1/poll_2 из samples.py -> результаты. Обработчики вызываются с
+настоящими Update/CallbackQuery, а вызовы Bot API перехватывает
+заглушка (с необязательной искусственной задержкой). Итоги сохраняются
+в bench_results/ для сравнения запусков.
+
+Запуск: python bench_handlers.py [--users 500] [--concurrency 100]
+                                 [--api-latency-ms 0] [--compare FILE]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from telegram import Bot, Update
+from telegram.ext import Application, CallbackContext
+
+import async_db
+import callback_router
+import click_analytics
+import database
+import handlers
+import outbound
+from db_pool import close_all, get_connection
+from logger import logger
+from samples import create_sample_polls
+
+RESULTS_DIR = "bench_results"
+
+
+class StubBot(Bot):
+    """Bot без сети: запоминает последнюю клавиатуру в каждом чате"""
+
+    def __init__(self, latency=0.0):
+        super().__init__("0:stub")
+        with self._unfrozen():
+            self.latency = latency
+            self.keyboards = {}
+            self.calls = Counter()
+
+    async def _call(self, method, chat_id=None, reply_markup=None):
+        self.calls[method] += 1
+        if chat_id is not None:
+            self.keyboards[chat_id] = reply_markup
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+    async def answer_callback_query(self, *args, **kwargs):
+        return await self._call("answer_callback_query")
+
+    async def edit_message_text(self, *args, chat_id=None, reply_markup=None, **kwargs):
+        return await self._call("edit_message_text", chat_id, reply_markup)
+
+    async def send_message(self, *args, chat_id=None, reply_markup=None, **kwargs):
+        return await self._call("send_message", chat_id, reply_markup)
+
+
+class LoadRunner:
+    """Прогон пользователей через обработчики с замером задержек"""
+
+    def __init__(self, bot, app):
+        # Клавиатура нужна сразу после обработчика: без очереди исходящих
+        outbound.OUTBOUND_ENABLED = False
+        self.bot = bot
+        self.app = app
+        self.update_ids = itertools.count(1)
+        self.latencies = {}
+        self.errors = 0
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def _command(self, user_id, text):
+        update_id = next(self.update_ids)
+        return Update.de_json({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+            },
+        }, self.bot)
+
+    def _callback(self, user_id, data):
+        update_id = next(self.update_ids)
+        return Update.de_json({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "",
+                },
+            },
+        }, self.bot)
+
+    async def _handle(self, name, handler, update):
+        context = CallbackContext.from_update(update, self.app)
+        started = time.perf_counter()
+        try:
+            await handler(update, context)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Bench handler {name} failed: {e}")
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+    def _buttons(self, user_id):
+        """callback_data кнопок последней клавиатуры пользователя"""
+        markup = self.bot.keyboards.get(user_id)
+        if markup is None:
+            return []
+        return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+    async def walk(self, user_id, poll_id, rnd):
+        """Один пользователь проходит опрос от /start до результатов"""
+        await self._handle("start", handlers.start, self._command(user_id, "/start"))
+        await self._handle(
+            "button_callback", handlers.button_callback,
+            self._callback(user_id, callback_router.encode("start_poll")),
+        )
+
+        data = callback_router.encode("poll", poll_id)
+        while data is not None:
+            await self._handle("button_callback", handlers.button_callback, self._callback(user_id, data))
+            answers = [b for b in self._buttons(user_id) if _route_name(b) == "answer"]
+            data = rnd.choice(answers) if answers else None
+
+        await self._handle(
+            "button_callback", handlers.button_callback,
+            self._callback(user_id, callback_router.encode("show_results")),
+        )
+
+
+def _route_name(data):
+    decoded = callback_router.decode(data)
+    return decoded[0].name if decoded else None
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _db_counts():
+    conn = get_connection(database.DB_NAME)
+    return {
+        "responses": conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0],
+        "clicks": conn.execute("SELECT COUNT(*) FROM clicks").fetchone()[0],
+    }
+
+
+async def run(args, db_path):
+    database.DB_NAME = db_path
+    click_analytics.DB_PATH = db_path
+    database.init_db()
+    create_sample_polls()
+    database.warm_poll_cache()
+    buffer = click_analytics.start_click_buffer()
+
+    bot = StubBot(args.api_latency_ms / 1000)
+    app = Application.builder().bot(bot).build()
+    runner = LoadRunner(bot, app)
+    rnd = random.Random(args.seed)
+    polls = ["poll_1", "poll_2"]
+    limiter = asyncio.Semaphore(args.concurrency)
+    before = _db_counts()
+
+    async def one(user_id):
+        async with limiter:
+            await runner.walk(user_id, rnd.choice(polls), rnd)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(100000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    async_db.shutdown()
+    click_analytics.stop_click_buffer()
+    after = _db_counts()
+    flushes = buffer.stats()["flushes"]
+
+    conn = get_connection(db_path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    close_all()
+
+    all_latencies = sorted(x for values in runner.latencies.values() for x in values)
+    result = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "api_latency_ms": args.api_latency_ms,
+        "updates": len(all_latencies),
+        "errors": runner.errors,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(all_latencies) / elapsed, 1),
+        "latency_ms": {
+            name: {
+                "p50": round(_percentile(values, 0.50) * 1000, 3),
+                "p95": round(_percentile(values, 0.95) * 1000, 3),
+                "p99": round(_percentile(values, 0.99) * 1000, 3),
+            }
+            for name, values in [("all", all_latencies)] + [
+                (name, sorted(values)) for name, values in runner.latencies.items()
+            ]
+        },
+        "db_writes": {
+            "responses": after["responses"] - before["responses"],
+            "clicks": after["clicks"] - before["clicks"],
+            "transactions": (after["responses"] - before["responses"]) + flushes,
+        },
+        "bot_api_calls": dict(bot.calls),
+        "db_size_bytes": os.path.getsize(db_path),
+    }
+    return result
+
+
+def _print(result, previous=None):
+    def delta(path):
+        if previous is None:
+            return ""
+        old = previous
+        new = result
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+            new = new[key]
+        if not isinstance(old, (int, float)) or not old:
+            return ""
+        return f"  ({(new - old) / old * 100:+.1f}%)"
+
+    print(f"Пользователей: {result['users']}, обновлений: {result['updates']}, ошибок: {result['errors']}")
+    print(f"Пропускная способность: {result['updates_per_sec']} обновлений/с{delta(['updates_per_sec'])}")
+    for name, lat in result["latency_ms"].items():
+        print(
+            f"  {name:16} p50 {lat['p50']:8.3f} мс{delta(['latency_ms', name, 'p50'])}"
+            f"  p95 {lat['p95']:8.3f} мс{delta(['latency_ms', name, 'p95'])}"
+            f"  p99 {lat['p99']:8.3f} мс{delta(['latency_ms', name, 'p99'])}"
+        )
+    writes = result["db_writes"]
+    print(
+        f"Записи в БД: ответов {writes['responses']}, кликов {writes['clicks']}, "
+        f"транзакций {writes['transactions']}{delta(['db_writes', 'transactions'])}"
+    )
+    print(f"Размер БД: {result['db_size_bytes'] / 1024:.1f} КБ{delta(['db_size_bytes'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--api-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--no-save", action="store_true", help="не сохранять результат")
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = asyncio.run(run(args, os.path.join(tmp, "bench.db")))
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+    _print(result, previous)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"handlers-{datetime.now():%Y%m%d-%H%M%S}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Результат сохранен: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Скетчи HyperLogLog: точность и скорость против COUNT(DISTINCT)
+
+1. Точность одного скетча на разном числе уникальных пользователей
+   (несколько прогонов с разными ID) и объединения пересекающихся
+   скетчей.
+2. Временная БД с кликами за неделю: скетчи строятся пачками, как при
+   сбросе буфера, затем уникальные пользователи по всем кликам, опросу,
+   вопросу и за неделю считаются точно и по скетчам.
+
+Запуск: python bench_hll.py [--users 50000] [--clicks 300000] [--max 1000000]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import click_analytics
+import database
+import hll
+from db_pool import transaction
+from logger import logger
+
+
+def _errors(cardinality, trials):
+    errors = []
+    for trial in range(trials):
+        sketch = hll.Sketch()
+        first = trial * 10_000_000
+        for user_id in range(first, first + cardinality):
+            sketch.add(user_id)
+        errors.append((sketch.estimate() - cardinality) / cardinality * 100)
+    return errors
+
+
+def accuracy(args):
+    print(f"Скетч {hll.REGISTERS} регистров ({hll.REGISTERS} байт), стандартная ошибка "
+          f"{hll.STANDARD_ERROR * 100:.2f}%, 95%: ±{hll.STANDARD_ERROR * 200:.2f}%")
+    print(f"{'уникальных':>11} {'прогонов':>8} {'ср. |ошибка|':>12} {'макс.':>7} {'в пределах 2σ':>14}")
+    cardinality = 100
+    while cardinality <= args.max:
+        trials = args.trials if cardinality <= 100_000 else 1
+        errors = _errors(cardinality, trials)
+        within = sum(abs(e) <= hll.STANDARD_ERROR * 200 for e in errors)
+        print(f"{cardinality:>11} {trials:>8} {statistics.mean(map(abs, errors)):>11.2f}% "
+              f"{max(map(abs, errors)):>6.2f}% {within:>10}/{trials}")
+        cardinality *= 10
+
+    a, b = hll.Sketch(), hll.Sketch()
+    for user_id in range(0, 60_000):
+        a.add(user_id)
+    for user_id in range(40_000, 100_000):
+        b.add(user_id)
+    merged = hll.Sketch().merge(a).merge(b).estimate()
+    print(f"Объединение 60k и 60k (пересечение 20k): {merged} из 100000 "
+          f"({(merged - 100_000) / 1000:+.2f}%)")
+
+
+def _generate(args, rnd):
+    """Клики за неделю: у пользователей разная активность"""
+    end = datetime(2026, 1, 8, tzinfo=timezone.utc)
+    rows = []
+    for _ in range(args.clicks):
+        user_id = 100000 + int(args.users * rnd.random() ** 2)
+        clicked_at = end - timedelta(seconds=rnd.randint(0, 7 * 86400 - 1))
+        if rnd.random() < 0.6:
+            poll_id = rnd.choice(("poll_1", "poll_2"))
+            question_idx = rnd.randint(0, 4)
+        else:
+            poll_id = question_idx = None
+        rows.append((clicked_at.strftime("%Y-%m-%d %H:%M:%S"), user_id, poll_id, question_idx))
+    rows.sort(key=lambda row: row[0])
+    days = [(end - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(7, -1, -1)]
+    return [(user_id, poll_id, question_idx, at) for at, user_id, poll_id, question_idx in rows], days
+
+
+def _timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - started) / repeat * 1000
+
+
+def dashboard(args, db_path):
+    database.DB_NAME = db_path
+    click_analytics.DB_PATH = db_path
+    database.init_db()
+    rows, days = _generate(args, random.Random(args.seed))
+
+    # Скетчи строятся так же, как при работе бота: пачками после записи
+    update_seconds = 0.0
+    for i in range(0, len(rows), args.batch):
+        with transaction(db_path) as conn:
+            conn.executemany(
+                "INSERT INTO clicks (user_id, button_name, poll_id, question_idx, clicked_at) "
+                "VALUES (?, 'x', ?, ?, ?)",
+                rows[i:i + args.batch]
+            )
+            started = time.perf_counter()
+            hll.update(conn)
+            update_seconds += time.perf_counter() - started
+    sketches, size = conn.execute("SELECT COUNT(*), SUM(LENGTH(registers)) FROM click_sketches").fetchone()
+    print(f"\nКликов: {len(rows)}, обновление скетчей пачками по {args.batch}: "
+          f"{update_seconds / len(rows) * 1e6:.1f} мкс на клик; скетчей {sketches}, {size / 1024:.0f} КБ")
+
+    cases = [
+        ("все клики", "SELECT COUNT(DISTINCT user_id) FROM clicks", (), "all", [""]),
+        ("опрос", "SELECT COUNT(DISTINCT user_id) FROM clicks WHERE poll_id = ?", ("poll_1",),
+         "poll", ["poll_1"]),
+        ("вопрос", "SELECT COUNT(DISTINCT user_id) FROM clicks WHERE poll_id = ? AND question_idx = ?",
+         ("poll_1", 2), "question", ["poll_1:2"]),
+        ("за неделю", "SELECT COUNT(DISTINCT user_id) FROM clicks WHERE clicked_at >= ?", (days[0],),
+         "day", days),
+    ]
+    print(f"{'':10} {'точно':>7} {'мс':>7} {'скетч':>7} {'мс':>7} {'ошибка':>7}")
+    worst = 0.0
+    for label, sql, params, scope, keys in cases:
+        exact, exact_ms = _timed(lambda: conn.execute(sql, params).fetchone()[0], args.repeat)
+        approx, approx_ms = _timed(lambda: hll.count_distinct(conn, scope, keys), args.repeat)
+        error = (approx - exact) / exact * 100
+        worst = max(worst, abs(error))
+        print(f"{label:10} {exact:>7} {exact_ms:>7.2f} {approx:>7} {approx_ms:>7.2f} {error:>+6.2f}%")
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--clicks", type=int, default=300000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--max", type=int, default=1_000_000, help="наибольшее число уникальных в тесте точности")
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+
+    accuracy(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        worst = dashboard(args, os.path.join(tmp, "bench.db"))
+    return 0 if worst <= hll.STANDARD_ERROR * 300 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,136 @@
+"""
+Стоимость вызова логгера для вызывающего кода
+
+Сравнивает прежнюю схему (FileHandler пишет на диск прямо в вызове)
+с очередью и фоновым потоком записи из logger.py: обычная строка на
+каждый клик, выборочный лог кликов и структурированное событие.
+Время меряется в вызывающем потоке (том, где работает цикл событий);
+отдельно показано, сколько фоновый поток дописывал очередь.
+
+--disk-latency-us добавляет задержку к каждой записи на диск (медленный
+диск, переполненный буфер консоли).
+
+Запуск: python bench_logging.py [--calls 50000] [--disk-latency-us 0]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import logger as log_module
+
+
+class SlowFileHandler(logging.FileHandler):
+    """FileHandler с искусственной задержкой записи"""
+
+    def __init__(self, path, latency):
+        super().__init__(path, encoding="utf-8")
+        self.latency = latency
+
+    def emit(self, record):
+        if self.latency:
+            time.sleep(self.latency)
+        super().emit(record)
+
+
+class SlowRotatingHandler(log_module.RotatingFileHandler):
+    """RotatingFileHandler с искусственной задержкой записи"""
+
+    def __init__(self, path, latency, **kwargs):
+        super().__init__(path, encoding="utf-8", **kwargs)
+        self.latency = latency
+
+    def emit(self, record):
+        if self.latency:
+            time.sleep(self.latency)
+        super().emit(record)
+
+
+def _make_logger(name, handler):
+    bench_logger = logging.getLogger(name)
+    bench_logger.handlers = [handler]
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+    return bench_logger
+
+
+def _time_calls(calls, fn):
+    """Время каждого вызова, с"""
+    timings = []
+    for i in range(calls):
+        started = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings
+
+
+def _report(label, timings, extra=""):
+    mean = sum(timings) / len(timings)
+    p99 = timings[int(len(timings) * 0.99)]
+    print(f"  {label:38} {mean * 1e6:8.2f} мкс/вызов  p99 {p99 * 1e6:8.2f} мкс{extra}")
+
+
+def run(args, tmp):
+    latency = args.disk_latency_us / 1e6
+    calls = args.calls
+
+    # Прежняя схема: запись на диск в вызывающем потоке
+    handler = SlowFileHandler(os.path.join(tmp, "sync.log"), latency)
+    handler.setFormatter(logging.Formatter(log_module.TEXT_FORMAT))
+    sync_logger = _make_logger("bench.sync", handler)
+    _report(
+        "FileHandler, строка на клик",
+        _time_calls(calls, lambda i: sync_logger.info(f"Click logged - User: {i}, Button: poll_1")),
+    )
+    handler.close()
+
+    def queued(label, fn, queue_size):
+        file_handler = SlowRotatingHandler(
+            os.path.join(tmp, f"queue-{label}.log"), latency,
+            maxBytes=log_module.LOG_MAX_BYTES, backupCount=1,
+        )
+        file_handler.setFormatter(log_module.JsonFormatter())
+        queue_handler = log_module.DroppingQueueHandler(log_module.queue.Queue(queue_size))
+        listener = log_module.QueueListener(queue_handler.queue, file_handler)
+        bench_logger = _make_logger(f"bench.{label}", queue_handler)
+        # Функции logger.py пишут в модульный logger
+        log_module.logger = bench_logger
+        listener.start()
+        timings = _time_calls(calls, fn(bench_logger))
+        started = time.perf_counter()
+        listener.stop()
+        drain = time.perf_counter() - started
+        file_handler.close()
+        _report(
+            label, timings,
+            f"  дописывание {drain * 1000:7.1f} мс  отброшено {queue_handler.dropped}",
+        )
+
+    queued("очередь, строка на клик",
+           lambda lg: lambda i: lg.info(f"Click logged - User: {i}, Button: poll_1"), calls)
+    queued(f"очередь {log_module.LOG_QUEUE_SIZE}, строка на клик",
+           lambda lg: lambda i: lg.info(f"Click logged - User: {i}, Button: poll_1"),
+           log_module.LOG_QUEUE_SIZE)
+    log_module.LOG_CLICK_SAMPLE = args.sample
+    queued(f"очередь, log_click_event {args.sample:g}",
+           lambda lg: lambda i: log_module.log_click_event(i, "poll_1"), calls)
+    queued("очередь, log_poll_completed (JSON)",
+           lambda lg: lambda i: log_module.log_poll_completed(i, "poll_1", 4), calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=50000)
+    parser.add_argument("--disk-latency-us", type=float, default=0.0)
+    parser.add_argument("--sample", type=float, default=log_module.LOG_CLICK_SAMPLE)
+    args = parser.parse_args()
+
+    print(f"{args.calls} вызовов, задержка диска {args.disk_latency_us:g} мкс")
+    with tempfile.TemporaryDirectory() as tmp:
+        run(args, tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Исходящие запросы под лимитами Telegram: напрямую и через outbound
+
+Поддельный Bot API (fake_telegram) ограничивает сообщения в чат и
+всего и отвечает 429, как Telegram. Пользователи быстро нажимают
+кнопки (ответ на нажатие + изменение сообщения на каждом шаге), а
+администраторы одновременно запрашивают отчеты из двух сообщений.
+
+Напрямую (как обработчики работали раньше) часть запросов падает с
+RetryAfter и экран пользователя остается старым. Через очередь
+outbound лимиты соблюдаются, промежуточные экраны склеиваются, и в
+каждом чате остается последний экран.
+
+Запуск: python bench_outbound.py [--users 50] [--steps 5] [--admins 2]
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+from collections import defaultdict
+
+from aiohttp import web
+from telegram import Bot, CallbackQuery, Message
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+import outbound
+from fake_telegram import FakeBotAPI
+from logger import logger
+
+
+class Recorder:
+    """Задержки до показа экрана и итоговые тексты"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.expected = {}
+        self.lost = 0
+
+    def track(self, priority, future):
+        started = time.monotonic()
+        future.add_done_callback(
+            lambda f: self.latencies[priority].append(time.monotonic() - started)
+        )
+
+
+def _message(bot, chat_id, message_id=1):
+    return Message.de_json({
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": "",
+    }, bot)
+
+
+def _query(bot, ids, chat_id):
+    return CallbackQuery.de_json({
+        "id": str(next(ids)),
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"},
+        "chat_instance": str(chat_id),
+        "data": "x",
+        "message": _message(bot, chat_id).to_dict(),
+    }, bot)
+
+
+async def _user(bot, ids, mode, chat_id, steps, think, rec):
+    for step in range(steps):
+        query = _query(bot, ids, chat_id)
+        text = f"Вопрос {step + 1}/{steps}"
+        rec.expected[chat_id] = text
+        if mode == "direct":
+            started = time.monotonic()
+            try:
+                await query.answer()
+                await query.edit_message_text(text)
+                rec.latencies[outbound.USER].append(time.monotonic() - started)
+            except RetryAfter:
+                rec.lost += 1
+        else:
+            await outbound.answer(query)
+            rec.track(outbound.USER, await outbound.edit_text(query, text))
+        await asyncio.sleep(think)
+
+
+async def _admin(bot, mode, chat_id, reports, rec):
+    message = _message(bot, chat_id)
+    for report in range(reports):
+        parts = [f"Отчет {report + 1}, часть 1", f"Отчет {report + 1}, часть 2"]
+        rec.expected[chat_id] = parts[-1]
+        for part in parts:
+            if mode == "direct":
+                started = time.monotonic()
+                try:
+                    await message.reply_text(part)
+                    rec.latencies[outbound.ADMIN].append(time.monotonic() - started)
+                except RetryAfter:
+                    rec.lost += 1
+            else:
+                rec.track(outbound.ADMIN, await outbound.reply_text(message, part, priority=outbound.ADMIN))
+
+
+async def run(args, mode):
+    api = FakeBotAPI(args.api_latency_ms / 1000, args.chat_limit, args.global_limit)
+    runner = web.AppRunner(api.make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+
+    bot = Bot(
+        "1:fake", base_url=f"http://127.0.0.1:{args.api_port}/bot",
+        request=HTTPXRequest(connection_pool_size=128),
+    )
+    await bot.initialize()
+    outbound.scheduler = outbound.Scheduler()
+    rec = Recorder()
+    ids = itertools.count(1)
+
+    users = [100000 + i for i in range(args.users)]
+    admins = [1 + i for i in range(args.admins)]
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(_admin(bot, mode, chat_id, args.reports, rec) for chat_id in admins),
+        *(_user(bot, ids, mode, chat_id, args.steps, args.think_ms / 1000, rec) for chat_id in users),
+    )
+    if mode == "queued":
+        await outbound.drain(timeout=120)
+    elapsed = time.perf_counter() - started
+
+    await bot.shutdown()
+    await runner.cleanup()
+
+    stale = sum(1 for chat_id, text in rec.expected.items() if not api.texts[chat_id] or api.texts[chat_id][-1] != text)
+    messages = sum(api.calls[m] for m in FakeBotAPI.MESSAGE_METHODS)
+    print(f"{mode}: {elapsed:.2f} с")
+    print(f"  сообщений к Bot API: {messages}, из них 429: {sum(api.flood.values())} {dict(api.flood)}")
+    print(f"  потеряно запросов: {rec.lost}, чатов со старым экраном: {stale}/{len(rec.expected)}")
+    if mode == "queued":
+        stats = outbound.get_outbound_stats()
+        print(f"  склеено изменений: {stats['coalesced']}, повторов после 429: {stats['retried']}")
+    for priority, label in ((outbound.USER, "пользователи"), (outbound.ADMIN, "админы")):
+        values = sorted(rec.latencies[priority])
+        if values:
+            print(
+                f"  {label:12} до показа p50 {values[len(values) // 2] * 1000:7.0f} мс  "
+                f"p99 {values[int(len(values) * 0.99)] * 1000:7.0f} мс"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--think-ms", type=float, default=100.0, help="пауза между нажатиями")
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--reports", type=int, default=5)
+    parser.add_argument("--chat-limit", type=int, default=3)
+    parser.add_argument("--global-limit", type=int, default=30)
+    parser.add_argument("--api-latency-ms", type=float, default=20.0)
+    parser.add_argument("--api-port", type=int, default=8082)
+    args = parser.parse_args()
+    logger.setLevel("CRITICAL")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    outbound.OUTBOUND_ENABLED = True
+    for mode in ("direct", "queued"):
+        asyncio.run(run(args, mode))
+
+
+if __name__ == "__main__":
+    main()
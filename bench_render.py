@@ -0,0 +1,122 @@
+"""
+Аллокации на обновление: экраны с кэшем и без
+
+Пользователи по одному проходят опрос через настоящие обработчики
+(заглушка Bot из bench_handlers). Для каждого обновления считаются
+созданные объекты telegram (кнопки, клавиатуры и т.д.) и пик памяти
+по tracemalloc. Прогон повторяется с выключенным и включенным
+render_cache.
+
+Запуск: python bench_render.py [--users 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import tracemalloc
+from collections import defaultdict
+
+from telegram import TelegramObject
+from telegram.ext import Application
+
+import async_db
+import click_analytics
+import database
+import render_cache
+from bench_handlers import LoadRunner, StubBot
+from db_pool import close_all
+from logger import logger
+from samples import create_sample_polls
+
+_created = [0]
+
+
+def _count_telegram_objects():
+    """Считать создаваемые объекты telegram"""
+    original = TelegramObject.__init__
+
+    def counting_init(self, *args, **kwargs):
+        _created[0] += 1
+        original(self, *args, **kwargs)
+
+    TelegramObject.__init__ = counting_init
+
+
+class AllocRunner(LoadRunner):
+    """LoadRunner, который замеряет аллокации каждого обновления"""
+
+    def __init__(self, bot, app):
+        super().__init__(bot, app)
+        self.objects = defaultdict(list)
+        self.peaks = defaultdict(list)
+
+    async def _handle(self, name, handler, update):
+        created = _created[0]
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        await super()._handle(name, handler, update)
+        self.peaks[name].append(tracemalloc.get_traced_memory()[1] - base)
+        self.objects[name].append(_created[0] - created)
+
+
+async def _run(users, cached):
+    render_cache.RENDER_CACHE = cached
+    render_cache.invalidate()
+    if cached:
+        render_cache.warm()
+
+    bot = StubBot()
+    app = Application.builder().bot(bot).build()
+    runner = AllocRunner(bot, app)
+    rnd = random.Random(42)
+    for i in range(users):
+        # Новые пользователи в каждом прогоне: оба проходят опрос целиком
+        user_id = (200000 if cached else 100000) + i
+        await runner.walk(user_id, rnd.choice(["poll_1", "poll_2"]), rnd)
+    return runner
+
+
+def _report(label, runner):
+    print(label)
+    for name in runner.objects:
+        objects = runner.objects[name]
+        peaks = runner.peaks[name]
+        print(
+            f"  {name:16} объектов telegram {sum(objects) / len(objects):6.1f}/обновление  "
+            f"пик памяти {sum(peaks) / len(peaks) / 1024:7.1f} КБ/обновление"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        database.DB_NAME = db_path
+        click_analytics.DB_PATH = db_path
+        database.init_db()
+        create_sample_polls()
+        database.warm_poll_cache()
+        # Редкие сбросы, чтобы поток записи реже попадал в замеры
+        click_analytics.start_click_buffer(batch_size=10 ** 6, flush_interval=1.0)
+
+        _count_telegram_objects()
+        tracemalloc.start()
+        before = asyncio.run(_run(args.users, cached=False))
+        after = asyncio.run(_run(args.users, cached=True))
+        tracemalloc.stop()
+
+        async_db.shutdown()
+        click_analytics.stop_click_buffer()
+        close_all()
+
+    _report("Без кэша экранов:", before)
+    _report("С кэшем экранов:", after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Постраничные отчеты: скорость первой страницы и кэш
+
+Временная БД с опросом на много вопросов (отчет - десятки страниц):
+
+1. Полный отчет: прежняя сборка строки через += и сборка из строк.
+2. Первая страница: раньше строился весь отчет и резался по 4096
+   символов, теперь страницы строятся по мере просмотра.
+3. Повторный показ и листание из кэша, затем новый ответ (новая версия
+   данных) - отчет строится заново.
+
+Проверяется, что страницы не длиннее 4096 символов, строки не
+разорваны и вместе страницы дают весь отчет.
+
+Запуск: python bench_reports.py [--questions 300] [--responses 500]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import analitycs
+import database
+import handlers  # noqa: F401 - регистрирует кнопки листания
+import report_pages
+from logger import logger
+
+POLL_ID = "big_poll"
+OPTIONS = ["Никогда", "Редко", "Иногда", "Часто", "Всегда"]
+
+
+def _old_report(poll_id):
+    """Прежний generate_report: строка собирается через +="""
+    analysis = analitycs.analyze_responses(poll_id)
+
+    report = "📋 ПОДРОБНЫЙ ОТЧЕТ\n"
+    report += "=" * 40 + "\n\n"
+
+    for q_idx, data in analysis.items():
+        report += f"Вопрос {q_idx + 1}: {data['question_text']}\n"
+        report += f"Всего ответов: {data['total_answered']}\n"
+
+        for answer, count in sorted(data['answer_counts'].items(), key=lambda x: x[1], reverse=True):
+            percentage = (count / data['total_answered'] * 100) if data['total_answered'] > 0 else 0
+            bar_length = int(percentage / 5)
+            bar = "█" * bar_length + "░" * (20 - bar_length)
+            report += f"{answer:20} {bar} {percentage:5.1f}% ({count})\n"
+
+        report += "\n"
+
+    return report
+
+
+def _setup(args, db_path):
+    database.DB_NAME = db_path
+    database.init_db()
+    rnd = random.Random(args.seed)
+    questions = [
+        {"text": f"Вопрос о самочувствии номер {i + 1}: как часто за последний месяц "
+                 f"вы замечали это состояние?", "options": OPTIONS}
+        for i in range(args.questions)
+    ]
+    database.save_poll(POLL_ID, "Большой опрос", "Опрос для бенчмарка", questions)
+    for user_id in range(args.responses):
+        answers = {f"q_{i}": rnd.choice(OPTIONS) for i in range(args.questions)}
+        database.save_response(100000 + user_id, POLL_ID, answers)
+
+
+def _timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - started) / repeat * 1000
+
+
+def _pages():
+    """Все страницы отчета по кнопкам листания"""
+    pages = []
+    number = 0
+    while True:
+        text, markup = report_pages.render_page("poll", POLL_ID, number)
+        pages.append(text)
+        if markup is None or "▶️" not in markup.inline_keyboard[0][-1].text:
+            return pages
+        number += 1
+
+
+def _check(pages):
+    """Страницы не длиннее лимита и вместе дают весь отчет"""
+    lines = [line for line in analitycs.report_lines(POLL_ID) if line.strip()]
+    paged = [line for page in pages for line in page.split("\n") if line.strip()]
+    too_long = [n for n, page in enumerate(pages) if report_pages._length(page) > report_pages.PAGE_LIMIT]
+    return not too_long and paged == lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--responses", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _setup(args, os.path.join(tmp, "bench.db"))
+
+        old, old_ms = _timed(lambda: _old_report(POLL_ID), args.repeat)
+        new, new_ms = _timed(lambda: analitycs.generate_report(POLL_ID), args.repeat)
+        print(f"Вопросов: {args.questions}, ответов: {args.responses}, отчет {len(new)} символов")
+        print(f"Полный отчет: += {old_ms:.2f} мс, из строк {new_ms:.2f} мс, совпадает: {old == new}")
+
+        _, sliced_ms = _timed(lambda: analitycs.generate_report(POLL_ID)[:report_pages.PAGE_LIMIT], args.repeat)
+
+        def first_page():
+            report_pages.invalidate()
+            return report_pages.render_page("poll", POLL_ID)
+        _, first_ms = _timed(first_page, args.repeat)
+        print(f"Первая страница: весь отчет и срез {sliced_ms:.2f} мс, по мере просмотра {first_ms:.2f} мс")
+
+        report_pages.invalidate()
+        started = time.perf_counter()
+        pages = _pages()
+        walk_ms = (time.perf_counter() - started) * 1000
+        _, cached_ms = _timed(lambda: report_pages.render_page("poll", POLL_ID), args.repeat)
+        _, cached_walk_ms = _timed(_pages, args.repeat)
+        print(f"Страниц: {len(pages)}; листание всех: {walk_ms:.2f} мс, из кэша {cached_walk_ms:.2f} мс; "
+              f"повторный показ первой {cached_ms:.3f} мс")
+
+        pages_ok = _check(pages)
+        database.save_response(1, POLL_ID, {f"q_{i}": OPTIONS[0] for i in range(args.questions)})
+        misses = report_pages.stats()["misses"]
+        report_pages.render_page("poll", POLL_ID)
+        rebuilt = report_pages.stats()["misses"] == misses + 1
+        print(f"После нового ответа отчет построен заново: {rebuilt}")
+
+        ok = pages_ok and old == new and rebuilt
+        print(f"Страницы в пределах {report_pages.PAGE_LIMIT} символов и дают весь отчет: {pages_ok}")
+        print(f"Кэш: {report_pages.stats()}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,194 @@
+"""
+Перенос старых кликов в архивы: сохранность отчетов и влияние на запись
+
+Временная БД с кликами за год. Клики пишутся пачками с обновлением
+агрегатов, как из буфера. Затем клики старше срока хранения переносятся
+в архивы по месяцам, а в это время отдельный поток продолжает писать
+новые клики.
+
+Проверяется, что:
+- отчеты по агрегатам (клики по кнопкам и вопросам, воронка, скетчи)
+  и аудитория рассылок не изменились;
+- точное число уникальных пользователей и история пользователя с
+  архивами совпадают с исходными;
+- все клики на месте: в БД и архивах ровно по одному разу;
+- incremental vacuum уменьшает файл БД.
+
+Сравнивается время пачки записи кликов без переноса и во время него.
+
+Запуск: python bench_retention.py [--clicks 300000] [--days 90]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import broadcast
+import click_analytics
+import click_rollups
+import database
+import funnel
+import hll
+import retention
+from db_pool import get_connection, transaction
+from logger import logger
+from samples import create_sample_polls
+
+SAMPLE_USERS = (100000, 100001, 100002, 100500)
+
+
+def _generate(args, rnd):
+    """Клики за год, по времени"""
+    end = datetime.now(timezone.utc)
+    rows = []
+    for _ in range(args.clicks):
+        user_id = 100000 + int(args.users * rnd.random() ** 2)
+        clicked_at = end - timedelta(seconds=rnd.randint(0, 365 * 86400))
+        if rnd.random() < 0.6:
+            poll_id = rnd.choice(("poll_1", "poll_2"))
+            q_idx = rnd.randint(0, 4)
+            button = f"answer_q{q_idx}"
+        else:
+            poll_id = q_idx = None
+            button = rnd.choice(("start_command", "view_results", "view_polls_list"))
+        rows.append((user_id, button, poll_id, q_idx, clicked_at.strftime("%Y-%m-%d %H:%M:%S")))
+    rows.sort(key=lambda row: row[4])
+    return rows
+
+
+def _write(db_path, rows):
+    """Пачка кликов с обновлением агрегатов; время транзакции в мс"""
+    started = time.perf_counter()
+    with transaction(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO clicks (user_id, button_name, poll_id, question_idx, clicked_at) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        click_analytics._after_write(conn)
+    return (time.perf_counter() - started) * 1000
+
+
+def _reports(conn):
+    """Все, что должно пережить перенос (новые клики потока пишутся без опроса)"""
+    return {
+        "by_button": click_analytics.get_clicks_by_button("poll_1"),
+        "by_question": click_analytics.get_clicks_by_question("poll_1"),
+        "audience": {user_id for (user_id,) in conn.execute(
+            broadcast.AUDIENCE_SQL["clicks"],
+            {"users_watermark": click_rollups.get_watermark(conn, click_rollups.USERS_STATE)}
+        ) if user_id < 200000},
+        "funnel": funnel.get_funnel(conn, "poll_1"),
+        "sketch": hll.count_distinct(conn, "poll", ["poll_1"]),
+        "unique": click_analytics.get_unique_users("poll_1", approximate=False),
+        "users": {user_id: (click_analytics.get_user_clicks(user_id, history=True),
+                            click_analytics.get_user_engagement(user_id, history=True))
+                  for user_id in SAMPLE_USERS},
+    }
+
+
+def _writer(db_path, stop, latencies, rnd):
+    """Поток новых кликов (не старше срока хранения)"""
+    while not stop.is_set():
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        rows = [(200000 + rnd.randint(0, 999), "start_command", None, None, now) for _ in range(100)]
+        latencies.append(_write(db_path, rows))
+        time.sleep(0.01)
+
+
+def _write_latencies(db_path, seconds, rnd):
+    stop = threading.Event()
+    latencies = []
+    thread = threading.Thread(target=_writer, args=(db_path, stop, latencies, rnd))
+    thread.start()
+    time.sleep(seconds)
+    stop.set()
+    thread.join()
+    return latencies
+
+
+def _summary(latencies):
+    latencies = sorted(latencies)
+    return (f"{len(latencies)} пачек, медиана {statistics.median(latencies):.1f} мс, "
+            f"p99 {latencies[int(len(latencies) * 0.99)]:.1f} мс, макс. {latencies[-1]:.1f} мс")
+
+
+def _all_ids(conn):
+    ids = [row[0] for row in retention.iter_history(conn, "SELECT id FROM clicks")]
+    return len(ids), len(set(ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clicks", type=int, default=300000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--batch", type=int, default=2000, help="кликов в пачке переноса")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logger.setLevel("WARNING")
+    rnd = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        database.DB_NAME = db_path
+        click_analytics.DB_PATH = db_path
+        retention.CLICK_ARCHIVE_DIR = os.path.join(tmp, "archive")
+        database.init_db()
+        create_sample_polls()
+
+        rows = _generate(args, rnd)
+        for i in range(0, len(rows), 500):
+            _write(db_path, rows[i:i + 500])
+        conn = get_connection(db_path)
+        before = _reports(conn)
+        total_before = _all_ids(conn)[0]
+        size_before = os.path.getsize(db_path)
+        print(f"Кликов: {total_before}, БД {size_before / 1024 / 1024:.1f} МБ, "
+              f"auto_vacuum={retention.vacuum_status(conn)['auto_vacuum']}")
+
+        idle = _write_latencies(db_path, 2, rnd)
+        print(f"Запись без переноса: {_summary(idle)}")
+
+        # Перенос идет, пока поток пишет новые клики
+        stop = threading.Event()
+        busy = []
+        thread = threading.Thread(target=_writer, args=(db_path, stop, busy, rnd))
+        thread.start()
+        started = time.perf_counter()
+        moved = retention.archive_clicks(db_path, args.days, args.batch)
+        archive_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        pages = retention.incremental_vacuum(db_path)
+        vacuum_seconds = time.perf_counter() - started
+        stop.set()
+        thread.join()
+        print(f"Запись во время переноса: {_summary(busy)}")
+
+        total = sum(moved.values())
+        print(f"Перенесено {total} кликов в {len(moved)} архивов за {archive_seconds:.1f} с "
+              f"({total / archive_seconds:.0f} кликов/с); vacuum {pages} страниц за {vacuum_seconds:.2f} с")
+        size_after = os.path.getsize(db_path)
+        print(f"БД: {size_before / 1024 / 1024:.1f} -> {size_after / 1024 / 1024:.1f} МБ")
+
+        after = _reports(conn)
+        same = {key: before[key] == after[key] for key in before}
+        print(f"Отчеты совпадают: {same}")
+        written = len(busy) * 100 + len(idle) * 100
+        count, unique = _all_ids(conn)
+        complete = count == unique == total_before + written
+        print(f"Кликов в БД и архивах: {count} (уникальных id {unique}), ожидалось {total_before + written}")
+
+        started = time.perf_counter()
+        click_analytics.get_user_engagement(SAMPLE_USERS[0], history=True)
+        history_ms = (time.perf_counter() - started) * 1000
+        print(f"История пользователя по {len(moved)} архивам: {history_ms:.1f} мс")
+
+    return 0 if all(same.values()) and complete and size_after < size_before else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
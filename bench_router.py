@@ -0,0 +1,96 @@
+"""
+Микробенчмарк разбора callback_data
+
+Сравнивает прежнюю цепочку if/elif (== и startswith, разбор через
+rsplit) с таблицей маршрутов callback_router на одинаковой смеси
+нажатий: разбор данных и выбор обработчика, без самих обработчиков.
+
+Запуск: python bench_router.py [--presses 200000]
+"""
+import argparse
+import random
+import time
+
+import callback_router
+import handlers  # noqa: F401  регистрирует маршруты
+
+
+def _noop(*args):
+    return args
+
+
+def legacy_dispatch(data):
+    """Разбор, как в button_callback до таблицы маршрутов"""
+    if data == "start_poll":
+        return _noop()
+    elif data == "show_results":
+        return _noop()
+    elif data.startswith("poll_"):
+        return _noop(data[len("poll_"):])
+    elif data.startswith("answer_"):
+        poll_id, question_idx, answer_idx = data[len("answer_"):].rsplit("_", 2)
+        return _noop(poll_id, int(question_idx), int(answer_idx))
+    return None
+
+
+def router_dispatch(data):
+    """Разбор через callback_router (обработчик только выбирается)"""
+    decoded = callback_router.decode(data)
+    if decoded is None:
+        return None
+    route, args = decoded
+    return _noop(route.handler, *args)
+
+
+def _presses(n, seed=42):
+    """Смесь нажатий: в основном ответы, как при прохождении опросов"""
+    rnd = random.Random(seed)
+    presses = []
+    for _ in range(n):
+        kind = rnd.random()
+        poll_id = f"poll_{rnd.randint(1, 20)}"
+        if kind < 0.75:
+            presses.append(("answer", (poll_id, rnd.randint(0, 9), rnd.randint(0, 4))))
+        elif kind < 0.9:
+            presses.append(("poll", (poll_id,)))
+        elif kind < 0.95:
+            presses.append(("start_poll", ()))
+        else:
+            presses.append(("show_results", ()))
+    return presses
+
+
+def _legacy_data(name, args):
+    return callback_router.get_route(name).label(args)
+
+
+def _measure(label, dispatch, payloads):
+    started = time.perf_counter()
+    for data in payloads:
+        dispatch(data)
+    elapsed = time.perf_counter() - started
+    size = sum(len(d.encode("utf-8")) for d in payloads) / len(payloads)
+    print(
+        f"{label:28} {elapsed / len(payloads) * 1e9:7.0f} нс/нажатие  "
+        f"callback_data {size:5.1f} Б в среднем"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--presses", type=int, default=200000)
+    args = parser.parse_args()
+
+    presses = _presses(args.presses)
+    legacy = [_legacy_data(name, a) for name, a in presses]
+    compact = [callback_router.encode(name, *a) for name, a in presses]
+    malformed = ["1a|" + "x" * 20, "answer_poll_1_x_1", "1z", "garbage" * 5] * (args.presses // 4)
+
+    _measure("if/elif, старый формат", legacy_dispatch, legacy)
+    _measure("router, старый формат", router_dispatch, legacy)
+    _measure("router, компактный формат", router_dispatch, compact)
+    _measure("router, некорректные данные", router_dispatch, malformed)
+
+
+if __name__ == "__main__":
+    main()
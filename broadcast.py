@@ -0,0 +1,319 @@
+"""
+Рассылка приглашений пройти опрос
+
+create_broadcast фиксирует список получателей (аудиторию) в таблице
+broadcast_recipients, run_broadcast рассылает приглашения с кнопкой
+опроса через очередь outbound с ограничением скорости.
+
+Аудитории:
+    clicks          все пользователи, которые хоть раз нажимали кнопки
+    non-responders  они же, кроме уже прошедших опрос
+
+Прогресс хранится в БД. Получатели берутся пачками: пачка помечается
+'sending' и фиксируется до отправки, после отправки каждому ставится
+'sent', 'blocked' (бот заблокирован) или 'failed'. При прерывании
+неотправленные возвращаются в 'pending', и run_broadcast продолжает с
+них. Получатели, оставшиеся в 'sending' (запрос ушел, ответа нет, или
+процесс упал), могли уже получить сообщение: повторно им не пишем (не
+больше одного приглашения на человека) и показываем их как unknown.
+Пользователи, заблокировавшие бота в прошлых рассылках, в новые не
+попадают.
+
+Настройки (.env):
+    BROADCAST_RATE   сообщений в секунду (8); вместе с OUTBOUND_RATE
+                     бота должно оставаться меньше 30
+    BROADCAST_BATCH  получателей в пачке (50) - столько могут остаться
+                     unknown, если процесс убит
+"""
+import asyncio
+import os
+import time
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden
+from telegram.request import HTTPXRequest
+
+import callback_router
+import database
+import handlers  # noqa: F401  регистрирует маршруты кнопок
+import outbound
+from click_rollups import USERS_STATE, get_watermark
+from db_pool import get_connection, transaction
+from logger import log_admin_action, logger
+
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "8"))
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "50"))
+
+AUDIENCES = ("clicks", "non-responders")
+
+PENDING, SENDING, SENT, BLOCKED, FAILED, SKIPPED = (
+    "pending", "sending", "sent", "blocked", "failed", "skipped"
+)
+
+# click_users не теряет пользователей при переносе кликов в архивы
+# (retention); хвост - клики, еще не учтенные в click_users
+_CLICK_USERS_SQL = """
+    SELECT user_id FROM click_users
+    UNION SELECT user_id FROM clicks WHERE id > :users_watermark
+"""
+
+AUDIENCE_SQL = {
+    "clicks": _CLICK_USERS_SQL,
+    "non-responders": f"""
+        SELECT user_id FROM ({_CLICK_USERS_SQL})
+        WHERE user_id NOT IN (SELECT user_id FROM responses WHERE poll_id = :poll_id)
+    """,
+}
+
+
+def _default_text(poll):
+    text = f"📋 Новый опрос: {poll['title']}"
+    if poll.get("description"):
+        text += f"\n\n{poll['description']}"
+    return text
+
+
+def create_broadcast(poll_id, audience="non-responders", text=None) -> int:
+    """Создать рассылку и зафиксировать получателей; вернуть ее ID"""
+    if audience not in AUDIENCES:
+        raise ValueError(f"Unknown audience {audience}, expected one of {AUDIENCES}")
+    poll = database.get_poll(poll_id)
+    if not poll:
+        raise ValueError(f"Poll {poll_id} not found")
+
+    with transaction(database.DB_NAME) as conn:
+        broadcast_id = conn.execute(
+            "INSERT INTO broadcasts (poll_id, audience, text) VALUES (?, ?, ?)",
+            (poll_id, audience, text or _default_text(poll))
+        ).lastrowid
+        conn.execute(f"""
+            INSERT INTO broadcast_recipients (broadcast_id, user_id)
+            SELECT :broadcast_id, user_id FROM ({AUDIENCE_SQL[audience]})
+            WHERE user_id NOT IN (
+                SELECT user_id FROM broadcast_recipients WHERE status = 'blocked'
+            )
+        """, {"broadcast_id": broadcast_id, "poll_id": poll_id,
+              "users_watermark": get_watermark(conn, USERS_STATE)})
+        total = conn.execute(
+            "SELECT COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ?", (broadcast_id,)
+        ).fetchone()[0]
+        conn.execute("UPDATE broadcasts SET total = ? WHERE id = ?", (total, broadcast_id))
+
+    log_admin_action(
+        "cli", "broadcast_created", f"id={broadcast_id}, poll_id={poll_id}, total={total}",
+        broadcast_id=broadcast_id, poll_id=poll_id, audience=audience, total=total,
+    )
+    return broadcast_id
+
+
+def get_broadcast(broadcast_id):
+    """Рассылка и число получателей по статусам"""
+    conn = get_connection(database.DB_NAME)
+    row = conn.execute(
+        "SELECT id, poll_id, audience, text, status, total, created_at, finished_at "
+        "FROM broadcasts WHERE id = ?", (broadcast_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    counts = dict(conn.execute(
+        "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+        (broadcast_id,)
+    ).fetchall())
+    return {
+        "id": row[0], "poll_id": row[1], "audience": row[2], "text": row[3],
+        "status": row[4], "total": row[5], "created_at": row[6], "finished_at": row[7],
+        "counts": {status: counts.get(status, 0) for status in (PENDING, SENDING, SENT, BLOCKED, FAILED, SKIPPED)},
+    }
+
+
+def list_broadcasts(limit=20):
+    """Последние рассылки (новые первыми)"""
+    conn = get_connection(database.DB_NAME)
+    ids = conn.execute("SELECT id FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [get_broadcast(row[0]) for row in ids]
+
+
+def _skip_responded(broadcast_id, poll_id):
+    """Не писать тем, кто прошел опрос после создания рассылки"""
+    with transaction(database.DB_NAME) as conn:
+        return conn.execute("""
+            UPDATE broadcast_recipients SET status = 'skipped'
+            WHERE broadcast_id = ? AND status = 'pending'
+              AND user_id IN (SELECT user_id FROM responses WHERE poll_id = ?)
+        """, (broadcast_id, poll_id)).rowcount
+
+
+def _claim(broadcast_id, limit):
+    """Взять пачку получателей: 'sending' фиксируется до отправки"""
+    with transaction(database.DB_NAME) as conn:
+        user_ids = [row[0] for row in conn.execute("""
+            SELECT user_id FROM broadcast_recipients
+            WHERE broadcast_id = ? AND status = 'pending' ORDER BY user_id LIMIT ?
+        """, (broadcast_id, limit))]
+        conn.executemany(
+            "UPDATE broadcast_recipients SET status = 'sending' WHERE broadcast_id = ? AND user_id = ?",
+            [(broadcast_id, user_id) for user_id in user_ids]
+        )
+    return user_ids
+
+
+def _record(broadcast_id, results):
+    """Сохранить итог отправки пачки: [(user_id, status, error)]"""
+    with transaction(database.DB_NAME) as conn:
+        conn.executemany("""
+            UPDATE broadcast_recipients SET status = ?, error = ?, sent_at = CURRENT_TIMESTAMP
+            WHERE broadcast_id = ? AND user_id = ?
+        """, [(status, error, broadcast_id, user_id) for user_id, status, error in results])
+
+
+def _set_status(broadcast_id, status):
+    with transaction(database.DB_NAME) as conn:
+        conn.execute(
+            "UPDATE broadcasts SET status = ?, "
+            "finished_at = CASE WHEN ? = 'done' THEN CURRENT_TIMESTAMP END WHERE id = ?",
+            (status, status, broadcast_id)
+        )
+
+
+def make_bot(token=None, api_url=None) -> Bot:
+    """Bot для рассылки вне процесса бота (TELEGRAM_TOKEN, TELEGRAM_API_URL)"""
+    token = token or os.getenv("TELEGRAM_TOKEN")
+    api_url = api_url or os.getenv("TELEGRAM_API_URL", "")
+    kwargs = {"base_url": f"{api_url.rstrip('/')}/bot"} if api_url else {}
+    return Bot(token, request=HTTPXRequest(connection_pool_size=16), **kwargs)
+
+
+def _release(broadcast_id, user_ids):
+    """Вернуть в очередь получателей, отправка которым не начиналась"""
+    with transaction(database.DB_NAME) as conn:
+        conn.executemany(
+            "UPDATE broadcast_recipients SET status = 'pending' "
+            "WHERE broadcast_id = ? AND user_id = ? AND status = 'sending'",
+            [(broadcast_id, user_id) for user_id in user_ids]
+        )
+
+
+def _outcome(future):
+    """Статус получателя по завершенному запросу"""
+    error = future.exception()
+    if error is None:
+        return SENT, None
+    return (BLOCKED if isinstance(error, Forbidden) else FAILED), str(error)
+
+
+async def _send_batches(broadcast_id, scheduler, send, batch, progress, remaining):
+    """Отправлять пачками до конца очереди получателей"""
+    started = time.monotonic()
+    totals = {SENT: 0, BLOCKED: 0, FAILED: 0}
+    done = 0
+    while True:
+        user_ids = _claim(broadcast_id, batch)
+        if not user_ids:
+            return totals
+        calls_started = set()
+
+        def call(user_id):
+            def start():
+                calls_started.add(user_id)
+                return send(user_id)
+            return start
+
+        futures = {
+            user_id: scheduler.submit(user_id, "sendMessage", call(user_id), priority=outbound.BROADCAST)
+            for user_id in user_ids
+        }
+        try:
+            await asyncio.wait(futures.values())
+        except asyncio.CancelledError:
+            # Прерывание: сохранить известные итоги, неначатых вернуть в
+            # очередь; в 'sending' остаются только запросы "в полете"
+            _record(broadcast_id, [
+                (user_id, *_outcome(future))
+                for user_id, future in futures.items() if future.done() and not future.cancelled()
+            ])
+            _release(broadcast_id, [
+                user_id for user_id, future in futures.items()
+                if not future.done() and user_id not in calls_started
+            ])
+            raise
+        results = [(user_id, *_outcome(future)) for user_id, future in futures.items()]
+        _record(broadcast_id, results)
+
+        for _, status, _ in results:
+            totals[status] += 1
+        done += len(results)
+        remaining = max(remaining - len(results), 0)
+        if progress:
+            elapsed = time.monotonic() - started
+            rate = done / elapsed if elapsed > 0 else 0.0
+            progress({**totals, "remaining": remaining, "rate": rate,
+                      "eta": remaining / rate if rate else None})
+
+
+async def run_broadcast(broadcast_id, bot, scheduler=None, rate=BROADCAST_RATE,
+                        batch=BROADCAST_BATCH, progress=None) -> dict:
+    """Разослать приглашения (продолжает прерванную рассылку)
+
+    scheduler - очередь outbound (по умолчанию своя, с лимитом rate);
+    в процессе бота можно передать outbound.scheduler, тогда рассылка
+    идет с приоритетом ниже ответов пользователям.
+    progress(stats) вызывается после каждой пачки; stats содержит
+    sent, blocked, failed, remaining, rate (сообщений/с) и eta (с).
+    """
+    info = get_broadcast(broadcast_id)
+    if info is None:
+        raise ValueError(f"Broadcast {broadcast_id} not found")
+    if info["status"] == "done":
+        return info
+
+    poll_id = info["poll_id"]
+    text = info["text"]
+    markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📝 Пройти опрос", callback_data=callback_router.encode("poll", poll_id))]
+    ])
+
+    def send(user_id):
+        return bot.send_message(user_id, text, reply_markup=markup)
+
+    unknown = info["counts"][SENDING]
+    if unknown:
+        logger.warning(
+            f"Broadcast {broadcast_id}: {unknown} recipients were being sent when it stopped, not resending"
+        )
+    if info["audience"] == "non-responders":
+        _skip_responded(broadcast_id, poll_id)
+    _set_status(broadcast_id, "running")
+
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = outbound.Scheduler(rate=rate, burst=1, chat_rate=rate, chat_burst=1)
+    try:
+        remaining = get_broadcast(broadcast_id)["counts"][PENDING]
+        totals = await _send_batches(broadcast_id, scheduler, send, batch, progress, remaining)
+    finally:
+        if own_scheduler:
+            # При прерывании не досылать пачку в фоне
+            await scheduler.drain(timeout=0)
+
+    info = get_broadcast(broadcast_id)
+    if not info["counts"][PENDING]:
+        _set_status(broadcast_id, "done")
+        info = get_broadcast(broadcast_id)
+    log_admin_action(
+        "cli", "broadcast_finished",
+        f"id={broadcast_id}, sent={totals[SENT]}, blocked={totals[BLOCKED]}, failed={totals[FAILED]}",
+        broadcast_id=broadcast_id, **totals,
+    )
+    return info
+
+
+def retry_failed(broadcast_id) -> int:
+    """Вернуть получателей с ошибкой отправки в очередь рассылки"""
+    with transaction(database.DB_NAME) as conn:
+        count = conn.execute(
+            "UPDATE broadcast_recipients SET status = 'pending', error = NULL "
+            "WHERE broadcast_id = ? AND status = 'failed'", (broadcast_id,)
+        ).rowcount
+        if count:
+            conn.execute("UPDATE broadcasts SET status = 'running' WHERE id = ?", (broadcast_id,))
+    return count
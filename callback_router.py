@@ -0,0 +1,179 @@
+"""
+Маршрутизация нажатий inline-кнопок
+
+callback_data кодируется компактно: версия формата, код действия и
+поля через "|" (целые - в base36, строки - как есть):
+
+    1a|poll_1|2|3   ответ на опрос poll_1, вопрос 2, вариант 3
+
+Действие регистрируется в таблице один раз (@route), button_callback
+находит обработчик по коду за один поиск в словаре. Кнопки старого
+формата (start_poll, poll_<id>, answer_<poll>_<q>_<a>) из уже
+отправленных сообщений разбираются отдельным декодером.
+"""
+import re
+from dataclasses import dataclass
+from typing import Callable, Optional, Pattern
+
+VERSION = "1"
+SEPARATOR = "|"
+# Ограничение Telegram на callback_data
+MAX_CALLBACK_BYTES = 64
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Регулярные выражения полей: компактный формат и старый
+_FIELD_PATTERNS = {"i": "([0-9a-z]+)", "s": "([^|]+)"}
+_LEGACY_FIELD_PATTERNS = {"i": "([0-9]+)", "s": "(.+)"}
+
+
+@dataclass(frozen=True)
+class Route:
+    """Действие кнопки: код, поля и обработчик
+
+    fields - строка типов полей: "i" - целое >= 0, "s" - строка.
+    legacy - шаблон старого формата, он же имя кнопки в аналитике кликов
+    (для действий без старого формата - name_{0}_{1}...).
+    """
+    code: str
+    name: str
+    fields: str
+    legacy: str
+    handler: Callable
+    pattern: Pattern
+    legacy_pattern: Pattern
+    # Номера целых полей: только их нужно преобразовать после совпадения
+    int_fields: tuple
+
+    def label(self, args) -> str:
+        """Имя кнопки для аналитики (в старом формате callback_data)"""
+        return self.legacy.format(*args)
+
+    def convert(self, groups, base=36) -> list:
+        """Поля из групп совпадения"""
+        args = list(groups)
+        for idx in self.int_fields:
+            args[idx] = int(args[idx], base)
+        return args
+
+
+_routes = {}
+_routes_by_name = {}
+# Маршруты с полями в порядке регистрации (для старого формата)
+_legacy_routes = []
+_legacy_exact = {}
+
+
+def _compile(code, fields, legacy):
+    """Регулярные выражения компактного и старого формата маршрута"""
+    compact = re.escape(VERSION + code) + "".join(
+        re.escape(SEPARATOR) + _FIELD_PATTERNS[kind] for kind in fields
+    )
+    placeholders = "_".join(f"{{{i}}}" for i in range(len(fields)))
+    if fields and not legacy.endswith(placeholders):
+        raise ValueError(f"Legacy format must end with {placeholders!r}: {legacy!r}")
+    prefix = legacy[:len(legacy) - len(placeholders)] if fields else legacy
+    # Жадное первое поле: poll_id сам может содержать "_"
+    old = re.escape(prefix) + "_".join(_LEGACY_FIELD_PATTERNS[kind] for kind in fields)
+    return re.compile(compact), re.compile(old)
+
+
+def route(code, name, fields="", legacy=None):
+    """Зарегистрировать обработчик действия
+
+    Обработчик вызывается как handler(query, context, user_id, *поля).
+    Действие с полями без legacy разбирается только в компактном формате.
+    """
+    if len(code) != 1 or code in _routes:
+        raise ValueError(f"Invalid or duplicate route code: {code!r}")
+    if set(fields) - set(_FIELD_PATTERNS):
+        raise ValueError(f"Unknown field types in {fields!r}")
+    template = legacy or "_".join([name] + [f"{{{i}}}" for i in range(len(fields))])
+    pattern, legacy_pattern = _compile(code, fields, template)
+
+    def decorator(handler):
+        int_fields = tuple(idx for idx, kind in enumerate(fields) if kind == "i")
+        entry = Route(code, name, fields, template, handler, pattern, legacy_pattern, int_fields)
+        _routes[code] = entry
+        _routes_by_name[name] = entry
+        if not fields:
+            _legacy_exact[template] = entry
+        elif legacy:
+            _legacy_routes.append(entry)
+        return handler
+
+    return decorator
+
+
+def _base36(value: int) -> str:
+    if value < 0:
+        raise ValueError(f"Negative callback field: {value}")
+    if value < 36:
+        return _DIGITS[value]
+    digits = []
+    while value:
+        value, rem = divmod(value, 36)
+        digits.append(_DIGITS[rem])
+    return "".join(reversed(digits))
+
+
+def encode(name, *args) -> str:
+    """callback_data для действия name с полями args"""
+    entry = _routes_by_name[name]
+    if len(args) != len(entry.fields):
+        raise ValueError(f"{name} expects {len(entry.fields)} fields, got {len(args)}")
+
+    parts = [VERSION + entry.code]
+    for kind, value in zip(entry.fields, args):
+        if kind == "i":
+            parts.append(_base36(value))
+        else:
+            value = str(value)
+            if not value or SEPARATOR in value:
+                raise ValueError(f"Empty field or separator in callback field: {value!r}")
+            parts.append(value)
+
+    data = SEPARATOR.join(parts)
+    if len(data.encode("utf-8")) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"Callback data longer than {MAX_CALLBACK_BYTES} bytes: {data!r}")
+    return data
+
+
+def _decode_legacy(data) -> Optional[tuple]:
+    """Кнопки старого формата (из сообщений, отправленных до перехода)"""
+    entry = _legacy_exact.get(data)
+    if entry is not None:
+        return entry, ()
+
+    for entry in _legacy_routes:
+        match = entry.legacy_pattern.fullmatch(data)
+        if match:
+            return entry, entry.convert(match.groups(), base=10)
+    return None
+
+
+def decode(data) -> Optional[tuple]:
+    """(Route, поля) по callback_data; None для нераспознанных данных"""
+    if not data or len(data) > MAX_CALLBACK_BYTES:
+        return None
+    if data[0] != VERSION:
+        return _decode_legacy(data)
+
+    entry = _routes.get(data[1:2])
+    if entry is None:
+        return None
+    if not entry.fields:
+        return (entry, ()) if len(data) == 2 else None
+    match = entry.pattern.fullmatch(data)
+    if match is None:
+        return None
+    return entry, entry.convert(match.groups())
+
+
+def get_route(name) -> Route:
+    """Маршрут по имени действия"""
+    return _routes_by_name[name]
+
+
+def routes() -> list:
+    """Зарегистрированные маршруты"""
+    return list(_routes.values())
@@ -1,143 +1,171 @@
 """
 Аналитика кликов и взаимодействий пользователей
 """
-import sqlite3
-from datetime import datetime, timedelta
+import atexit
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 from collections import defaultdict
-from constants import DB_PATH
-from logger import logger
+from typing import Dict, List, Optional
+from database import DB_NAME as DB_PATH
+import click_rollups
+import funnel
+import hll
+import retention
+from click_buffer import ClickBuffer
+from db_pool import get_connection, read_snapshot, transaction
+from logger import log_click_event
+from migrations import migrate
+import metrics
+
+# Считать уникальных пользователей по скетчам HyperLogLog (погрешность
+# ~1.6%, см. hll.py) вместо COUNT(DISTINCT) по clicks
+CLICK_APPROX_DISTINCT = os.getenv("CLICK_APPROX_DISTINCT", "0") == "1"
+
+# Имя кнопки ответа на вопрос (см. handlers.on_answer)
+_ANSWER_BUTTON = re.compile(r"answer_q(\d+)")
+
+# Буфер пакетной записи кликов (включается start_click_buffer)
+_click_buffer = None
 
 def init_clicks_table():
-    """Инициализировать таблицу кликов"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS clicks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            button_name TEXT NOT NULL,
-            callback_data TEXT,
-            poll_id TEXT,
-            question_idx INTEGER,
-            clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
+    """Инициализировать таблицу кликов (применяет миграции схемы)"""
+    migrate(DB_PATH)
 
 def log_click(user_id: int, button_name: str, callback_data: str = None, 
               poll_id: str = None, question_idx: int = None):
     """Логировать клик по кнопке"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        INSERT INTO clicks (user_id, button_name, callback_data, poll_id, question_idx)
-        VALUES (?, ?, ?, ?, ?)
-    """, (user_id, button_name, callback_data, poll_id, question_idx))
-    
-    conn.commit()
-    conn.close()
-    
-    logger.info(f"Click logged - User: {user_id}, Button: {button_name}")
+    if _click_buffer is not None:
+        _click_buffer.put(_click_row(user_id, button_name, callback_data, poll_id, question_idx))
+    else:
+        with transaction(DB_PATH) as conn:
+            conn.execute("""
+                INSERT INTO clicks (user_id, button_name, callback_data, poll_id, question_idx)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, button_name, callback_data, poll_id, question_idx))
+    
+    metrics.CLICKS_LOGGED.inc()
+    log_click_event(user_id, button_name)
+
+def _click_row(user_id, button_name, callback_data, poll_id, question_idx):
+    """Строка для буфера; время фиксируем сейчас, а не в момент сброса пачки"""
+    # Формат CURRENT_TIMESTAMP (UTC)
+    clicked_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    return (user_id, button_name, callback_data, poll_id, question_idx, clicked_at)
+
+def try_log_click(user_id: int, button_name: str, callback_data: str = None,
+                  poll_id: str = None, question_idx: int = None) -> bool:
+    """Поставить клик в буфер без блокировки (из цикла событий)
+
+    False, если буфер выключен или заполнен: тогда нужен log_click в
+    потоке БД, который сам сбросит пачку.
+    """
+    if _click_buffer is None or not _click_buffer.offer(
+        _click_row(user_id, button_name, callback_data, poll_id, question_idx)
+    ):
+        return False
+    metrics.CLICKS_LOGGED.inc()
+    log_click_event(user_id, button_name)
+    return True
+
+def _after_write(conn):
+    """Обновить агрегаты, воронку, скетчи и список пользователей после записи пачки кликов"""
+    click_rollups.compact(conn)
+    click_rollups.update_users(conn)
+    funnel.update(conn)
+    hll.update(conn)
+
+def start_click_buffer(**kwargs) -> ClickBuffer:
+    """Включить буферизованную запись кликов"""
+    global _click_buffer
+    if _click_buffer is None:
+        # Агрегаты обновляются в той же транзакции, что и вставка пачки
+        kwargs.setdefault("after_write", _after_write)
+        _click_buffer = ClickBuffer(DB_PATH, **kwargs)
+        _click_buffer.start()
+        atexit.register(stop_click_buffer)
+    return _click_buffer
+
+def stop_click_buffer():
+    """Записать оставшиеся клики и выключить буфер"""
+    global _click_buffer
+    if _click_buffer is not None:
+        _click_buffer.stop()
+        _click_buffer = None
+
+def flush_clicks():
+    """Немедленно записать клики из буфера в БД"""
+    if _click_buffer is not None:
+        _click_buffer.flush()
+
+def get_click_buffer_stats() -> dict:
+    """Счетчики буфера кликов: глубина очереди, время сброса"""
+    if _click_buffer is None:
+        return {}
+    return _click_buffer.stats()
 
 def get_total_clicks(poll_id: str = None) -> int:
     """Получить общее количество кликов"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    if poll_id:
-        cursor.execute(
-            "SELECT COUNT(*) FROM clicks WHERE poll_id = ?",
-            (poll_id,)
-        )
-    else:
-        cursor.execute("SELECT COUNT(*) FROM clicks")
-    
-    total = cursor.fetchone()[0]
-    conn.close()
+    with read_snapshot(DB_PATH) as conn:
+        counts = click_rollups.counts_by_button(conn, poll_id)
     
-    return total
+    return sum(counts.values())
 
 def get_clicks_by_button(poll_id: str = None) -> dict:
     """Получить количество кликов по каждой кнопке"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with read_snapshot(DB_PATH) as conn:
+        counts = click_rollups.counts_by_button(conn, poll_id)
     
-    if poll_id:
-        cursor.execute("""
-            SELECT button_name, COUNT(*) as count
-            FROM clicks
-            WHERE poll_id = ?
-            GROUP BY button_name
-            ORDER BY count DESC
-        """, (poll_id,))
-    else:
-        cursor.execute("""
-            SELECT button_name, COUNT(*) as count
-            FROM clicks
-            GROUP BY button_name
-            ORDER BY count DESC
-        """)
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    return {button: count for button, count in results}
+    return dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
 
 def get_clicks_by_question(poll_id: str) -> dict:
-    """Получить клики по вопросам"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT question_idx, COUNT(*) as count
-        FROM clicks
-        WHERE poll_id = ? AND question_idx IS NOT NULL
-        GROUP BY question_idx
-        ORDER BY question_idx
-    """, (poll_id,))
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    return {f"q_{q}": count for q, count in results}
+    """Получить клики по вопросам
+
+    По агрегатам кнопок answer_q<N> (так логируются ответы, см. handlers.on_answer),
+    поэтому учитываются и клики, перенесенные в архивы.
+    """
+    with read_snapshot(DB_PATH) as conn:
+        counts = click_rollups.counts_by_button(conn, poll_id)
+    
+    questions = {}
+    for button, count in counts.items():
+        match = _ANSWER_BUTTON.fullmatch(button)
+        if match:
+            questions[int(match.group(1))] = count
+    
+    return {f"q_{q}": questions[q] for q in sorted(questions)}
 
 def get_clicks_timeline(poll_id: str = None, days: int = 7) -> list:
     """Получить график кликов по времени"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     from_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
     
-    if poll_id:
-        cursor.execute("""
-            SELECT DATE(clicked_at) as date, COUNT(*) as count
-            FROM clicks
-            WHERE poll_id = ? AND clicked_at >= ?
-            GROUP BY DATE(clicked_at)
-            ORDER BY date
-        """, (poll_id, from_date))
-    else:
-        cursor.execute("""
-            SELECT DATE(clicked_at) as date, COUNT(*) as count
-            FROM clicks
-            WHERE clicked_at >= ?
-            GROUP BY DATE(clicked_at)
-            ORDER BY date
-        """, (from_date,))
+    with read_snapshot(DB_PATH) as conn:
+        counts = click_rollups.counts_by_bucket(conn, "day", from_date, poll_id)
     
-    results = cursor.fetchall()
-    conn.close()
+    return [{"date": date, "clicks": counts[date]} for date in sorted(counts)]
+
+def get_clicks_hourly(poll_id: str = None, hours: int = 24) -> list:
+    """Получить почасовой график кликов (время в UTC)"""
+    from_hour = (datetime.now(timezone.utc) - timedelta(hours=hours)).strftime("%Y-%m-%d %H:00")
     
-    return [{"date": date, "clicks": count} for date, count in results]
+    with read_snapshot(DB_PATH) as conn:
+        counts = click_rollups.counts_by_bucket(conn, "hour", from_hour, poll_id)
+    
+    return [{"hour": hour, "clicks": counts[hour]} for hour in sorted(counts)]
 
-def get_user_clicks(user_id: int) -> dict:
-    """Получить клики пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def get_user_clicks(user_id: int, history: bool = False) -> dict:
+    """Получить клики пользователя (history - вместе с архивами)"""
+    if history:
+        buttons = dict(retention.iter_history(
+            get_connection(DB_PATH), "SELECT id, button_name FROM clicks WHERE user_id = ?", (user_id,)
+        ))
+        counts = defaultdict(int)
+        for button in buttons.values():
+            counts[button] += 1
+        return dict(counts)
+    
+    cursor = get_connection(DB_PATH).cursor()
     
     cursor.execute("""
         SELECT button_name, COUNT(*) as count
@@ -147,121 +175,217 @@ def get_user_clicks(user_id: int) -> dict:
     """, (user_id,))
     
     results = cursor.fetchall()
-    conn.close()
     
     return {button: count for button, count in results}
 
 def get_most_clicked_buttons(limit: int = 10) -> list:
     """Получить самые кликаемые кнопки"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    buttons = get_clicks_by_button()
     
-    cursor.execute("""
-        SELECT button_name, COUNT(*) as count
-        FROM clicks
-        GROUP BY button_name
-        ORDER BY count DESC
-        LIMIT ?
-    """, (limit,))
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    return [{"button": button, "clicks": count} for button, count in results]
+    return [
+        {"button": button, "clicks": count}
+        for button, count in list(buttons.items())[:limit]
+    ]
+
+def compact_clicks() -> int:
+    """Свернуть еще не учтенные клики в агрегаты, воронку, скетчи и список пользователей"""
+    with transaction(DB_PATH) as conn:
+        folded = click_rollups.compact(conn)
+        click_rollups.update_users(conn)
+        funnel.update(conn)
+        hll.update(conn)
+    return folded
+
+def _funnel_steps(poll_funnel: dict) -> dict:
+    """Воронка: число сессий, дошедших до ответа на каждый вопрос"""
+    return {f"Question {step['step']}": step["sessions"] for step in poll_funnel["steps"][1:]}
+
+def _approximate(approximate):
+    return CLICK_APPROX_DISTINCT if approximate is None else approximate
+
+def _unique_users(conn, poll_id: str = None, approximate: bool = False) -> int:
+    """Число уникальных пользователей, кликавших по кнопкам"""
+    if approximate:
+        return hll.count_distinct(conn, "poll", [poll_id]) if poll_id else hll.count_distinct(conn, "all")
+    if retention.has_archives(conn):
+        # Старые клики в архивах: объединяем пользователей всех источников
+        if poll_id:
+            rows = retention.iter_history(
+                conn, "SELECT DISTINCT user_id FROM clicks WHERE poll_id = ?", (poll_id,)
+            )
+        else:
+            rows = retention.iter_history(conn, "SELECT DISTINCT user_id FROM clicks")
+        return len({user_id for (user_id,) in rows})
+    if poll_id:
+        row = conn.execute(
+            "SELECT COUNT(DISTINCT user_id) FROM clicks WHERE poll_id = ?", (poll_id,)
+        ).fetchone()
+    else:
+        row = conn.execute("SELECT COUNT(DISTINCT user_id) FROM clicks").fetchone()
+    return row[0]
 
 def get_click_funnel(poll_id: str) -> dict:
     """Получить воронку (funnel) кликов - где теряются пользователи"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Клики по вопросам
-    cursor.execute("""
-        SELECT question_idx, COUNT(DISTINCT user_id) as users
-        FROM clicks
-        WHERE poll_id = ? AND question_idx IS NOT NULL
-        GROUP BY question_idx
-        ORDER BY question_idx
-    """, (poll_id,))
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    funnel = {}
-    for q_idx, users in results:
-        funnel[f"Question {q_idx + 1}"] = users
-    
-    return funnel
+    with read_snapshot(DB_PATH) as conn:
+        return _funnel_steps(funnel.get_funnel(conn, poll_id))
+
+def get_question_unique_users(poll_id: str) -> dict:
+    """Уникальные пользователи, кликавшие по кнопкам каждого вопроса
+
+    Считается по скетчам (±3.3% в 95% случаев). Это не воронка: сюда
+    попадают и повторные нажатия на старые вопросы, и прохождения за
+    несколько сессий.
+    """
+    with read_snapshot(DB_PATH) as conn:
+        keys = hll.question_keys(conn, poll_id)
+        return {
+            f"Question {int(key.rsplit(':', 1)[1]) + 1}": hll.count_distinct(conn, "question", [key])
+            for key in keys
+        }
+
+def get_poll_funnel(poll_id: str) -> dict:
+    """Воронка опроса с конверсией и временем шагов (см. funnel.get_funnel)
+
+    Считается по агрегатам: отстает от кликов не больше, чем на один
+    сброс буфера.
+    """
+    with read_snapshot(DB_PATH) as conn:
+        return funnel.get_funnel(conn, poll_id)
 
-def get_average_clicks_per_user(poll_id: str = None) -> float:
+def get_unique_users(poll_id: str = None, approximate: bool = None) -> int:
+    """Число уникальных пользователей (approximate - по скетчам, ±3.3%)"""
+    with read_snapshot(DB_PATH) as conn:
+        return _unique_users(conn, poll_id, _approximate(approximate))
+
+def get_daily_unique_users(days: int = 7) -> dict:
+    """Уникальные пользователи по дням и за весь период (по скетчам, UTC)
+
+    Итог за период - объединение скетчей дней, а не сумма: пользователь,
+    заходивший несколько дней, учитывается один раз.
+    """
+    today = datetime.now(timezone.utc).date()
+    dates = [(today - timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+    with read_snapshot(DB_PATH) as conn:
+        daily = [{"date": date, "users": hll.count_distinct(conn, "day", [date])} for date in dates]
+        total = hll.count_distinct(conn, "day", dates)
+    return {"days": daily, "total": total}
+
+def get_average_clicks_per_user(poll_id: str = None, approximate: bool = None) -> float:
     """Получить среднее количество кликов на пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    if poll_id:
-        cursor.execute("""
-            SELECT COUNT(DISTINCT user_id), COUNT(*)
-            FROM clicks
-            WHERE poll_id = ?
-        """, (poll_id,))
-    else:
-        cursor.execute("""
-            SELECT COUNT(DISTINCT user_id), COUNT(*)
-            FROM clicks
-        """)
-    
-    result = cursor.fetchone()
-    conn.close()
+    with read_snapshot(DB_PATH) as conn:
+        total = sum(click_rollups.counts_by_button(conn, poll_id).values())
+        users = _unique_users(conn, poll_id, _approximate(approximate))
     
-    if result[0] == 0:
+    if users == 0:
         return 0
     
-    return round(result[1] / result[0], 2)
+    return round(total / users, 2)
+
+@dataclass(frozen=True)
+class ClickStatistics:
+    """Согласованный срез статистики кликов на один момент времени"""
+    poll_id: Optional[str]
+    total_clicks: int
+    clicks_by_button: Dict[str, int]
+    timeline: List[dict]
+    most_clicked: List[dict]
+    unique_users: int
+    avg_clicks_per_user: float
+    funnel: Dict[str, int] = field(default_factory=dict)
+    approximate: bool = False
+    # Воронка опроса с конверсией и временем шагов (см. funnel.get_funnel)
+    poll_funnel: Optional[dict] = None
+
+def get_click_snapshot(poll_id: str = None, days: int = 7, top: int = 5,
+                       approximate: bool = None) -> ClickStatistics:
+    """Посчитать всю статистику кликов в одной транзакции чтения"""
+    from_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    approximate = _approximate(approximate)
+    
+    with read_snapshot(DB_PATH) as conn:
+        by_button = click_rollups.counts_by_button(conn, poll_id)
+        by_day = click_rollups.counts_by_bucket(conn, "day", from_date, poll_id)
+        unique_users = _unique_users(conn, poll_id, approximate)
+        poll_funnel = funnel.get_funnel(conn, poll_id) if poll_id else None
+    
+    clicks_by_button = dict(sorted(by_button.items(), key=lambda item: (-item[1], item[0])))
+    total = sum(clicks_by_button.values())
+    
+    return ClickStatistics(
+        poll_id=poll_id,
+        total_clicks=total,
+        clicks_by_button=clicks_by_button,
+        timeline=[{"date": date, "clicks": by_day[date]} for date in sorted(by_day)],
+        most_clicked=[
+            {"button": button, "clicks": count}
+            for button, count in list(clicks_by_button.items())[:top]
+        ],
+        unique_users=unique_users,
+        avg_clicks_per_user=round(total / unique_users, 2) if unique_users else 0,
+        funnel=_funnel_steps(poll_funnel) if poll_funnel else {},
+        approximate=approximate,
+        poll_funnel=poll_funnel,
+    )
 
 def get_click_statistics(poll_id: str = None) -> dict:
     """Получить полную статистику кликов"""
+    stats = get_click_snapshot(poll_id)
     return {
-        "total_clicks": get_total_clicks(poll_id),
-        "clicks_by_button": get_clicks_by_button(poll_id),
-        "timeline": get_clicks_timeline(poll_id),
-        "most_clicked": get_most_clicked_buttons(5),
-        "avg_clicks_per_user": get_average_clicks_per_user(poll_id)
+        "total_clicks": stats.total_clicks,
+        "clicks_by_button": stats.clicks_by_button,
+        "timeline": stats.timeline,
+        "most_clicked": stats.most_clicked,
+        "avg_clicks_per_user": stats.avg_clicks_per_user
     }
 
-def format_click_report(poll_id: str = None) -> str:
+def click_report_lines(poll_id: str = None, stats: ClickStatistics = None):
+    """Строки отчета по кликам (данные читаются сразу, строки - по мере чтения)"""
+    if stats is None:
+        stats = get_click_snapshot(poll_id)
+    return _click_report_lines(stats)
+
+def _click_report_lines(stats: ClickStatistics):
+    yield "📊 АНАЛИТИКА КЛИКОВ"
+    yield ""
+    yield f"Всего кликов: {stats.total_clicks}"
+    yield f"Среднее кликов на пользователя: {stats.avg_clicks_per_user}"
+    yield ""
+    
+    yield "🔘 Топ кнопок:"
+    for button, count in list(stats.clicks_by_button.items())[:10]:
+        percentage = (count / stats.total_clicks * 100) if stats.total_clicks > 0 else 0
+        yield f"  {button}: {count} ({percentage:.1f}%)"
+
+def format_click_report(poll_id: str = None, stats: ClickStatistics = None) -> str:
     """Отформатировать отчет по кликам"""
-    stats = get_click_statistics(poll_id)
-    
-    report = "📊 АНАЛИТИКА КЛИКОВ\n\n"
-    report += f"Всего кликов: {stats['total_clicks']}\n"
-    report += f"Среднее кликов на пользователя: {stats['avg_clicks_per_user']}\n\n"
-    
-    report += "🔘 Топ кнопок:\n"
-    for button, count in list(stats['clicks_by_button'].items())[:10]:
-        percentage = (count / stats['total_clicks'] * 100) if stats['total_clicks'] > 0 else 0
-        report += f"  {button}: {count} ({percentage:.1f}%)\n"
-    
-    return report
+    return "\n".join(click_report_lines(poll_id, stats)) + "\n"
 
-def get_user_engagement(user_id: int) -> dict:
-    """Получить вовлеченность пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Количество кликов
-    cursor.execute("SELECT COUNT(*) FROM clicks WHERE user_id = ?", (user_id,))
-    total_clicks = cursor.fetchone()[0]
+def get_user_engagement(user_id: int, history: bool = False) -> dict:
+    """Получить вовлеченность пользователя (history - вместе с архивами)"""
+    cursor = get_connection(DB_PATH).cursor()
+    
+    if history:
+        clicked = dict(retention.iter_history(
+            cursor.connection, "SELECT id, clicked_at FROM clicks WHERE user_id = ?", (user_id,)
+        ))
+        total_clicks = len(clicked)
+        first_click = min(clicked.values(), default=None)
+        last_click = max(clicked.values(), default=None)
+    else:
+        # Количество кликов
+        cursor.execute("SELECT COUNT(*) FROM clicks WHERE user_id = ?", (user_id,))
+        total_clicks = cursor.fetchone()[0]
+        
+        # Первый и последний клик
+        cursor.execute("""
+            SELECT MIN(clicked_at), MAX(clicked_at) FROM clicks WHERE user_id = ?
+        """, (user_id,))
+        first_click, last_click = cursor.fetchone()
     
     # Количество опросов пройденных
     cursor.execute("SELECT COUNT(*) FROM responses WHERE user_id = ?", (user_id,))
     total_polls = cursor.fetchone()[0]
     
-    # Первый и последний клик
-    cursor.execute("""
-        SELECT MIN(clicked_at), MAX(clicked_at) FROM clicks WHERE user_id = ?
-    """, (user_id,))
-    first_click, last_click = cursor.fetchone()
-    
-    conn.close()
     
     return {
         "user_id": user_id,
@@ -0,0 +1,180 @@
+"""
+Буферизованная запись кликов (group commit)
+
+Клики складываются в ограниченную очередь в памяти, а фоновый поток
+пишет их пачками через executemany в одной транзакции: каждые
+batch_size строк или каждые flush_interval секунд, что наступит раньше.
+В той же транзакции вызывается after_write(conn) - например, свертка
+кликов в агрегаты.
+"""
+import os
+import queue
+import threading
+import time
+
+from db_pool import transaction
+from logger import logger
+
+CLICK_BATCH_SIZE = int(os.getenv("CLICK_BATCH_SIZE", "500"))
+CLICK_FLUSH_MS = int(os.getenv("CLICK_FLUSH_MS", "200"))
+CLICK_QUEUE_SIZE = int(os.getenv("CLICK_QUEUE_SIZE", "20000"))
+
+INSERT_CLICKS_SQL = """
+    INSERT INTO clicks (user_id, button_name, callback_data, poll_id, question_idx, clicked_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+class ClickBuffer:
+    """Ограниченная очередь кликов с фоновым сбросом в SQLite"""
+
+    def __init__(self, db_path, batch_size=CLICK_BATCH_SIZE,
+                 flush_interval=CLICK_FLUSH_MS / 1000, max_queue=CLICK_QUEUE_SIZE,
+                 put_timeout=0.05, after_write=None):
+        self.db_path = db_path
+        self.after_write = after_write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Счетчики
+        self.enqueued = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.backpressure_events = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        """Запустить фоновый поток сброса"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="click-flusher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Остановить поток и записать все, что осталось в очереди"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def put(self, row):
+        """Добавить клик в очередь
+
+        Если очередь заполнена, вызывающий поток сам сбрасывает пачку
+        в БД (backpressure) и повторяет попытку.
+        """
+        while True:
+            try:
+                self._queue.put(row, timeout=self.put_timeout)
+                break
+            except queue.Full:
+                with self._stats_lock:
+                    self.backpressure_events += 1
+                self._flush_batch()
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self.enqueued += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def offer(self, row) -> bool:
+        """Добавить клик без ожидания; False, если очередь заполнена"""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            return False
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self.enqueued += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def flush(self):
+        """Записать в БД все клики из очереди"""
+        while self._flush_batch():
+            pass
+
+    def _flush_batch(self):
+        """Забрать из очереди до batch_size строк и записать их"""
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return self._write(batch)
+
+    def _write(self, batch):
+        """Записать пачку одной транзакцией; вернуть число строк"""
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            with transaction(self.db_path) as conn:
+                conn.executemany(INSERT_CLICKS_SQL, batch)
+                if self.after_write is not None:
+                    self.after_write(conn)
+        except Exception as e:
+            logger.error(f"Click flush failed, {len(batch)} clicks lost: {e}")
+            return 0
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._stats_lock:
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+            self.last_flush_ms = elapsed_ms
+            self._total_flush_ms += elapsed_ms
+            if elapsed_ms > self.max_flush_ms:
+                self.max_flush_ms = elapsed_ms
+        return len(batch)
+
+    def _run(self):
+        """Цикл фонового потока"""
+        while not self._stop.is_set():
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+
+            # Даем пачке набраться до batch_size или до конца интервала
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._write(batch)
+
+    def stats(self) -> dict:
+        """Счетчики очереди и сброса"""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "flushed_rows": self.flushed_rows,
+            "flushes": self.flushes,
+            "backpressure_events": self.backpressure_events,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
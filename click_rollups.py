@@ -0,0 +1,173 @@
+"""
+Почасовые и посуточные агрегаты кликов
+
+Клики сворачиваются в click_rollups (ключ: гранулярность, интервал,
+poll_id, button_name) при каждом сбросе буфера кликов. Прогресс
+хранится в rollup_state как id последнего учтенного клика, поэтому
+запросы читают агрегаты плюс только "хвост" еще не свернутых кликов.
+"""
+from collections import Counter
+
+ROLLUP_STATE = "rollups"
+USERS_STATE = "users"
+
+# Гранулярность -> формат strftime для начала интервала
+GRANULARITIES = (
+    ("hour", "%Y-%m-%d %H:00"),
+    ("day", "%Y-%m-%d"),
+)
+
+_FOLD_SQL = """
+    INSERT INTO click_rollups (granularity, bucket, poll_id, button_name, count)
+    SELECT ?, strftime(?, clicked_at), COALESCE(poll_id, ''), button_name, COUNT(*)
+    FROM clicks
+    WHERE id > ? AND id <= ?
+    GROUP BY 2, 3, 4
+    ON CONFLICT (granularity, bucket, poll_id, button_name)
+    DO UPDATE SET count = count + excluded.count
+"""
+
+
+def get_watermark(conn, name=ROLLUP_STATE) -> int:
+    """id последнего клика, учтенного обработчиком name"""
+    row = conn.execute(
+        "SELECT last_click_id FROM rollup_state WHERE name = ?", (name,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def set_watermark(conn, last_click_id, name=ROLLUP_STATE):
+    """Сохранить id последнего учтенного клика"""
+    conn.execute("""
+        INSERT INTO rollup_state (name, last_click_id) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET last_click_id = excluded.last_click_id
+    """, (name, last_click_id))
+
+
+def check_full_history(conn, name):
+    """Запретить пересчет обработчика name с нуля, если часть кликов в архивах
+
+    clicks тогда содержит не всю историю, и пересчет молча потерял бы
+    перенесенные месяцы (см. retention).
+    """
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'click_archives'"
+    ).fetchone():
+        return
+    if conn.execute("SELECT 1 FROM click_archives LIMIT 1").fetchone():
+        raise RuntimeError(
+            f"Cannot rebuild '{name}' from clicks: older clicks are archived (see retention)"
+        )
+
+
+def compact(conn) -> int:
+    """Свернуть новые клики в агрегаты (внутри транзакции вызывающего)
+
+    Возвращает число учтенных кликов.
+    """
+    last_id = get_watermark(conn)
+    max_id = conn.execute("SELECT MAX(id) FROM clicks").fetchone()[0] or 0
+    if max_id <= last_id:
+        return 0
+    if not last_id:
+        check_full_history(conn, ROLLUP_STATE)
+
+    for granularity, fmt in GRANULARITIES:
+        conn.execute(_FOLD_SQL, (granularity, fmt, last_id, max_id))
+    set_watermark(conn, max_id)
+    return max_id - last_id
+
+
+_MERGE_USERS_SQL = """
+    INSERT INTO click_users (user_id, first_click_at, last_click_at) VALUES (?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET
+        first_click_at = MIN(first_click_at, excluded.first_click_at),
+        last_click_at = MAX(last_click_at, excluded.last_click_at)
+"""
+
+_USERS_SQL = """
+    SELECT user_id, MIN(clicked_at), MAX(clicked_at) FROM clicks
+    WHERE id > ? AND id <= ?
+    GROUP BY user_id
+"""
+
+
+def merge_users(conn, rows):
+    """Учесть в click_users строки (user_id, первый клик, последний клик)"""
+    conn.executemany(_MERGE_USERS_SQL, rows)
+
+
+def update_users(conn) -> int:
+    """Добавить в click_users пользователей новых кликов (внутри транзакции вызывающего)
+
+    click_users - все, кто когда-либо нажимал кнопки: перенос старых
+    кликов в архивы (retention) эту таблицу не трогает.
+    """
+    last_id = get_watermark(conn, USERS_STATE)
+    max_id = conn.execute("SELECT MAX(id) FROM clicks").fetchone()[0] or 0
+    if max_id <= last_id:
+        return 0
+    if not last_id:
+        check_full_history(conn, USERS_STATE)
+
+    merge_users(conn, conn.execute(_USERS_SQL, (last_id, max_id)).fetchall())
+    set_watermark(conn, max_id, USERS_STATE)
+    return max_id - last_id
+
+
+def _poll_filter(poll_id, column="poll_id"):
+    """Условие и параметры фильтра по опросу"""
+    if poll_id:
+        return f" AND {column} = ?", (poll_id,)
+    return "", ()
+
+
+def counts_by_button(conn, poll_id=None) -> Counter:
+    """Клики по кнопкам: агрегаты + хвост"""
+    last_id = get_watermark(conn)
+    cond, params = _poll_filter(poll_id)
+    # Унарный + отключает индекс опроса: хвост короткий, его нужно брать
+    # по диапазону id, а не перебором всех кликов опроса (как в hll.py)
+    tail_cond, _ = _poll_filter(poll_id, "+poll_id")
+
+    counts = Counter()
+    for button, count in conn.execute(f"""
+        SELECT button_name, SUM(count) FROM click_rollups
+        WHERE granularity = 'day'{cond}
+        GROUP BY button_name
+    """, params):
+        counts[button] += count
+
+    for button, count in conn.execute(f"""
+        SELECT button_name, COUNT(*) FROM clicks
+        WHERE id > ?{tail_cond}
+        GROUP BY button_name
+    """, (last_id, *params)):
+        counts[button] += count
+
+    return counts
+
+
+def counts_by_bucket(conn, granularity, since, poll_id=None) -> Counter:
+    """Клики по интервалам начиная с since: агрегаты + хвост"""
+    fmt = dict(GRANULARITIES)[granularity]
+    last_id = get_watermark(conn)
+    cond, params = _poll_filter(poll_id)
+    tail_cond, _ = _poll_filter(poll_id, "+poll_id")
+
+    counts = Counter()
+    for bucket, count in conn.execute(f"""
+        SELECT bucket, SUM(count) FROM click_rollups
+        WHERE granularity = ? AND bucket >= ?{cond}
+        GROUP BY bucket
+    """, (granularity, since, *params)):
+        counts[bucket] += count
+
+    for bucket, count in conn.execute(f"""
+        SELECT strftime(?, clicked_at), COUNT(*) FROM clicks
+        WHERE id > ? AND +clicked_at >= ?{tail_cond}
+        GROUP BY 1
+    """, (fmt, last_id, since, *params)):
+        counts[bucket] += count
+
+    return counts
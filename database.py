@@ -1,120 +1,262 @@
-import sqlite3
 import json
 from datetime import datetime
+import answer_codec
+import metrics
+import tallies
+from db_pool import get_connection, transaction
+from migrations import migrate
+from poll_cache import PollCache
+from responded_index import RespondedIndex
 
 DB_NAME = "bot_data.db"
 
+# Функции poll_id -> None, вызываемые при изменении опросов
+_poll_listeners = []
+
 def init_db():
-    """Инициализация базы данных"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    # Таблица для опросов
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS polls (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            poll_id TEXT UNIQUE,
-            title TEXT NOT NULL,
-            description TEXT,
-            questions TEXT NOT NULL,
-            image_url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Таблица для ответов пользователей
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS responses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            poll_id TEXT NOT NULL,
-            answers TEXT NOT NULL,
-            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (poll_id) REFERENCES polls(poll_id)
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
+    """Инициализация базы данных (применяет миграции схемы)"""
+    migrate(DB_NAME)
 
 def save_poll(poll_id, title, description, questions, image_url=None):
     """Сохранить опрос в БД"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        INSERT INTO polls (poll_id, title, description, questions, image_url)
-        VALUES (?, ?, ?, ?, ?)
-    """, (poll_id, title, description, json.dumps(questions), image_url))
+    with transaction(DB_NAME) as conn:
+        conn.execute("""
+            INSERT INTO polls (poll_id, title, description, questions, image_url)
+            VALUES (?, ?, ?, ?, ?)
+        """, (poll_id, title, description, json.dumps(questions), image_url))
+        answer_codec.register_layout(conn, poll_id, answer_codec.poll_options(questions))
     
-    conn.commit()
-    conn.close()
+    _poll_cache.invalidate(poll_id)
+    _notify_poll_changed(poll_id)
 
-def get_poll(poll_id):
-    """Получить опрос по ID"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+def on_poll_changed(listener):
+    """Подписаться на изменения опросов (сброс производных кэшей)"""
+    _poll_listeners.append(listener)
+
+def _notify_poll_changed(poll_id=None):
+    for listener in _poll_listeners:
+        listener(poll_id)
+
+def _poll_from_row(poll):
+    """Собрать словарь опроса из строки таблицы polls"""
+    return {
+        "id": poll[0],
+        "poll_id": poll[1],
+        "title": poll[2],
+        "description": poll[3],
+        "questions": json.loads(poll[4]),
+        "image_url": poll[5],
+        "created_at": poll[6]
+    }
+
+def _load_poll(poll_id):
+    """Загрузить опрос из БД в обход кэша"""
+    conn = get_connection(DB_NAME)
     
-    cursor.execute("SELECT * FROM polls WHERE poll_id = ?", (poll_id,))
-    poll = cursor.fetchone()
-    conn.close()
+    poll = conn.execute(
+        "SELECT * FROM polls WHERE poll_id = ?", (poll_id,)
+    ).fetchone()
     
     if poll:
-        return {
-            "id": poll[0],
-            "poll_id": poll[1],
-            "title": poll[2],
-            "description": poll[3],
-            "questions": json.loads(poll[4]),
-            "image_url": poll[5],
-            "created_at": poll[6]
-        }
+        return _poll_from_row(poll)
     return None
 
-def save_response(user_id, poll_id, answers):
-    """Сохранить ответы пользователя"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+_poll_cache = PollCache(_load_poll)
+
+def get_poll(poll_id):
+    """Получить опрос по ID (неизменяемый объект из кэша)"""
+    return _poll_cache.get(poll_id)
+
+def peek_poll(poll_id):
+    """Опрос из кэша без запроса к БД или None"""
+    return _poll_cache.peek(poll_id)
+
+def warm_poll_cache():
+    """Загрузить все опросы в кэш одним запросом (при старте бота)"""
+    conn = get_connection(DB_NAME)
     
-    cursor.execute("""
-        INSERT INTO responses (user_id, poll_id, answers)
-        VALUES (?, ?, ?)
-    """, (user_id, poll_id, json.dumps(answers)))
+    polls = conn.execute("SELECT * FROM polls").fetchall()
+    for poll in polls:
+        _poll_cache.put(poll[1], _poll_from_row(poll))
     
-    conn.commit()
-    conn.close()
+    return len(polls)
+
+def invalidate_poll_cache(poll_id=None):
+    """Сбросить кэш опросов (после правки опросов в обход save_poll)"""
+    _poll_cache.invalidate(poll_id)
+    _notify_poll_changed(poll_id)
+
+def get_poll_cache_stats():
+    """Статистика кэша опросов: попадания, промахи, размер"""
+    return _poll_cache.stats()
+
+def save_response(user_id, poll_id, answers):
+    """Сохранить ответы пользователя и обновить счетчики ответов"""
+    with transaction(DB_NAME) as conn:
+        conn.execute("""
+            INSERT INTO responses (user_id, poll_id, answers)
+            VALUES (?, ?, ?)
+        """, (user_id, poll_id, pack_answers(poll_id, answers, conn)))
+        tallies.apply_response(conn, poll_id, answers)
+    _responded.add(user_id, poll_id)
+    metrics.RESPONSES_SAVED.inc(poll_id)
+
+def pack_answers(poll_id, answers, conn):
+    """Ответы в формат хранения: компактный BLOB или JSON, если не кодируются
+
+    conn - транзакция записи ответа: в ней же сохраняется набор
+    вариантов, по которому BLOB будет раскодирован.
+    """
+    poll = get_poll(poll_id)
+    if poll:
+        options = answer_codec.poll_options(poll["questions"])
+        fp = answer_codec.register_layout(conn, poll_id, options)
+        blob = answer_codec.encode(options, answers, fp)
+        if blob is not None:
+            return blob
+    return json.dumps(answers)
+
+def unpack_answers(poll_id, value):
+    """Ответы из формата хранения в словарь {"q_N": вариант}"""
+    return answer_codec.decode(get_connection(DB_NAME), poll_id, value)
 
 def get_responses(poll_id):
     """Получить все ответы для опроса"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    return list(iter_responses(poll_id))
+
+def iter_response_chunks(poll_id, chunk_size=1000):
+    """Отдавать ответы опроса пачками по chunk_size
+
+    Пачки выбираются по id (keyset), поэтому между пачками не держится
+    открытая транзакция, а память не зависит от числа ответов.
+    """
+    conn = get_connection(DB_NAME)
+    last_id = 0
+    
+    while True:
+        rows = conn.execute("""
+            SELECT id, user_id, answers, completed_at FROM responses
+            WHERE poll_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (poll_id, last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        
+        last_id = rows[-1][0]
+        yield [
+            {
+                "user_id": r[1],
+                "answers": answer_codec.decode(conn, poll_id, r[2]),
+                "completed_at": r[3]
+            }
+            for r in rows
+        ]
+
+def iter_raw_answer_chunks(poll_id, chunk_size=10000):
+    """Отдавать значения answers опроса пачками без декодирования"""
+    conn = get_connection(DB_NAME)
+    last_id = 0
+    
+    while True:
+        rows = conn.execute("""
+            SELECT id, answers FROM responses
+            WHERE poll_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (poll_id, last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        
+        last_id = rows[-1][0]
+        yield [r[1] for r in rows]
+
+def iter_responses(poll_id, chunk_size=1000):
+    """Отдавать ответы опроса по одному, читая БД пачками"""
+    for chunk in iter_response_chunks(poll_id, chunk_size):
+        yield from chunk
+
+def _response_exists(user_id, poll_id):
+    """Есть ли ответ пользователя на опрос (запрос к БД)"""
+    conn = get_connection(DB_NAME)
+    
+    row = conn.execute("""
+        SELECT 1 FROM responses WHERE user_id = ? AND poll_id = ? LIMIT 1
+    """, (user_id, poll_id)).fetchone()
+    
+    return row is not None
+
+def _load_responders(poll_id):
+    """user_id всех ответивших на опрос (для индекса)"""
+    conn = get_connection(DB_NAME)
+    rows = conn.execute("SELECT user_id FROM responses WHERE poll_id = ?", (poll_id,))
+    return (row[0] for row in rows)
+
+_responded = RespondedIndex(_load_responders, _response_exists)
+
+def user_already_responded(user_id, poll_id):
+    """Проверить, ответил ли пользователь на опрос"""
+    return _responded.contains(user_id, poll_id)
+
+def peek_user_responded(user_id, poll_id):
+    """Проверка без запроса к БД: True/False или None, если индекс не знает"""
+    return _responded.peek(user_id, poll_id)
+
+def invalidate_responded_index(poll_id=None):
+    """Сбросить индекс ответивших (после правки responses в обход save_response)"""
+    _responded.invalidate(poll_id)
+
+def get_responded_index_stats():
+    """Память и частота проверок индекса ответивших"""
+    return _responded.stats()
+
+def get_all_polls():
+    """Получить список всех опросов"""
+    conn = get_connection(DB_NAME)
+    
+    polls = conn.execute(
+        "SELECT poll_id, title FROM polls ORDER BY id"
+    ).fetchall()
     
-    cursor.execute("""
-        SELECT user_id, answers, completed_at FROM responses WHERE poll_id = ?
-    """, (poll_id,))
+    return [{"poll_id": p[0], "title": p[1]} for p in polls]
+
+def get_user_responses(user_id):
+    """Получить все ответы пользователя"""
+    conn = get_connection(DB_NAME)
     
-    responses = cursor.fetchall()
-    conn.close()
+    responses = conn.execute("""
+        SELECT poll_id, answers, completed_at FROM responses
+        WHERE user_id = ? ORDER BY completed_at
+    """, (user_id,)).fetchall()
     
     return [
         {
-            "user_id": r[0],
-            "answers": json.loads(r[1]),
+            "poll_id": r[0],
+            "answers": answer_codec.decode(conn, r[0], r[1]),
             "completed_at": r[2]
         }
         for r in responses
     ]
 
-def user_already_responded(user_id, poll_id):
-    """Проверить, ответил ли пользователь на опрос"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+def get_answer_tallies(poll_id):
+    """Счетчики ответов опроса: {question_idx: {answer: count}}"""
+    conn = get_connection(DB_NAME)
     
-    cursor.execute("""
-        SELECT COUNT(*) FROM responses WHERE user_id = ? AND poll_id = ?
-    """, (user_id, poll_id))
+    rows = conn.execute("""
+        SELECT question_idx, answer, count FROM answer_tallies
+        WHERE poll_id = ? AND count > 0
+    """, (poll_id,)).fetchall()
     
-    count = cursor.fetchone()[0]
-    conn.close()
-    
-    return count > 0
\ No newline at end of file
+    result = {}
+    for q_idx, answer, count in rows:
+        result.setdefault(q_idx, {})[answer] = count
+    return result
+
+def rebuild_answer_tallies(poll_id=None):
+    """Пересчитать счетчики ответов по сырым ответам"""
+    with transaction(DB_NAME) as conn:
+        return tallies.rebuild(conn, poll_id)
+
+def check_answer_tallies(poll_id=None):
+    """Сверить счетчики с сырыми ответами; вернуть список расхождений"""
+    return tallies.diff(get_connection(DB_NAME), poll_id)
@@ -0,0 +1,94 @@
+"""
+Общий пул соединений SQLite
+
+Каждый поток держит по одному постоянному соединению на файл БД,
+поэтому повторные вызовы не платят за connect() и переиспользуют
+кэш подготовленных выражений sqlite3.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Размер LRU-кэша подготовленных выражений на соединение
+STATEMENT_CACHE_SIZE = 256
+
+# Настройки, применяемые к каждому новому соединению
+PRAGMAS = (
+    # Действует только для новых файлов (до первой таблицы), см. retention
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+_local = threading.local()
+_registry_lock = threading.Lock()
+_registry = []
+
+
+def _open(db_path):
+    """Открыть и настроить новое соединение"""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=5.0,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection(db_path):
+    """Получить соединение текущего потока для файла БД"""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = _open(db_path)
+        connections[db_path] = conn
+        with _registry_lock:
+            _registry.append((connections, db_path, conn))
+    return conn
+
+
+@contextmanager
+def transaction(db_path):
+    """Выполнить блок в транзакции: commit при успехе, rollback при ошибке"""
+    conn = get_connection(db_path)
+    with conn:
+        yield conn
+
+
+@contextmanager
+def read_snapshot(db_path):
+    """Выполнить несколько чтений в одной транзакции (единый срез данных)"""
+    conn = get_connection(db_path)
+    if conn.in_transaction:
+        yield conn
+        return
+
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.commit()
+
+
+def close_all():
+    """Закрыть все соединения пула (при остановке бота)"""
+    with _registry_lock:
+        entries = list(_registry)
+        _registry.clear()
+
+    for connections, db_path, conn in entries:
+        if connections.get(db_path) is conn:
+            del connections[db_path]
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
@@ -4,6 +4,8 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 from logger import logger, log_error
+import metrics
+import outbound
 
 class BotException(Exception):
     """Базовое исключение бота"""
@@ -24,6 +26,7 @@ class DatabaseError(BotException):
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Update {update} caused error {context.error}")
+    metrics.ERRORS.inc(type(context.error).__name__)
     
     try:
         if update and update.effective_user:
@@ -32,11 +35,13 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             # Отправляем сообщение об ошибке пользователю
             if update.message:
-                await update.message.reply_text(
+                await outbound.reply_text(
+                    update.message,
                     "❌ Произошла ошибка. Пожалуйста, попробуйте позже или обратитесь к администратору."
                 )
             elif update.callback_query:
-                await update.callback_query.answer(
+                await outbound.answer(
+                    update.callback_query,
                     "❌ Ошибка при обработке запроса",
                     show_alert=True
                 )
@@ -45,18 +50,18 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def validate_poll_exists(poll_id):
     """Проверка существования опроса"""
-    from database import get_poll
+    from async_db import get_poll
     
-    poll = get_poll(poll_id)
+    poll = await get_poll(poll_id)
     if not poll:
         raise PollNotFoundError(f"Poll {poll_id} not found")
     return poll
 
 async def validate_user_not_responded(user_id, poll_id):
     """Проверка что пользователь не ответил"""
-    from database import user_already_responded
+    from async_db import user_already_responded
     
-    if user_already_responded(user_id, poll_id):
+    if await user_already_responded(user_id, poll_id):
         raise UserAlreadyRespondedError(f"User {user_id} already responded to {poll_id}")
 
 def safe_json_load(data):
@@ -0,0 +1,78 @@
+"""
+Потоковая выгрузка ответов опроса в CSV и JSONL
+
+Ответы читаются пачками через iter_responses и сразу пишутся в файл,
+поэтому расход памяти не зависит от размера опроса.
+"""
+import csv
+import json
+import time
+
+from analitycs import calculate_stress_level
+from database import get_poll, iter_responses
+
+FORMATS = ("csv", "jsonl")
+
+
+def _detect_format(path):
+    """Формат по расширению файла"""
+    for fmt in FORMATS:
+        if path.lower().endswith(f".{fmt}"):
+            return fmt
+    raise ValueError(f"Unknown export format for {path}, expected one of {FORMATS}")
+
+
+def _flatten(response, question_keys):
+    """Ответ в плоскую строку: user_id, completed_at, q_N..., stress_level"""
+    answers = response["answers"]
+    row = {
+        "user_id": response["user_id"],
+        "completed_at": response["completed_at"],
+    }
+    for key in question_keys:
+        row[key] = answers.get(key, "")
+    row["stress_level"] = calculate_stress_level(answers)
+    return row
+
+
+def export_responses(poll_id, path, fmt=None, chunk_size=1000, progress=None,
+                     progress_every=10000) -> dict:
+    """Выгрузить ответы опроса в файл
+
+    progress(rows, rows_per_sec) вызывается каждые progress_every строк.
+    Возвращает {"rows", "seconds", "rows_per_sec"}.
+    """
+    fmt = fmt or _detect_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt}, expected one of {FORMATS}")
+
+    poll = get_poll(poll_id)
+    if not poll:
+        raise ValueError(f"Poll {poll_id} not found")
+
+    question_keys = [f"q_{i}" for i in range(len(poll["questions"]))]
+    columns = ["user_id", "completed_at", *question_keys, "stress_level"]
+
+    started = time.perf_counter()
+    rows = 0
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            write = lambda row: f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+        for response in iter_responses(poll_id, chunk_size):
+            write(_flatten(response, question_keys))
+            rows += 1
+            if progress and rows % progress_every == 0:
+                progress(rows, rows / (time.perf_counter() - started))
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds) if seconds > 0 else rows,
+    }
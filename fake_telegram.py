@@ -0,0 +1,283 @@
+"""
+Локальная проверка режима вебхука без Telegram
+
+Скрипт поднимает поддельный Bot API (отвечает на вызовы бота и
+запоминает отправленные тексты по чатам) и от имени N пользователей
+отправляет обновления на вебхук бота: /start, список опросов, выбор
+опроса и ответы на все вопросы - пачкой, не дожидаясь ответов бота.
+Затем проверяет, что каждый пользователь прошел опрос и вопросы
+показаны по порядку.
+
+1. Запустить бота:
+   RUN_MODE=webhook TELEGRAM_TOKEN=1:fake TELEGRAM_API_URL=http://127.0.0.1:8081 python main.py
+2. Запустить клиента:
+   python fake_telegram.py --users 200
+"""
+import argparse
+import asyncio
+import itertools
+import re
+import time
+from collections import defaultdict, deque
+
+import aiohttp
+from aiohttp import web
+
+import callback_router
+import database
+import handlers  # noqa: F401  регистрирует маршруты кнопок
+from webhook import SECRET_HEADER, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET
+
+QUESTION_RE = re.compile(r"Вопрос (\d+)/(\d+)")
+DONE_TEXT = "Спасибо за участие"
+
+
+class FakeBotAPI:
+    """Поддельный Bot API: тексты сообщений по чатам
+
+    С chat_limit/global_limit (сообщений в секунду в чат и всего) ведет
+    себя как Telegram при превышении лимитов: отвечает 429 с
+    retry_after. Считаются отправка и изменение сообщений.
+    Чатам из blocked отвечает 403, как для заблокировавших бота.
+    """
+
+    MESSAGE_METHODS = ("sendMessage", "editMessageText")
+
+    def __init__(self, latency=0.0, chat_limit=0, global_limit=0, retry_after=1, blocked=()):
+        self.latency = latency
+        self.blocked = set(blocked)
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.retry_after = retry_after
+        self.texts = defaultdict(list)
+        self.calls = defaultdict(int)
+        self.flood = defaultdict(int)
+        self.message_ids = itertools.count(1000)
+        self._global_window = deque()
+        self._chat_windows = defaultdict(deque)
+
+    @staticmethod
+    def _over_limit(window, limit, now):
+        """Скользящее окно в 1 с: True, если лимит исчерпан"""
+        while window and window[0] <= now - 1:
+            window.popleft()
+        if len(window) >= limit:
+            return True
+        window.append(now)
+        return False
+
+    def _flooded(self, method, params):
+        if method not in self.MESSAGE_METHODS:
+            return False
+        now = time.monotonic()
+        if self.global_limit and self._over_limit(self._global_window, self.global_limit, now):
+            self.flood["global"] += 1
+            return True
+        if self.chat_limit:
+            window = self._chat_windows[int(params["chat_id"])]
+            if self._over_limit(window, self.chat_limit, now):
+                self.flood["chat"] += 1
+                return True
+        return False
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+        flooded = self._flooded(method, params)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if flooded:
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        if method in self.MESSAGE_METHODS and int(params["chat_id"]) in self.blocked:
+            return web.json_response({
+                "ok": False,
+                "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user",
+            }, status=403)
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            self.texts[chat_id].append(params.get("text", ""))
+            result = {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+
+class FakeClient:
+    """Пользователи, отправляющие обновления на вебхук"""
+
+    def __init__(self, session, url, secret):
+        self.session = session
+        self.url = url
+        self.secret = secret
+        self.update_ids = itertools.count(1)
+        self.sent = 0
+        self.throttled = 0
+        self.latencies = []
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def command(self, user_id, text):
+        update_id = next(self.update_ids)
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+            },
+        }
+
+    def callback(self, user_id, data):
+        update_id = next(self.update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "",
+                },
+            },
+        }
+
+    async def post(self, update):
+        """Отправить обновление; на 429 повторить, как Telegram"""
+        headers = {SECRET_HEADER: self.secret} if self.secret else {}
+        while True:
+            started = time.perf_counter()
+            async with self.session.post(self.url, json=update, headers=headers) as response:
+                self.latencies.append(time.perf_counter() - started)
+                if response.status == 429:
+                    self.throttled += 1
+                    await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+                    continue
+                response.raise_for_status()
+                self.sent += 1
+                return
+
+    async def user_burst(self, user_id, poll):
+        """Весь путь пользователя без ожидания ответов бота"""
+        poll_id = poll["poll_id"]
+        await self.post(self.command(user_id, "/start"))
+        await self.post(self.callback(user_id, callback_router.encode("start_poll")))
+        await self.post(self.callback(user_id, callback_router.encode("poll", poll_id)))
+        for q_idx, question in enumerate(poll["questions"]):
+            a_idx = user_id % len(question["options"])
+            await self.post(self.callback(user_id, callback_router.encode("answer", poll_id, q_idx, a_idx)))
+
+
+def check_order(texts):
+    """Номера показанных вопросов растут, последний экран - благодарность"""
+    shown = [int(m.group(1)) for m in map(QUESTION_RE.search, texts) if m]
+    ordered = shown == sorted(shown) and len(shown) == len(set(shown))
+    finished = bool(texts) and DONE_TEXT in texts[-1]
+    return ordered, finished
+
+
+async def run(args):
+    api = FakeBotAPI(args.api_latency_ms / 1000, args.chat_limit, args.global_limit)
+    runner = web.AppRunner(api.make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+
+    print(f"Поддельный Bot API: http://127.0.0.1:{args.api_port}")
+    if args.wait_bot:
+        print(f"Ожидание бота {args.wait_bot} с...")
+        await asyncio.sleep(args.wait_bot)
+
+    database.DB_NAME = args.db
+    polls = [database.get_poll(item["poll_id"]) for item in database.get_all_polls()]
+    polls = [poll for poll in polls if poll]
+    if not polls:
+        raise SystemExit(f"No polls in {args.db}")
+
+    user_ids = [args.first_user + i for i in range(args.users)]
+    async with aiohttp.ClientSession() as session:
+        client = FakeClient(session, args.webhook, args.secret)
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            client.user_burst(user_id, polls[user_id % len(polls)]) for user_id in user_ids
+        ))
+        sent_time = time.perf_counter() - started
+
+        # Ждем, пока бот ответит всем пользователям
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            if all(check_order(api.texts[u])[1] for u in user_ids):
+                break
+            await asyncio.sleep(0.05)
+        total_time = time.perf_counter() - started
+
+    results = [check_order(api.texts[u]) for u in user_ids]
+    latencies = sorted(client.latencies)
+    print(f"Отправлено обновлений: {client.sent} за {sent_time:.2f} с ({client.sent / sent_time:.0f}/с)")
+    print(f"Ответов 429: {client.throttled}")
+    if latencies:
+        print(
+            f"Время ответа вебхука: p50 {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс"
+        )
+    print(f"Прошли опрос: {sum(f for _, f in results)}/{len(user_ids)} за {total_time:.2f} с")
+    print(f"Нарушений порядка: {sum(not o for o, _ in results)}")
+    print(f"Вызовов Bot API: {dict(api.calls)}")
+    if api.flood:
+        print(f"Ответов 429 от Bot API: {dict(api.flood)}")
+
+    await runner.cleanup()
+    return all(o and f for o, f in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--first-user", type=int, default=500000,
+                        help="первый user_id (новые id, чтобы опрос не был уже пройден)")
+    parser.add_argument("--webhook", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--api-latency-ms", type=float, default=0.0)
+    parser.add_argument("--chat-limit", type=int, default=0, help="лимит сообщений в чат в секунду")
+    parser.add_argument("--global-limit", type=int, default=0, help="лимит сообщений бота в секунду")
+    parser.add_argument("--db", default=database.DB_NAME, help="БД бота (для структуры опросов)")
+    parser.add_argument("--wait-bot", type=float, default=0.0, help="подождать запуска бота, с")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Воронка прохождения опросов по сессиям
+
+Клики started_poll_* и answer_qN складываются в сессии (пользователь +
+опрос): сессия начинается с выбора опроса, каждый ответ на очередной
+вопрос - следующий шаг, ответ на последний вопрос завершает сессию.
+Повторный выбор опроса начинает новую сессию; сессия без кликов
+дольше FUNNEL_SESSION_TIMEOUT считается брошенной.
+
+Агрегаты обновляются инкрементально, как и click_rollups: update(conn)
+разбирает только клики после водяного знака rollup_state 'funnel' и
+вызывается при каждом сбросе буфера кликов. Незавершенные сессии
+хранятся в funnel_sessions, поэтому отчеты не читают историю кликов.
+
+    funnel_steps    сколько сессий дошло до шага (0 - начало, k - ответ
+                    на k-й вопрос)
+    funnel_timings  гистограмма времени: шаг k - от шага k-1 до k,
+                    completion - от начала до последнего ответа
+
+Длительности в гистограмме округляются до двух значащих цифр, поэтому
+медиана и p90 точны до секунды для шагов короче 100 с и до ~10%
+для более долгих.
+"""
+import json
+import os
+
+from click_rollups import check_full_history, get_watermark, set_watermark
+
+FUNNEL_STATE = "funnel"
+FUNNEL_SESSION_TIMEOUT = int(os.getenv(
+    "FUNNEL_SESSION_TIMEOUT", os.getenv("SESSION_IDLE_TIMEOUT", "1800")
+))
+
+STEP, COMPLETION = "step", "completion"
+
+# Параметров в одном IN (...): меньше старого предела SQLite в 999
+_SQL_BATCH = 500
+
+_EVENTS_SQL = """
+    SELECT user_id, poll_id, button_name, question_idx,
+           CAST(strftime('%s', clicked_at) AS INTEGER)
+    FROM clicks
+    WHERE id > ? AND id <= ? AND poll_id IS NOT NULL
+      AND (button_name LIKE 'started\\_poll\\_%' ESCAPE '\\' OR button_name LIKE 'answer\\_q%' ESCAPE '\\')
+    ORDER BY id
+"""
+
+
+def _bucket(seconds) -> int:
+    """Ключ гистограммы: длительность с точностью до двух значащих цифр"""
+    seconds = max(int(seconds), 0)
+    if seconds < 100:
+        return seconds
+    scale = 10 ** (len(str(seconds)) - 2)
+    return seconds // scale * scale
+
+
+def _question_counts(conn, poll_ids) -> dict:
+    """Число вопросов в опросах: из кэша опросов, недостающие - одним запросом"""
+    import database  # database -> migrations -> funnel
+
+    counts = {}
+    for poll_id in poll_ids:
+        poll = database.peek_poll(poll_id)
+        if poll is not None:
+            counts[poll_id] = len(poll["questions"])
+    missing = [poll_id for poll_id in poll_ids if poll_id not in counts]
+    for start in range(0, len(missing), _SQL_BATCH):
+        chunk = missing[start:start + _SQL_BATCH]
+        for poll_id, questions in conn.execute(
+            f"SELECT poll_id, questions FROM polls WHERE poll_id IN ({', '.join('?' * len(chunk))})",
+            chunk
+        ):
+            counts[poll_id] = len(json.loads(questions))
+    return counts
+
+
+def _load_sessions(conn, keys) -> dict:
+    """Открытые сессии для пар (user_id, poll_id): [started_at, step, last_at]"""
+    users = sorted({user_id for user_id, _ in keys})
+    sessions = {}
+    for start in range(0, len(users), _SQL_BATCH):
+        chunk = users[start:start + _SQL_BATCH]
+        for user_id, poll_id, *session in conn.execute(f"""
+            SELECT user_id, poll_id, started_at, step, last_at FROM funnel_sessions
+            WHERE user_id IN ({', '.join('?' * len(chunk))})
+        """, chunk):
+            if (user_id, poll_id) in keys:
+                sessions[(user_id, poll_id)] = session
+    return sessions
+
+
+def update(conn) -> int:
+    """Учесть новые клики в воронке (внутри транзакции вызывающего)
+
+    Возвращает число разобранных кликов.
+    """
+    last_id = get_watermark(conn, FUNNEL_STATE)
+    max_id = conn.execute("SELECT MAX(id) FROM clicks").fetchone()[0] or 0
+    if max_id <= last_id:
+        return 0
+    if not last_id:
+        check_full_history(conn, FUNNEL_STATE)
+
+    events = conn.execute(_EVENTS_SQL, (last_id, max_id)).fetchall()
+    set_watermark(conn, max_id, FUNNEL_STATE)
+    if not events:
+        return 0
+
+    sessions = _load_sessions(conn, {(user_id, poll_id) for user_id, poll_id, *_ in events})
+    questions = _question_counts(conn, sorted({poll_id for _, poll_id, *_ in events}))
+    steps = {}
+    timings = {}
+
+    def count(poll_id, step):
+        steps[poll_id, step] = steps.get((poll_id, step), 0) + 1
+
+    def timing(poll_id, metric, step, seconds):
+        key = (poll_id, metric, step, _bucket(seconds))
+        timings[key] = timings.get(key, 0) + 1
+
+    for user_id, poll_id, button_name, question_idx, at in events:
+        key = (user_id, poll_id)
+        if button_name.startswith("started_poll_"):
+            sessions[key] = [at, 0, at]
+            count(poll_id, 0)
+            continue
+
+        session = sessions.get(key)
+        if session is None or question_idx is None:
+            continue
+        started_at, step, last_at = session
+        if at - last_at > FUNNEL_SESSION_TIMEOUT:
+            # Брошенная сессия: ответ без нового начала не учитываем
+            del sessions[key]
+            continue
+        if question_idx != step:
+            # Повторное нажатие или кнопка с другого вопроса
+            continue
+
+        step += 1
+        count(poll_id, step)
+        timing(poll_id, STEP, step, at - last_at)
+        session[1:] = [step, at]
+        if step >= questions.get(poll_id, step + 1):
+            timing(poll_id, COMPLETION, step, at - started_at)
+            del sessions[key]
+
+    conn.executemany("""
+        INSERT INTO funnel_steps (poll_id, step, sessions) VALUES (?, ?, ?)
+        ON CONFLICT (poll_id, step) DO UPDATE SET sessions = sessions + excluded.sessions
+    """, [(poll_id, step, n) for (poll_id, step), n in steps.items()])
+    conn.executemany("""
+        INSERT INTO funnel_timings (poll_id, metric, step, bucket, count) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (poll_id, metric, step, bucket) DO UPDATE SET count = count + excluded.count
+    """, [(*key, n) for key, n in timings.items()])
+
+    # Завершенные сессии удаляются, остальные сохраняются с новым шагом
+    touched = {(user_id, poll_id) for user_id, poll_id, *_ in events}
+    conn.executemany(
+        "DELETE FROM funnel_sessions WHERE user_id = ? AND poll_id = ?",
+        [key for key in touched if key not in sessions]
+    )
+    conn.executemany("""
+        INSERT INTO funnel_sessions (user_id, poll_id, started_at, step, last_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, poll_id) DO UPDATE SET
+            started_at = excluded.started_at, step = excluded.step, last_at = excluded.last_at
+    """, [(*key, *sessions[key]) for key in touched if key in sessions])
+    # Брошенные сессии больше не продолжатся
+    conn.execute(
+        "DELETE FROM funnel_sessions WHERE last_at < ?", (events[-1][4] - FUNNEL_SESSION_TIMEOUT,)
+    )
+    return len(events)
+
+
+def _quantile(histogram, q):
+    """Квантиль по гистограмме [(значение, число)], отсортированной по значению"""
+    total = sum(n for _, n in histogram)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for value, n in histogram:
+        seen += n
+        if seen >= rank:
+            return value
+    return histogram[-1][0]
+
+
+def get_funnel(conn, poll_id) -> dict:
+    """Воронка опроса по агрегатам
+
+    steps: [{step, sessions, conversion (от предыдущего шага),
+    from_start, median, p90}], completion: {sessions, median, p90};
+    время в секундах.
+    """
+    reached = dict(conn.execute(
+        "SELECT step, sessions FROM funnel_steps WHERE poll_id = ? ORDER BY step", (poll_id,)
+    ).fetchall())
+    histograms = {}
+    for metric, step, bucket, n in conn.execute("""
+        SELECT metric, step, bucket, count FROM funnel_timings
+        WHERE poll_id = ? ORDER BY metric, step, bucket
+    """, (poll_id,)):
+        histograms.setdefault((metric, step), []).append((bucket, n))
+
+    started = reached.get(0, 0)
+    steps = []
+    previous = started
+    for step in range(max(reached, default=-1) + 1):
+        sessions = reached.get(step, 0)
+        times = histograms.get((STEP, step), [])
+        steps.append({
+            "step": step,
+            "sessions": sessions,
+            "conversion": round(sessions / previous * 100, 1) if previous else 0.0,
+            "from_start": round(sessions / started * 100, 1) if started else 0.0,
+            "median": _quantile(times, 0.5),
+            "p90": _quantile(times, 0.9),
+        })
+        previous = sessions
+
+    completion = [item for (metric, _), times in histograms.items() if metric == COMPLETION for item in times]
+    completion.sort()
+    return {
+        "poll_id": poll_id,
+        "started": started,
+        "steps": steps,
+        "completion": {
+            "sessions": sum(n for _, n in completion),
+            "median": _quantile(completion, 0.5),
+            "p90": _quantile(completion, 0.9),
+        },
+    }
+
+
+def _seconds(value):
+    if value is None:
+        return "-"
+    if value < 60:
+        return f"{value} с"
+    return f"{value // 60} мин {value % 60} с"
+
+
+def format_funnel(funnel) -> str:
+    """Текст воронки для админа"""
+    lines = [f"🔀 ВОРОНКА {funnel['poll_id']}: начали {funnel['started']}"]
+    for step in funnel["steps"][1:]:
+        lines.append(
+            f"  Вопрос {step['step']}: {step['sessions']} ({step['conversion']}% от предыдущего, "
+            f"{step['from_start']}% от начала), время медиана {_seconds(step['median'])}, "
+            f"p90 {_seconds(step['p90'])}"
+        )
+    completion = funnel["completion"]
+    lines.append(
+        f"  Завершили: {completion['sessions']}, время прохождения медиана "
+        f"{_seconds(completion['median'])}, p90 {_seconds(completion['p90'])}"
+    )
+    return "\n".join(lines)
+
@@ -5,139 +5,310 @@
 
 from telegram import Update
 from telegram.ext import ContextTypes
-from click_analytics import log_click, format_click_report
+import async_db
+import callback_router
+import outbound
+import render_cache
+import report_pages
+import sessions
+from async_db import log_click, run_db
+from analitycs import calculate_stress_level
+from errors import (
+    PollNotFoundError, UserAlreadyRespondedError,
+    validate_poll_exists, validate_user_not_responded
+)
+from logger import log_poll_started, log_poll_completed
+from metrics import timed_handler
 
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка команды /start"""
     user = update.effective_user
     user_id = user.id
     
     # Логируем клик
-    log_click(user_id, "start_command")
+    await log_click(user_id, "start_command")
     
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-    
-    keyboard = [
-        [InlineKeyboardButton("Начать опрос", callback_data="start_poll")],
-        [InlineKeyboardButton("Результаты", callback_data="show_results")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
+    await outbound.reply_text(
+        update.message,
         f"Привет, {user.first_name}! 👋\n\n"
         "Это бот для проведения опросов. Выберите действие:",
-        reply_markup=reply_markup
+        reply_markup=render_cache.start_markup()
     )
 
+@timed_handler
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка нажатий на кнопки с логированием"""
     query = update.callback_query
     user_id = update.effective_user.id
     
-    await query.answer()
+    await outbound.answer(query)
     
-    # Логируем каждый клик
-    log_click(user_id, query.data)
+    decoded = callback_router.decode(query.data)
+    if decoded is None:
+        # Неизвестная кнопка: учитываем клик как есть
+        await log_click(user_id, query.data)
+        return
+    
+    # Логируем каждый клик (имя кнопки - в прежнем формате callback_data)
+    route, args = decoded
+    await log_click(user_id, route.label(args), callback_data=query.data)
+    await route.handler(query, context, user_id, *args)
+
+@callback_router.route("s", "start_poll")
+async def on_start_poll(query, context, user_id):
+    """Кнопка «Начать опрос»"""
+    await start_poll(query, context, user_id)
+    await log_click(user_id, "view_polls_list")
+
+@callback_router.route("r", "show_results")
+async def on_show_results(query, context, user_id):
+    """Кнопка «Результаты»"""
+    await show_results(query, context)
+    await log_click(user_id, "view_results")
+
+@callback_router.route("p", "poll", "s", legacy="poll_{0}")
+async def on_poll(query, context, user_id, poll_id):
+    """Выбор опроса из списка"""
+    # started_poll_* - начало сессии в воронке, отказы логируются отдельно
+    if await show_poll_question(query, context, user_id, poll_id, 0):
+        await log_click(user_id, f"started_poll_{poll_id}", poll_id=poll_id)
+    else:
+        await log_click(user_id, f"poll_rejected_{poll_id}", poll_id=poll_id)
+
+@callback_router.route("a", "answer", "sii", legacy="answer_{0}_{1}_{2}")
+async def on_answer(query, context, user_id, poll_id, question_idx, answer_idx):
+    """Выбор варианта ответа"""
+    # Логируем клик по ответу
+    await log_click(
+        user_id, 
+        f"answer_q{question_idx}", 
+        poll_id=poll_id,
+        question_idx=question_idx
+    )
     
-    if query.data == "start_poll":
-        await start_poll(query, context, user_id)
-        log_click(user_id, "view_polls_list")
+    await process_answer(query, context, user_id, poll_id, question_idx, answer_idx)
+
+@timed_handler
+async def start_poll(query, context, user_id):
+    """Показать список опросов"""
+    screen = await render_cache.poll_list_screen(async_db.get_all_polls)
+    await outbound.edit_text(query, screen.text, reply_markup=screen.reply_markup)
+
+@timed_handler
+async def show_results(query, context):
+    """Показать результаты пройденных опросов пользователя"""
+    responses = await async_db.get_user_responses(query.from_user.id)
     
-    elif query.data == "show_results":
-        await show_results(query, context)
-        log_click(user_id, "view_results")
+    if not responses:
+        await outbound.edit_text(query, "Вы еще не прошли ни одного опроса.")
+        return
     
-    elif query.data.startswith("poll_"):
-        poll_id = query.data.replace("poll_", "")
-        await show_poll_question(query, context, user_id, poll_id, 0)
-        log_click(user_id, f"started_poll_{poll_id}", poll_id=poll_id)
+    text = "📊 Ваши результаты:\n\n"
+    for response in responses:
+        text += f"{response['poll_id']}: {calculate_stress_level(response['answers'])}\n"
     
-    elif query.data.startswith("answer_"):
-        parts = query.data.split("_")
-        poll_id = parts[1]
-        question_idx = int(parts[2])
-        answer_idx = int(parts[3])
-        
-        # Логируем клик по ответу
-        log_click(
-            user_id, 
-            f"answer_q{question_idx}", 
-            poll_id=poll_id,
-            question_idx=question_idx
-        )
+    await outbound.edit_text(query, text)
+
+async def _session_poll(session):
+    """Определение опроса сессии (после восстановления из снимка - из кэша)"""
+    if session.poll is None:
+        session.poll = await async_db.get_poll(session.poll_id)
+    return session.poll
+
+async def _session_expired(query, poll_id):
+    """Сессия опроса не найдена: предложить начать заново"""
+    screen = render_cache.restart_screen(poll_id)
+    await outbound.edit_text(query, screen.text, reply_markup=screen.reply_markup)
+
+@timed_handler
+async def show_poll_question(query, context, user_id, poll_id, question_idx):
+    """Показать вопрос опроса (вопрос 0 начинает новую сессию)
+
+    Возвращает True, если вопрос показан, и False, если опрос не найден,
+    уже пройден или сессия истекла.
+    """
+    if question_idx == 0:
+        try:
+            poll = await validate_poll_exists(poll_id)
+            await validate_user_not_responded(user_id, poll_id)
+        except PollNotFoundError:
+            await outbound.edit_text(query, "❌ Опрос не найден.")
+            return False
+        except UserAlreadyRespondedError:
+            await outbound.edit_text(query, "✅ Вы уже прошли этот опрос.")
+            return False
         
-        await process_answer(query, context, user_id, poll_id, question_idx, answer_idx)
+        sessions.store.start(user_id, poll_id, poll)
+        log_poll_started(user_id, poll_id)
+    else:
+        session = sessions.store.get(user_id)
+        if session is None or session.poll_id != poll_id:
+            await _session_expired(query, poll_id)
+            return False
+        poll = await _session_poll(session)
+    
+    screen = render_cache.question_screen(poll, question_idx)
+    await outbound.edit_text(query, screen.text, reply_markup=screen.reply_markup)
+    return True
+
+@timed_handler
+async def process_answer(query, context, user_id, poll_id, question_idx, answer_idx):
+    """Запомнить ответ в сессии; на последнем вопросе сохранить в БД"""
+    session = sessions.store.get(user_id)
+    if session is None or session.poll_id != poll_id:
+        # Кнопка с уже пройденного опроса (повторное нажатие последнего
+        # ответа): не заменяем сообщение с результатом экраном перезапуска
+        if await async_db.user_already_responded(user_id, poll_id):
+            return
+        await _session_expired(query, poll_id)
+        return
+    if question_idx != session.question_idx:
+        # Повторное нажатие или кнопка с уже пройденного вопроса
+        return
+    
+    poll = await _session_poll(session)
+    if not poll:
+        sessions.store.finish(user_id)
+        await outbound.edit_text(query, "❌ Опрос не найден.")
+        return
+    
+    questions = poll["questions"]
+    options = questions[question_idx]["options"]
+    if not 0 <= answer_idx < len(options):
+        return
+    session.answers[f"q_{question_idx}"] = options[answer_idx]
+    session.question_idx += 1
+    
+    if session.question_idx < len(questions):
+        await show_poll_question(query, context, user_id, poll_id, session.question_idx)
+        return
+    
+    try:
+        await async_db.save_response(user_id, poll_id, session.answers)
+    except Exception:
+        # Ответ не записан: последний вопрос можно отправить еще раз
+        session.question_idx -= 1
+        raise
+    sessions.store.finish(user_id)
+    log_poll_completed(user_id, poll_id, len(session.answers))
+    
+    await outbound.edit_text(
+        query,
+        "✅ Спасибо за участие!\n\n"
+        f"Результат: {calculate_stress_level(session.answers)}"
+    )
 
 # В admin.py добавьте команду для просмотра аналитики кликов:
 
+def _is_admin(user_id) -> bool:
+    from config import ADMIN_IDS
+    return user_id in ADMIN_IDS
+
+@callback_router.route("c", "admin_clicks")
+async def on_admin_clicks(query, context, user_id):
+    """Кнопка «Аналитика кликов» админ панели"""
+    if _is_admin(user_id):
+        await admin_click_analytics(query, context)
+
+@callback_router.route("o", "admin_reports")
+async def on_admin_reports(query, context, user_id):
+    """Кнопка «Отчеты» админ панели"""
+    if _is_admin(user_id):
+        await admin_reports(query, context)
+
+@callback_router.route("g", "report_page", "ssii")
+async def on_report_page(query, context, user_id, kind, poll_id, version, number):
+    """Листание отчета: kind, опрос, версия данных, страница"""
+    if _is_admin(user_id):
+        await show_report(query, kind, poll_id, number, version)
+
+async def show_report(query, kind, poll_id=None, number=0, version=0):
+    """Страница отчета в том же сообщении, с кнопками листания"""
+    text, markup = await run_db(report_pages.render_page, kind, poll_id, number, version)
+    await outbound.edit_text(query, text, reply_markup=markup, priority=outbound.ADMIN)
+
+@timed_handler
 async def admin_click_analytics(query, context):
     """Показать аналитику кликов"""
-    from click_analytics import format_click_report, get_click_statistics
-    
-    report = format_click_report()
+    await show_report(query, "clicks")
+
+@timed_handler
+async def admin_reports(query, context):
+    """Список опросов для подробного отчета"""
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     
-    if len(report) > 4096:
-        await query.edit_message_text(report[:4096])
-        await query.message.reply_text(report[4096:])
-    else:
-        await query.edit_message_text(report)
+    polls = await async_db.get_all_polls()
+    keyboard = [
+        [InlineKeyboardButton(
+            poll["title"],
+            callback_data=callback_router.encode("report_page", "poll", poll["poll_id"], 0, 0)
+        )]
+        for poll in polls
+    ]
+    await outbound.edit_text(
+        query,
+        "📋 Выберите опрос для отчета:" if polls else "Опросов пока нет.",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        priority=outbound.ADMIN,
+    )
 
 # Добавьте в admin panel меню:
 
+@timed_handler
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать админ панель с аналитикой кликов"""
     user_id = update.effective_user.id
     
     from config import ADMIN_IDS
     if user_id not in ADMIN_IDS:
-        await update.message.reply_text("❌ У вас нет доступа к админ панели!")
+        await outbound.reply_text(update.message, "❌ У вас нет доступа к админ панели!")
         return
     
     from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     
     keyboard = [
         [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
-        [InlineKeyboardButton("📋 Отчеты", callback_data="admin_reports")],
-        [InlineKeyboardButton("🔘 Аналитика кликов", callback_data="admin_clicks")],  # НОВОЕ
+        [InlineKeyboardButton("📋 Отчеты", callback_data=callback_router.encode("admin_reports"))],
+        [InlineKeyboardButton("🔘 Аналитика кликов", callback_data=callback_router.encode("admin_clicks"))],  # НОВОЕ
         [InlineKeyboardButton("📝 Управление опросами", callback_data="admin_polls")],
         [InlineKeyboardButton("👥 Пользователи", callback_data="admin_users")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(
+    await outbound.reply_text(
+        update.message,
         "🔐 АДМИН ПАНЕЛЬ\n\n"
         "Выберите действие:",
-        reply_markup=reply_markup
+        reply_markup=reply_markup,
+        priority=outbound.ADMIN,
     )
 
 # Функция для экспорта аналитики в текст
 
 async def export_click_analytics(poll_id: str = None) -> str:
     """Экспортировать аналитику кликов"""
-    from click_analytics import (
-        get_total_clicks, get_clicks_by_button, 
-        get_click_funnel, get_most_clicked_buttons,
-        get_average_clicks_per_user
-    )
+    from click_analytics import get_click_snapshot
+    
+    stats = await run_db(get_click_snapshot, poll_id)
     
-    report = "📊 ПОЛНАЯ АНАЛИТИКА КЛИКОВ\n"
-    report += "=" * 50 + "\n\n"
+    lines = ["📊 ПОЛНАЯ АНАЛИТИКА КЛИКОВ", "=" * 50, ""]
     
-    total = get_total_clicks(poll_id)
-    report += f"Всего кликов: {total}\n"
-    report += f"Среднее кликов на пользователя: {get_average_clicks_per_user(poll_id)}\n\n"
+    total = stats.total_clicks
+    lines.append(f"Всего кликов: {total}")
+    lines.append(f"Среднее кликов на пользователя: {stats.avg_clicks_per_user}")
+    lines.append("")
     
-    report += "🔘 КЛИКИ ПО КНОПКАМ\n"
-    buttons = get_clicks_by_button(poll_id)
-    for button, count in list(buttons.items())[:10]:
+    lines.append("🔘 КЛИКИ ПО КНОПКАМ")
+    for button, count in list(stats.clicks_by_button.items())[:10]:
         pct = (count / total * 100) if total > 0 else 0
         bar = "█" * int(pct / 5) + "░" * (20 - int(pct / 5))
-        report += f"{button:20} {bar} {pct:5.1f}% ({count})\n"
+        lines.append(f"{button:20} {bar} {pct:5.1f}% ({count})")
     
-    report += "\n🔀 ВОРОНКА (FUNNEL)\n"
-    if poll_id:
-        funnel = get_click_funnel(poll_id)
-        for step, users in funnel.items():
-            report += f"  {step}: {users} пользователей\n"
+    if stats.poll_funnel:
+        from funnel import format_funnel
+        
+        lines.append("")
+        lines.append(format_funnel(stats.poll_funnel))
     
-    return report
\ No newline at end of file
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,195 @@
+"""
+Приближенный подсчет уникальных пользователей (HyperLogLog)
+
+Вместо COUNT(DISTINCT user_id) по всей таблице clicks уникальные
+пользователи считаются по скетчам HyperLogLog в click_sketches:
+
+    scope       key                 кто кликал
+    all         ''                  по всем кнопкам
+    poll        poll_id             в опросе
+    question    'poll_id:idx'       по кнопкам вопроса
+    day         'YYYY-MM-DD'        за день (UTC)
+
+Скетч - 2^12 регистров по байту (хранится сжатым). Скетчи объединяются
+без потерь (максимум по регистрам), поэтому уникальные за неделю - это
+объединение скетчей дней.
+
+Погрешность: стандартная ошибка 1.04/sqrt(4096) = 1.6%, т.е. в 95%
+случаев оценка отличается от точного числа не больше чем на 3.3%; до
+тысячи пользователей (линейный подсчет) - обычно меньше 1%.
+
+Скетчи обновляются инкрементально при сбросе буфера кликов (водяной
+знак rollup_state 'sketches'), еще не учтенные клики добавляются при
+чтении, как в click_rollups.
+"""
+import math
+import zlib
+
+from click_rollups import check_full_history, get_watermark, set_watermark
+
+SKETCH_STATE = "sketches"
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+STANDARD_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+_MASK = (1 << 64) - 1
+_RANK_BITS = 64 - PRECISION
+_RANK_MASK = (1 << _RANK_BITS) - 1
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+_POW = [2.0 ** -rank for rank in range(_RANK_BITS + 2)]
+# До этой оценки линейный подсчет точнее (порог HyperLogLog++ для p=12)
+_LINEAR_COUNTING_LIMIT = 11500
+
+
+def _hash(user_id) -> int:
+    """64-битный хэш ID пользователя (splitmix64)"""
+    x = (user_id + 0x9E3779B97F4A7C15) & _MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+    return x ^ (x >> 31)
+
+
+class Sketch:
+    """Скетч HyperLogLog: регистры 0..64-PRECISION+1"""
+
+    __slots__ = ("registers",)
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers else bytearray(REGISTERS)
+
+    def add(self, user_id) -> bool:
+        """Учесть пользователя; True, если скетч изменился"""
+        return self.add_hash(_hash(user_id))
+
+    def add_hash(self, h) -> bool:
+        index = h >> _RANK_BITS
+        rank = _RANK_BITS - (h & _RANK_MASK).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        """Объединить с другим скетчем (на месте)"""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def estimate(self) -> int:
+        """Оценка числа уникальных пользователей"""
+        zeros = self.registers.count(0)
+        if zeros:
+            # Линейный подсчет для малых множеств
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+            if estimate <= _LINEAR_COUNTING_LIMIT:
+                return round(estimate)
+        return round(_ALPHA * REGISTERS * REGISTERS / sum(map(_POW.__getitem__, self.registers)))
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(zlib.decompress(data))
+
+
+def _keys(poll_id, question_idx, day):
+    """Скетчи, в которые попадает клик"""
+    keys = [("all", ""), ("day", day)]
+    if poll_id:
+        keys.append(("poll", poll_id))
+        if question_idx is not None:
+            keys.append(("question", f"{poll_id}:{question_idx}"))
+    return keys
+
+
+def load(conn, scope, key):
+    """Скетч из БД (пустой, если его еще нет)"""
+    row = conn.execute(
+        "SELECT registers FROM click_sketches WHERE scope = ? AND key = ?", (scope, key)
+    ).fetchone()
+    return Sketch.from_bytes(row[0]) if row else Sketch()
+
+
+def update(conn) -> int:
+    """Добавить в скетчи новые клики (внутри транзакции вызывающего)
+
+    Возвращает число учтенных кликов.
+    """
+    last_id = get_watermark(conn, SKETCH_STATE)
+    max_id = conn.execute("SELECT MAX(id) FROM clicks").fetchone()[0] or 0
+    if max_id <= last_id:
+        return 0
+    if not last_id:
+        check_full_history(conn, SKETCH_STATE)
+
+    sketches = {}
+    changed = set()
+    for user_id, poll_id, question_idx, day in conn.execute("""
+        SELECT user_id, poll_id, question_idx, substr(clicked_at, 1, 10)
+        FROM clicks WHERE id > ? AND id <= ?
+    """, (last_id, max_id)).fetchall():
+        h = _hash(user_id)
+        for key in _keys(poll_id, question_idx, day):
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = load(conn, *key)
+            if sketch.add_hash(h):
+                changed.add(key)
+
+    conn.executemany("""
+        INSERT INTO click_sketches (scope, key, registers) VALUES (?, ?, ?)
+        ON CONFLICT (scope, key) DO UPDATE SET registers = excluded.registers
+    """, [(scope, key, sketches[scope, key].to_bytes()) for scope, key in changed])
+    set_watermark(conn, max_id, SKETCH_STATE)
+    return max_id - last_id
+
+
+def _tail_filter(scope, key):
+    """Условие на еще не учтенные клики для скетча
+
+    Унарный + отключает индексы по этим колонкам: хвост короткий, и его
+    нужно брать по диапазону id, а не перебором индекса опроса.
+    """
+    if scope == "poll":
+        return " AND +poll_id = ?", (key,)
+    if scope == "question":
+        poll_id, question_idx = key.rsplit(":", 1)
+        return " AND +poll_id = ? AND +question_idx = ?", (poll_id, int(question_idx))
+    if scope == "day":
+        return " AND +clicked_at >= ? AND +clicked_at < date(?, '+1 day')", (key, key)
+    return "", ()
+
+
+def sketch_of(conn, scope, keys) -> Sketch:
+    """Объединение скетчей keys одного scope плюс хвост неучтенных кликов"""
+    last_id = get_watermark(conn, SKETCH_STATE)
+    merged = None
+    for key in keys:
+        sketch = load(conn, scope, key)
+        merged = sketch if merged is None else merged.merge(sketch)
+        cond, params = _tail_filter(scope, key)
+        for (user_id,) in conn.execute(
+            f"SELECT user_id FROM clicks WHERE id > ?{cond}", (last_id, *params)
+        ):
+            merged.add(user_id)
+    return merged or Sketch()
+
+
+def count_distinct(conn, scope, keys=("",)) -> int:
+    """Приближенное число уникальных пользователей в объединении скетчей"""
+    return sketch_of(conn, scope, keys).estimate()
+
+
+def question_keys(conn, poll_id) -> list:
+    """Ключи скетчей вопросов опроса (с учетом хвоста) по порядку вопросов"""
+    prefix = f"{poll_id}:"
+    indexes = {int(row[0][len(prefix):]) for row in conn.execute(
+        "SELECT key FROM click_sketches WHERE scope = 'question' AND key >= ? AND key < ?",
+        (prefix, prefix + "\uffff")
+    )}
+    indexes.update(row[0] for row in conn.execute(
+        "SELECT question_idx FROM clicks WHERE id > ? AND +poll_id = ? AND question_idx IS NOT NULL",
+        (get_watermark(conn, SKETCH_STATE), poll_id)
+    ))
+    return [f"{prefix}{idx}" for idx in sorted(indexes)]
@@ -1,46 +1,168 @@
 """
 Логирование для отладки и мониторинга
+
+Вызовы логгера не пишут на диск сами: запись кладется в очередь, а в
+файл и консоль ее выводит фоновый поток (QueueListener). Если очередь
+переполнена, запись отбрасывается и учитывается в dropped_records(),
+чтобы логирование не тормозило обработчики.
+
+В файл пишутся JSON-строки (одна запись - одна строка) с ротацией по
+размеру, в консоль - обычный текст. Поля структурированных событий
+(log_user_action и др.) попадают в JSON отдельными ключами.
+
+Настройки (.env):
+    LOG_FILE            файл лога (bot.log)
+    LOG_LEVEL           уровень (INFO)
+    LOG_MAX_BYTES       размер файла до ротации (10 МБ)
+    LOG_BACKUP_COUNT    сколько старых файлов хранить (5)
+    LOG_QUEUE_SIZE      размер очереди записей (10000)
+    LOG_CLICK_SAMPLE    доля кликов, попадающих в лог (0.01); все клики
+                        и так есть в БД и в метриках
 """
+import atexit
+import json
 import logging
-from datetime import datetime
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_CLICK_SAMPLE = float(os.getenv("LOG_CLICK_SAMPLE", "0.01"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой"""
+
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event:
+            data.update(event)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который не блокирует и не падает на полной очереди"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Аргументы подставляем сразу (они могут измениться до записи), но без
+        # форматирования и копирования записи: это сделает фоновый поток
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def build_pipeline(log_file=LOG_FILE, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                   queue_size=LOG_QUEUE_SIZE, console=True):
+    """Обработчик-очередь и фоновый поток записи в файл (и консоль)"""
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(stream_handler)
+
+    log_queue = queue.Queue(queue_size)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    return DroppingQueueHandler(log_queue), listener
+
 
 # Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
+_queue_handler, _listener = build_pipeline()
+logging.basicConfig(level=LOG_LEVEL, handlers=[_queue_handler])
+_listener.start()
 
 logger = logging.getLogger(__name__)
 
-def log_user_action(user_id, action, details=None):
+
+def stop_logging():
+    """Дописать накопленные записи и остановить фоновый поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
+
+
+def dropped_records() -> int:
+    """Сколько записей отброшено из-за переполненной очереди"""
+    return _queue_handler.dropped
+
+
+def log_user_action(user_id, action, details=None, **fields):
     """Логировать действие пользователя"""
     msg = f"User {user_id} - {action}"
     if details:
         msg += f" - {details}"
-    logger.info(msg)
+    logger.info(msg, extra={"event": {"event": action, "user_id": user_id, **fields}})
 
 def log_poll_started(user_id, poll_id):
     """Логировать начало опроса"""
-    log_user_action(user_id, "started_poll", f"poll_id={poll_id}")
+    log_user_action(user_id, "started_poll", f"poll_id={poll_id}", poll_id=poll_id)
 
 def log_poll_completed(user_id, poll_id, answers_count):
     """Логировать завершение опроса"""
-    log_user_action(user_id, "completed_poll", f"poll_id={poll_id}, answers={answers_count}")
+    log_user_action(
+        user_id, "completed_poll", f"poll_id={poll_id}, answers={answers_count}",
+        poll_id=poll_id, answers=answers_count,
+    )
+
+def log_click_event(user_id, button_name):
+    """Логировать клик (выборочно, доля LOG_CLICK_SAMPLE)"""
+    if LOG_CLICK_SAMPLE < 1 and random.random() >= LOG_CLICK_SAMPLE:
+        return
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(
+        "Click logged - User: %s, Button: %s", user_id, button_name,
+        extra={"event": {"event": "click", "user_id": user_id, "button": button_name,
+                         "sample_rate": LOG_CLICK_SAMPLE}},
+    )
 
 def log_error(error_type, error_msg, user_id=None):
     """Логировать ошибку"""
     msg = f"ERROR: {error_type} - {error_msg}"
     if user_id:
         msg += f" (user_id={user_id})"
-    logger.error(msg)
+    logger.error(msg, extra={"event": {"event": "error", "error_type": error_type, "user_id": user_id}})
 
-def log_admin_action(admin_id, action, details=None):
+def log_admin_action(admin_id, action, details=None, **fields):
     """Логировать админ действие"""
     msg = f"ADMIN {admin_id} - {action}"
     if details:
         msg += f" - {details}"
-    logger.warning(msg)
\ No newline at end of file
+    logger.warning(msg, extra={"event": {"event": action, "admin_id": admin_id, **fields}})
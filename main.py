@@ -1,17 +1,61 @@
 import os
 from dotenv import load_dotenv
+
+# До импорта модулей бота: они читают настройки из окружения при импорте
+load_dotenv()
+
 from telegram import Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 from handlers import start, button_callback
-from database import init_db
+from database import init_db, warm_poll_cache
+from click_analytics import start_click_buffer, stop_click_buffer
+from db_pool import close_all
+from errors import error_handler
+import async_db
+import metrics
+import outbound
+import render_cache
+import sessions
+import webhook
+from update_processor import OrderedUpdateProcessor
 
-load_dotenv()
 TOKEN = os.getenv("TELEGRAM_TOKEN")
+# polling или webhook
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+# Другой адрес Bot API (например, локальный fake_telegram.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
 
-def main():
-    init_db()
-    
-    app = Application.builder().token(TOKEN).build()
+async def on_startup(app: Application):
+    """Восстановить сессии опросов, запустить запись кликов и сервер метрик"""
+    sessions.load_snapshot()
+    start_click_buffer()
+    await metrics.start_server()
+
+async def on_stop(app: Application):
+    """Дослать ответы из очереди исходящих запросов, пока бот еще открыт"""
+    await outbound.drain()
+
+async def on_shutdown(app: Application):
+    """Сохранить сессии, дождаться запросов к БД, сбросить клики и закрыть соединения"""
+    sessions.save_snapshot()
+    await metrics.stop_server()
+    async_db.shutdown()
+    stop_click_buffer()
+    close_all()
+
+def build_app() -> Application:
+    """Собрать приложение с обработчиками"""
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(OrderedUpdateProcessor())
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL.rstrip('/')}/bot")
+    app = builder.build()
     
     # Команды
     app.add_handler(CommandHandler("start", start))
@@ -19,8 +63,21 @@ def main():
     # Обработка кнопок
     app.add_handler(CallbackQueryHandler(button_callback))
     
-    print("Бот запущен...")
-    app.run_polling()
+    app.add_error_handler(error_handler)
+    return app
+
+def main():
+    init_db()
+    warm_poll_cache()
+    render_cache.warm()
+    
+    app = build_app()
+    
+    print(f"Бот запущен ({RUN_MODE})...")
+    if RUN_MODE == "webhook":
+        webhook.run(app)
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
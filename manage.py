@@ -0,0 +1,278 @@
+"""
+Служебные команды обслуживания БД
+
+    python manage.py migrate       Применить миграции схемы
+    python manage.py check-plans   Проверить планы горячих запросов
+    python manage.py rebuild-tallies [--poll ID] [--check]
+                                   Пересчитать счетчики ответов
+    python manage.py compact-clicks
+                                   Свернуть новые клики в агрегаты
+    python manage.py export --poll ID --out FILE.csv|FILE.jsonl
+                                   Выгрузить ответы опроса
+    python manage.py broadcast --poll ID [--audience clicks|non-responders] [--text TEXT]
+    python manage.py broadcast --resume BID [--retry-failed]
+                                   Разослать приглашения пройти опрос
+    python manage.py broadcast-status [BID]
+                                   Прогресс рассылок
+    python manage.py archive-clicks [--days N] [--limit N] [--dry-run] [--setup-vacuum]
+                                   Перенести старые клики в архивы по месяцам
+    python manage.py archive-status
+                                   Архивы кликов и свободное место в БД
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from dotenv import load_dotenv
+
+# До импорта модулей бота: они читают настройки из окружения при импорте
+load_dotenv()
+
+import broadcast
+import click_analytics
+import database
+import retention
+from export import export_responses
+from migrations import check_query_plans, get_schema_version, migrate
+from db_pool import get_connection
+
+
+def cmd_migrate(args):
+    """Применить миграции"""
+    before = get_schema_version(get_connection(database.DB_NAME))
+    after = migrate(database.DB_NAME)
+    print(f"Версия схемы: {before} -> {after}")
+    return 0
+
+
+def cmd_check_plans(args):
+    """Проверить, что горячие запросы используют индексы"""
+    migrate(database.DB_NAME)
+    problems = check_query_plans(database.DB_NAME)
+
+    if not problems:
+        print("✅ Все горячие запросы используют индексы")
+        return 0
+
+    for name, plan in problems:
+        print(f"❌ {name}: полный проход таблицы")
+        for step in plan:
+            print(f"     {step}")
+    return 1
+
+
+def cmd_rebuild_tallies(args):
+    """Пересчитать счетчики ответов и сверить их с сырыми ответами"""
+    migrate(database.DB_NAME)
+    mismatches = database.check_answer_tallies(args.poll)
+
+    for poll_id, q_idx, answer, stored, actual in mismatches:
+        print(f"≠ {poll_id} q_{q_idx} {answer!r}: в счетчиках {stored}, по ответам {actual}")
+    print(f"Расхождений: {len(mismatches)}")
+
+    if args.check:
+        return 1 if mismatches else 0
+
+    rows = database.rebuild_answer_tallies(args.poll)
+    remaining = database.check_answer_tallies(args.poll)
+    print(f"Пересчитано строк счетчиков: {rows}, расхождений после: {len(remaining)}")
+    return 1 if remaining else 0
+
+
+def cmd_compact_clicks(args):
+    """Свернуть еще не учтенные клики в почасовые/посуточные агрегаты"""
+    migrate(database.DB_NAME)
+    folded = click_analytics.compact_clicks()
+    print(f"Свернуто кликов: {folded}")
+    return 0
+
+
+def cmd_export(args):
+    """Выгрузить ответы опроса в CSV/JSONL потоково"""
+    progress = lambda rows, rate: print(f"  {rows} строк, {rate:.0f} строк/с")
+    result = export_responses(args.poll, args.out, fmt=args.format, progress=progress)
+    print(
+        f"✅ {args.out}: {result['rows']} строк за {result['seconds']} с "
+        f"({result['rows_per_sec']} строк/с)"
+    )
+    return 0
+
+
+def _print_broadcast(info):
+    counts = info["counts"]
+    print(
+        f"#{info['id']} {info['poll_id']} ({info['audience']}) {info['status']}: "
+        f"всего {info['total']}, отправлено {counts['sent']}, заблокировали {counts['blocked']}, "
+        f"ошибок {counts['failed']}, пропущено {counts['skipped']}, осталось {counts['pending']}"
+        + (f", неизвестно {counts['sending']}" if counts["sending"] else "")
+    )
+
+
+def cmd_broadcast(args):
+    """Создать рассылку (или продолжить прерванную) и разослать приглашения"""
+    migrate(database.DB_NAME)
+    if args.resume:
+        broadcast_id = args.resume
+        if args.retry_failed:
+            print(f"Возвращено в очередь после ошибок: {broadcast.retry_failed(broadcast_id)}")
+    elif args.poll:
+        broadcast_id = broadcast.create_broadcast(args.poll, args.audience, args.text)
+        print(f"Создана рассылка #{broadcast_id}")
+    else:
+        print("Нужен --poll или --resume")
+        return 2
+
+    info = broadcast.get_broadcast(broadcast_id)
+    if info is None:
+        print(f"Рассылка #{broadcast_id} не найдена")
+        return 1
+    _print_broadcast(info)
+    if args.dry_run:
+        return 0
+
+    def progress(stats):
+        eta = f"{stats['eta']:.0f} с" if stats["eta"] is not None else "?"
+        print(
+            f"  отправлено {stats['sent']}, заблокировали {stats['blocked']}, ошибок {stats['failed']}, "
+            f"осталось {stats['remaining']}, {stats['rate']:.1f} сообщений/с, ETA {eta}"
+        )
+
+    # Без строки лога на каждое сообщение
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    async def run():
+        async with broadcast.make_bot() as bot:
+            return await broadcast.run_broadcast(
+                broadcast_id, bot, rate=args.rate or broadcast.BROADCAST_RATE, progress=progress
+            )
+
+    info = asyncio.run(run())
+    _print_broadcast(info)
+    return 0 if info["status"] == "done" else 1
+
+
+def cmd_broadcast_status(args):
+    """Показать прогресс рассылок"""
+    migrate(database.DB_NAME)
+    if args.id:
+        info = broadcast.get_broadcast(args.id)
+        if info is None:
+            print(f"Рассылка #{args.id} не найдена")
+            return 1
+        _print_broadcast(info)
+        return 0
+    for info in broadcast.list_broadcasts():
+        _print_broadcast(info)
+    return 0
+
+
+def _print_vacuum(status):
+    size = status["page_count"] * status["page_size"] / 1024 / 1024
+    free = status["freelist_count"] * status["page_size"] / 1024 / 1024
+    print(f"БД: {size:.1f} МБ, свободно {free:.1f} МБ, auto_vacuum={status['auto_vacuum']}")
+
+
+def cmd_archive_clicks(args):
+    """Перенести клики старше срока хранения в архивы и освободить место"""
+    migrate(database.DB_NAME)
+    conn = get_connection(database.DB_NAME)
+    if args.setup_vacuum:
+        print("Перестройка БД для auto_vacuum=INCREMENTAL (запись блокируется)...")
+        changed = retention.enable_incremental_vacuum(database.DB_NAME)
+        print("✅ Готово" if changed else "auto_vacuum=INCREMENTAL уже включен")
+
+    # Сначала свернуть новые клики: переносятся только учтенные в агрегатах
+    click_analytics.compact_clicks()
+    if args.dry_run:
+        months = retention.pending(database.DB_NAME, args.days)
+        for month, count in months.items():
+            print(f"  {month}: {count}")
+        print(f"Будет перенесено кликов: {sum(months.values())}")
+        _print_vacuum(retention.vacuum_status(conn))
+        return 0
+
+    started = time.perf_counter()
+    moved = retention.archive_clicks(database.DB_NAME, args.days, args.batch, limit=args.limit)
+    for month, count in moved.items():
+        print(f"  {month}: {count} -> {retention.archive_path(month)}")
+    print(f"Перенесено кликов: {sum(moved.values())} за {time.perf_counter() - started:.1f} с")
+
+    if not args.no_vacuum:
+        pages = retention.incremental_vacuum(database.DB_NAME)
+        print(f"Возвращено страниц файлу: {pages}")
+    _print_vacuum(retention.vacuum_status(conn))
+    return 0
+
+
+def cmd_archive_status(args):
+    """Показать архивы кликов и заполненность БД"""
+    migrate(database.DB_NAME)
+    conn = get_connection(database.DB_NAME)
+    for archive in retention.list_archives(conn):
+        print(f"  {archive['month']}: {archive['clicks']} кликов (id {archive['first_id']}..{archive['last_id']}), "
+              f"{archive['path']}, обновлен {archive['archived_at']}")
+    print(f"Кликов в БД: {conn.execute('SELECT COUNT(*) FROM clicks').fetchone()[0]}, "
+          f"срок хранения {retention.CLICK_RETENTION_DAYS} дн.")
+    _print_vacuum(retention.vacuum_status(conn))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обслуживание БД бота")
+    parser.add_argument("--db", help="путь к файлу БД (по умолчанию bot_data.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("migrate", help="применить миграции схемы").set_defaults(func=cmd_migrate)
+    sub.add_parser("check-plans", help="проверить планы горячих запросов").set_defaults(func=cmd_check_plans)
+
+    rebuild = sub.add_parser("rebuild-tallies", help="пересчитать счетчики ответов")
+    rebuild.add_argument("--poll", help="только для одного опроса")
+    rebuild.add_argument("--check", action="store_true", help="только сверить, не пересчитывать")
+    rebuild.set_defaults(func=cmd_rebuild_tallies)
+
+    sub.add_parser("compact-clicks", help="свернуть клики в агрегаты").set_defaults(func=cmd_compact_clicks)
+
+    export = sub.add_parser("export", help="выгрузить ответы опроса в CSV/JSONL")
+    export.add_argument("--poll", required=True, help="ID опроса")
+    export.add_argument("--out", required=True, help="файл .csv или .jsonl")
+    export.add_argument("--format", choices=("csv", "jsonl"), help="формат (по умолчанию по расширению)")
+    export.set_defaults(func=cmd_export)
+
+    send = sub.add_parser("broadcast", help="разослать приглашения пройти опрос")
+    send.add_argument("--poll", help="ID опроса (новая рассылка)")
+    send.add_argument("--audience", choices=broadcast.AUDIENCES, default="non-responders",
+                      help="кому: всем нажимавшим кнопки или еще не прошедшим опрос")
+    send.add_argument("--text", help="текст приглашения (по умолчанию название и описание опроса)")
+    send.add_argument("--resume", type=int, metavar="BID", help="продолжить рассылку")
+    send.add_argument("--retry-failed", action="store_true", help="с --resume: повторить ошибки")
+    send.add_argument("--rate", type=float, help="сообщений в секунду (по умолчанию BROADCAST_RATE)")
+    send.add_argument("--dry-run", action="store_true", help="только создать и показать получателей")
+    send.set_defaults(func=cmd_broadcast)
+
+    status = sub.add_parser("broadcast-status", help="прогресс рассылок")
+    status.add_argument("id", nargs="?", type=int, metavar="BID", help="ID рассылки")
+    status.set_defaults(func=cmd_broadcast_status)
+
+    archive = sub.add_parser("archive-clicks", help="перенести старые клики в архивы по месяцам")
+    archive.add_argument("--days", type=int, help="срок хранения в днях (по умолчанию CLICK_RETENTION_DAYS)")
+    archive.add_argument("--batch", type=int, help="кликов в пачке (по умолчанию CLICK_ARCHIVE_BATCH)")
+    archive.add_argument("--limit", type=int, help="не больше стольких кликов за запуск")
+    archive.add_argument("--dry-run", action="store_true", help="только показать, сколько будет перенесено")
+    archive.add_argument("--no-vacuum", action="store_true", help="не возвращать место файлу БД")
+    archive.add_argument("--setup-vacuum", action="store_true",
+                         help="однократно перестроить БД для incremental vacuum (остановите бота)")
+    archive.set_defaults(func=cmd_archive_clicks)
+
+    sub.add_parser("archive-status", help="архивы кликов и место в БД").set_defaults(func=cmd_archive_status)
+
+    args = parser.parse_args(argv)
+    if args.db:
+        database.DB_NAME = args.db
+        click_analytics.DB_PATH = args.db
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
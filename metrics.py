@@ -0,0 +1,243 @@
+"""
+Метрики бота в формате Prometheus
+
+Гистограммы задержек обработчиков и запросов к БД, счетчики кликов,
+ответов и ошибок. Метрики отдаются по HTTP (GET /metrics) небольшим
+aiohttp-сервером. Без METRICS_ENABLED=1 обработчики не оборачиваются,
+а inc/observe сразу возвращаются.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from logger import logger
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Границы корзин в секундах
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registry = []
+_runner = None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики по корзинам (+Inf последней), сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        if not METRICS_ENABLED:
+            return
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][idx] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = ("le", bound if bound == "+Inf" else repr(float(bound)))
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+class Gauge:
+    """Значение, снимаемое функцией в момент запроса метрик"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        _registry.append(self)
+
+    def samples(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.error(f"Metrics gauge {self.name} failed: {e}")
+            return
+        if value is not None:
+            yield f"{self.name} {value}"
+
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_seconds", "Время обработки обновления", labels=("handler",)
+)
+DB_QUERY_LATENCY = Histogram(
+    "bot_db_query_seconds", "Время выполнения запроса к БД в потоке пула", labels=("query",)
+)
+DB_QUEUE_WAIT = Histogram(
+    "bot_db_queue_wait_seconds", "Ожидание свободного потока пула БД"
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", labels=("handler",)
+)
+CLICKS_LOGGED = Counter("bot_clicks_logged_total", "Залогированные клики")
+RESPONSES_SAVED = Counter(
+    "bot_responses_saved_total", "Сохраненные ответы", labels=("poll_id",)
+)
+ERRORS = Counter("bot_errors_total", "Ошибки из error_handler", labels=("type",))
+OUTBOUND_WAIT = Histogram(
+    "bot_outbound_wait_seconds", "Ожидание запроса к Bot API в очереди", labels=("priority",)
+)
+OUTBOUND_COALESCED = Counter(
+    "bot_outbound_coalesced_total", "Изменения сообщений, замененные более новыми"
+)
+OUTBOUND_RETRY_AFTER = Counter("bot_outbound_retry_after_total", "Ответы RetryAfter от Bot API")
+OUTBOUND_FAILED = Counter(
+    "bot_outbound_failed_total", "Неотправленные запросы к Bot API", labels=("method",)
+)
+REPORT_RENDER = Histogram(
+    "bot_report_render_seconds", "Построение страницы отчета", labels=("report",)
+)
+REPORT_CACHE = Counter(
+    "bot_report_cache_total", "Обращения к кэшу отчетов", labels=("result",)
+)
+
+
+def _click_queue_depth():
+    from click_analytics import get_click_buffer_stats
+    return get_click_buffer_stats().get("queue_depth")
+
+
+def _responded_index_bytes():
+    from database import get_responded_index_stats
+    return get_responded_index_stats()["memory_bytes"]
+
+
+def _active_sessions():
+    from sessions import store
+    return len(store)
+
+
+def _outbound_pending():
+    from outbound import get_outbound_stats
+    return get_outbound_stats()["pending"]
+
+
+Gauge("bot_click_buffer_queue_depth", "Клики в очереди на запись", _click_queue_depth)
+Gauge("bot_responded_index_bytes", "Память индекса ответивших", _responded_index_bytes)
+Gauge("bot_poll_sessions_active", "Незавершенные сессии опросов", _active_sessions)
+Gauge("bot_outbound_pending", "Запросы к Bot API в очереди", _outbound_pending)
+
+
+def timed_handler(func):
+    """Замерять время async-обработчика (без метрик - функция как есть)"""
+    if not METRICS_ENABLED:
+        return func
+
+    name = func.__name__
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+async def start_server(host=None, port=None):
+    """Поднять HTTP-сервер /metrics (если метрики включены)"""
+    global _runner
+    if not METRICS_ENABLED or _runner is not None:
+        return
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    site = web.TCPSite(_runner, host or METRICS_HOST, port or METRICS_PORT)
+    await site.start()
+    logger.info(f"Metrics endpoint on http://{host or METRICS_HOST}:{port or METRICS_PORT}/metrics")
+
+
+async def stop_server():
+    """Остановить HTTP-сервер метрик"""
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
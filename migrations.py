@@ -0,0 +1,440 @@
+"""
+Версионированные миграции схемы БД
+
+Каждая миграция применяется один раз в своей транзакции, номер
+примененной версии хранится в таблице schema_version. Существующий
+bot_data.db обновляется на месте: базовые таблицы создаются через
+IF NOT EXISTS и просто "принимаются" в версию 1.
+"""
+import answer_codec
+import click_rollups
+import funnel
+import hll
+import tallies
+from db_pool import get_connection
+from logger import logger
+
+
+def _backfill_answer_tallies(conn):
+    """Посчитать счетчики ответов по уже сохраненным ответам"""
+    tallies.rebuild(conn)
+
+
+def _backfill_click_rollups(conn):
+    """Свернуть в агрегаты уже накопленные клики"""
+    click_rollups.compact(conn)
+
+
+def _pack_existing_answers(conn):
+    """Перекодировать сохраненные JSON-ответы в компактный формат"""
+    packed = answer_codec.pack_existing(conn)
+    logger.info(f"Packed {packed} stored responses")
+
+
+def _rekey_answer_layouts(conn):
+    """Наборы вариантов под 32-битным отпечатком (формат ответов версии 2)"""
+    answer_codec.rekey_layouts(conn)
+
+
+def _backfill_funnel(conn):
+    """Разобрать в воронку уже накопленные клики"""
+    funnel.update(conn)
+
+
+def _backfill_click_sketches(conn):
+    """Построить скетчи уникальных пользователей по накопленным кликам"""
+    hll.update(conn)
+
+
+def _backfill_click_users(conn):
+    """Собрать click_users по накопленным кликам, включая архивы"""
+    import retention
+    click_rollups.merge_users(conn, retention.iter_history(
+        conn, "SELECT user_id, MIN(clicked_at), MAX(clicked_at) FROM clicks GROUP BY user_id"
+    ))
+    # Учтены все клики, в том числе перенесенные, даже если clicks пуста
+    max_id = max(row[0] or 0 for row in retention.iter_history(conn, "SELECT MAX(id) FROM clicks"))
+    click_rollups.set_watermark(conn, max_id, click_rollups.USERS_STATE)
+
+
+# (версия, описание, список SQL-выражений или функций conn -> None)
+MIGRATIONS = [
+    (1, "Базовые таблицы: polls, responses, clicks", [
+        """
+        CREATE TABLE IF NOT EXISTS polls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            poll_id TEXT UNIQUE,
+            title TEXT NOT NULL,
+            description TEXT,
+            questions TEXT NOT NULL,
+            image_url TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            poll_id TEXT NOT NULL,
+            answers TEXT NOT NULL,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (poll_id) REFERENCES polls(poll_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS clicks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            button_name TEXT NOT NULL,
+            callback_data TEXT,
+            poll_id TEXT,
+            question_idx INTEGER,
+            clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "Индексы для проверок ответов и аналитики кликов", [
+        "CREATE INDEX IF NOT EXISTS idx_responses_poll_user ON responses(poll_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_responses_user ON responses(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_clicks_poll_question_user ON clicks(poll_id, question_idx, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_clicks_clicked_at ON clicks(clicked_at)",
+        "CREATE INDEX IF NOT EXISTS idx_clicks_user ON clicks(user_id, button_name)",
+    ]),
+    (3, "Счетчики ответов answer_tallies", [
+        """
+        CREATE TABLE IF NOT EXISTS answer_tallies (
+            poll_id TEXT NOT NULL,
+            question_idx INTEGER NOT NULL,
+            answer TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (poll_id, question_idx, answer)
+        ) WITHOUT ROWID
+        """,
+        _backfill_answer_tallies,
+    ]),
+    (4, "Почасовые и посуточные агрегаты кликов", [
+        """
+        CREATE TABLE IF NOT EXISTS click_rollups (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            poll_id TEXT NOT NULL DEFAULT '',
+            button_name TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket, poll_id, button_name)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_click_rollups_poll ON click_rollups(granularity, poll_id, bucket)",
+        """
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            last_click_id INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        _backfill_click_rollups,
+    ]),
+    (5, "Индекс для постраничного чтения ответов опроса", [
+        "CREATE INDEX IF NOT EXISTS idx_responses_poll_id ON responses(poll_id, id)",
+    ]),
+    (6, "Компактное хранение ответов и наборы вариантов poll_layouts", [
+        """
+        CREATE TABLE IF NOT EXISTS poll_layouts (
+            poll_id TEXT NOT NULL,
+            fingerprint INTEGER NOT NULL,
+            options TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (poll_id, fingerprint)
+        )
+        """,
+        _pack_existing_answers,
+    ]),
+    (7, "Рассылки приглашений: broadcasts и получатели", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            poll_id TEXT NOT NULL,
+            audience TEXT NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            total INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            sent_at TIMESTAMP,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status "
+        "ON broadcast_recipients(broadcast_id, status, user_id)",
+    ]),
+    (8, "Воронка по сессиям: funnel_steps, funnel_timings, funnel_sessions", [
+        """
+        CREATE TABLE IF NOT EXISTS funnel_steps (
+            poll_id TEXT NOT NULL,
+            step INTEGER NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (poll_id, step)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS funnel_timings (
+            poll_id TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            step INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (poll_id, metric, step, bucket)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS funnel_sessions (
+            user_id INTEGER NOT NULL,
+            poll_id TEXT NOT NULL,
+            started_at INTEGER NOT NULL,
+            step INTEGER NOT NULL,
+            last_at INTEGER NOT NULL,
+            PRIMARY KEY (user_id, poll_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_funnel_sessions_last_at ON funnel_sessions(last_at)",
+        _backfill_funnel,
+    ]),
+    (9, "Скетчи уникальных пользователей click_sketches", [
+        """
+        CREATE TABLE IF NOT EXISTS click_sketches (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            registers BLOB NOT NULL,
+            PRIMARY KEY (scope, key)
+        )
+        """,
+        _backfill_click_sketches,
+    ]),
+    (10, "Архивы кликов по месяцам click_archives", [
+        """
+        CREATE TABLE IF NOT EXISTS click_archives (
+            month TEXT PRIMARY KEY,
+            clicks INTEGER NOT NULL DEFAULT 0,
+            first_id INTEGER,
+            last_id INTEGER,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (11, "Все когда-либо кликавшие пользователи click_users", [
+        """
+        CREATE TABLE IF NOT EXISTS click_users (
+            user_id INTEGER PRIMARY KEY,
+            first_click_at TIMESTAMP,
+            last_click_at TIMESTAMP
+        )
+        """,
+        _backfill_click_users,
+    ]),
+    (12, "Полный 32-битный отпечаток наборов вариантов poll_layouts", [
+        _rekey_answer_layouts,
+    ]),
+]
+
+# Горячие запросы, которые не должны вырождаться в полный проход таблицы
+HOT_QUERIES = [
+    ("user_already_responded",
+     "SELECT 1 FROM responses WHERE user_id = ? AND poll_id = ? LIMIT 1", (1, "poll_1")),
+    ("responded index load",
+     "SELECT user_id FROM responses WHERE poll_id = ?", ("poll_1",)),
+    ("iter_response_chunks",
+     """SELECT id, user_id, answers, completed_at FROM responses
+        WHERE poll_id = ? AND id > ? ORDER BY id LIMIT ?""", ("poll_1", 0, 1000)),
+    ("iter_raw_answer_chunks",
+     """SELECT id, answers FROM responses
+        WHERE poll_id = ? AND id > ? ORDER BY id LIMIT ?""", ("poll_1", 0, 1000)),
+    ("get_user_responses",
+     "SELECT poll_id, answers, completed_at FROM responses WHERE user_id = ? ORDER BY completed_at", (1,)),
+    ("get_answer_tallies",
+     """SELECT question_idx, answer, count FROM answer_tallies
+        WHERE poll_id = ? AND count > 0""", ("poll_1",)),
+    ("report version(poll)",
+     "SELECT MAX(id) FROM responses WHERE poll_id = ?", ("poll_1",)),
+    ("report version(clicks)",
+     "SELECT MAX(id) FROM clicks", ()),
+    # Чтения агрегатов кликов (click_rollups.counts_by_button/counts_by_bucket)
+    ("click_rollups by button",
+     """SELECT button_name, SUM(count) FROM click_rollups
+        WHERE granularity = 'day' GROUP BY button_name""", ()),
+    ("click_rollups by button(poll_id)",
+     """SELECT button_name, SUM(count) FROM click_rollups
+        WHERE granularity = 'day' AND poll_id = ? GROUP BY button_name""", ("poll_1",)),
+    ("click_rollups by bucket",
+     """SELECT bucket, SUM(count) FROM click_rollups
+        WHERE granularity = ? AND bucket >= ? GROUP BY bucket""", ("day", "2026-01-01")),
+    ("click_rollups by bucket(poll_id)",
+     """SELECT bucket, SUM(count) FROM click_rollups
+        WHERE granularity = ? AND bucket >= ? AND poll_id = ? GROUP BY bucket""",
+     ("day", "2026-01-01", "poll_1")),
+    ("clicks tail",
+     "SELECT button_name, COUNT(*) FROM clicks WHERE id > ? GROUP BY button_name", (0,)),
+    ("clicks tail(poll_id)",
+     "SELECT button_name, COUNT(*) FROM clicks WHERE id > ? AND +poll_id = ? GROUP BY button_name",
+     (0, "poll_1")),
+    ("clicks tail by bucket",
+     """SELECT strftime(?, clicked_at), COUNT(*) FROM clicks
+        WHERE id > ? AND +clicked_at >= ? AND +poll_id = ? GROUP BY 1""",
+     ("%Y-%m-%d", 0, "2026-01-01", "poll_1")),
+    # Сворачивание новых кликов после записи пачки (_after_write)
+    ("rollup fold", click_rollups._FOLD_SQL, ("day", "%Y-%m-%d", 0, 1000)),
+    ("click users tail", click_rollups._USERS_SQL, (0, 1000)),
+    ("funnel events", funnel._EVENTS_SQL, (0, 1000)),
+    ("funnel sessions",
+     """SELECT user_id, poll_id, started_at, step, last_at FROM funnel_sessions
+        WHERE user_id IN (?, ?)""", (1, 2)),
+    ("funnel sessions expiry",
+     "DELETE FROM funnel_sessions WHERE last_at < ?", (0,)),
+    ("funnel poll questions",
+     "SELECT poll_id, questions FROM polls WHERE poll_id IN (?, ?)", ("poll_1", "poll_2")),
+    ("get_click_funnel",
+     "SELECT step, sessions FROM funnel_steps WHERE poll_id = ? ORDER BY step", ("poll_1",)),
+    ("funnel timings",
+     """SELECT metric, step, bucket, count FROM funnel_timings
+        WHERE poll_id = ? ORDER BY metric, step, bucket""", ("poll_1",)),
+    ("sketch update",
+     """SELECT user_id, poll_id, question_idx, substr(clicked_at, 1, 10)
+        FROM clicks WHERE id > ? AND id <= ?""", (0, 1000)),
+    ("click sketch",
+     "SELECT registers FROM click_sketches WHERE scope = ? AND key = ?", ("poll", "poll_1")),
+    ("click sketch keys",
+     "SELECT key FROM click_sketches WHERE scope = 'question' AND key >= ? AND key < ?",
+     ("poll_1:", "poll_1:\uffff")),
+    ("click sketch tail(poll)",
+     "SELECT user_id FROM clicks WHERE id > ? AND +poll_id = ?", (0, "poll_1")),
+    ("click sketch tail(question)",
+     "SELECT user_id FROM clicks WHERE id > ? AND +poll_id = ? AND +question_idx = ?",
+     (0, "poll_1", 0)),
+    ("click sketch tail(day)",
+     "SELECT user_id FROM clicks WHERE id > ? AND +clicked_at >= ? AND +clicked_at < date(?, '+1 day')",
+     (0, "2026-01-01", "2026-01-01")),
+    ("question_keys tail",
+     "SELECT question_idx FROM clicks WHERE id > ? AND +poll_id = ? AND question_idx IS NOT NULL",
+     (0, "poll_1")),
+    ("retention cutoff",
+     "SELECT MAX(id) FROM clicks WHERE clicked_at < ?", ("2026-01-01 00:00:00",)),
+    ("retention pending",
+     """SELECT substr(clicked_at, 1, 7), COUNT(*) FROM clicks
+        WHERE clicked_at < ? AND id <= ? GROUP BY 1 ORDER BY 1""", ("2026-01-01 00:00:00", 1000)),
+    ("retention batch",
+     """SELECT id, user_id, button_name, callback_data, poll_id, question_idx, clicked_at FROM clicks
+        WHERE id > ? AND id <= ? AND +clicked_at < ? ORDER BY id LIMIT ?""",
+     (0, 1000, "2026-01-01 00:00:00", 2000)),
+    ("get_user_clicks",
+     """SELECT button_name, COUNT(*) as count FROM clicks
+        WHERE user_id = ? GROUP BY button_name""", (1,)),
+    ("get_user_clicks(history)",
+     "SELECT id, button_name FROM clicks WHERE user_id = ?", (1,)),
+    ("get_user_engagement",
+     "SELECT COUNT(*) FROM clicks WHERE user_id = ?", (1,)),
+    ("get_user_engagement dates",
+     "SELECT MIN(clicked_at), MAX(clicked_at) FROM clicks WHERE user_id = ?", (1,)),
+    ("get_user_engagement responses",
+     "SELECT COUNT(*) FROM responses WHERE user_id = ?", (1,)),
+    ("broadcast claim",
+     """SELECT user_id FROM broadcast_recipients
+        WHERE broadcast_id = ? AND status = 'pending' ORDER BY user_id LIMIT ?""", (1, 50)),
+    # Как в broadcast.AUDIENCE_SQL["non-responders"]
+    ("broadcast audience",
+     """SELECT user_id FROM (
+            SELECT user_id FROM click_users
+            UNION SELECT user_id FROM clicks WHERE id > :users_watermark
+        )
+        WHERE user_id NOT IN (SELECT user_id FROM responses WHERE poll_id = :poll_id)""",
+     {"users_watermark": 0, "poll_id": "poll_1"}),
+]
+
+
+def _ensure_version_table(conn):
+    """Создать таблицу версий схемы"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def get_schema_version(conn) -> int:
+    """Текущая версия схемы (0 для пустой БД)"""
+    _ensure_version_table(conn)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(db_path) -> int:
+    """Применить недостающие миграции; вернуть итоговую версию"""
+    conn = get_connection(db_path)
+    _ensure_version_table(conn)
+
+    for version, description, steps in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+
+        # BEGIN IMMEDIATE сериализует параллельные запуски миграций
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        logger.info(f"Schema migrated to version {version}: {description}")
+
+    return get_schema_version(conn)
+
+
+# Запросы, которым полный проход нужен по смыслу: имя -> таблицы
+FULL_SCAN_ALLOWED = {
+    # Аудитория рассылки - все кликавшие пользователи
+    "broadcast audience": ("click_users",),
+}
+
+
+def explain(conn, sql, params=()) -> list:
+    """План выполнения запроса (строки EXPLAIN QUERY PLAN)"""
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row[3] for row in rows]
+
+
+def check_query_plans(db_path) -> list:
+    """Проверить горячие запросы; вернуть список (имя, план) с полным сканом"""
+    conn = get_connection(db_path)
+    problems = []
+
+    for name, sql, params in HOT_QUERIES:
+        plan = explain(conn, sql, params)
+        # Проход по покрывающему индексу - тоже полный проход; SCAN (subquery-N) -
+        # чтение уже выбранных строк подзапроса, его шаги проверяются отдельно
+        allowed = FULL_SCAN_ALLOWED.get(name, ())
+        if any(
+            step.startswith("SCAN") and not step.split()[1].startswith("(")
+            and step.split()[1] not in allowed
+            for step in plan
+        ):
+            problems.append((name, plan))
+
+    return problems
@@ -0,0 +1,400 @@
+"""
+Очередь исходящих запросов к Bot API
+
+Обработчики не вызывают Telegram напрямую, а ставят запрос в очередь
+(answer, edit_text, reply_text); фоновая задача отправляет запросы с
+учетом лимитов:
+
+- общий лимит бота (OUTBOUND_RATE сообщений/с, всплеск OUTBOUND_BURST);
+- лимит на чат (OUTBOUND_CHAT_RATE сообщений/с, всплеск
+  OUTBOUND_CHAT_BURST);
+- запросы одного чата уходят строго по порядку, разных чатов - по
+  приоритету (USER, затем ADMIN, затем BROADCAST), затем по времени
+  постановки;
+- новое изменение того же сообщения заменяет еще не отправленное:
+  пользователь увидит только последний экран;
+- на RetryAfter отправка приостанавливается на указанное время, и
+  запрос повторяется (до OUTBOUND_MAX_RETRIES раз).
+
+Ответы на нажатия кнопок (answerCallbackQuery) - не сообщения: они
+уходят сразу, без очереди и лимитов, иначе у пользователя крутятся
+часики на кнопке.
+
+Вызов возвращает asyncio.Future с результатом; ждать его не нужно
+(wait=True - дождаться отправки). Ошибки отправки логируются.
+OUTBOUND_ENABLED=0 - запросы выполняются сразу, как раньше.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+
+from telegram.error import BadRequest, RetryAfter
+
+import metrics
+from logger import logger
+
+OUTBOUND_ENABLED = os.getenv("OUTBOUND_ENABLED", "1") == "1"
+# За любую секунду уходит не больше rate + burst сообщений: 25 в сумме
+# (запас до лимита Telegram в 30) и 3 в чат
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "20"))
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "5"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "2"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Приоритеты: меньше - раньше
+USER = 0
+ADMIN = 1
+BROADCAST = 2
+
+# Сколько лимитов чатов хранить, прежде чем удалять восполненные
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Ведро токенов: rate в секунду, не больше capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now) -> float:
+        """Через сколько секунд будет токен (0 - уже есть)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, now, seconds):
+        """Не выдавать токены seconds секунд"""
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+        self.updated = now
+
+    def full(self, now) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Request:
+    __slots__ = ("chat_id", "method", "call", "priority", "seq", "key",
+                 "futures", "submitted", "retries")
+
+    def __init__(self, chat_id, method, call, priority, seq, key, future):
+        self.chat_id = chat_id
+        self.method = method
+        self.call = call
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.futures = [future]
+        self.submitted = time.monotonic()
+        self.retries = 0
+
+
+class Scheduler:
+    """Отправка запросов с лимитами, приоритетами и склейкой изменений"""
+
+    def __init__(self, rate=OUTBOUND_RATE, burst=OUTBOUND_BURST, chat_rate=OUTBOUND_CHAT_RATE,
+                 chat_burst=OUTBOUND_CHAT_BURST, max_retries=OUTBOUND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(rate, burst)
+        self._buckets = {}
+        # чат -> очередь запросов; голова очереди - в _ready или _sleeping
+        self._queues = {}
+        self._ready = []
+        self._sleeping = []
+        self._scheduled = set()
+        # чаты, запрос которых сейчас отправляется
+        self._busy = set()
+        # (чат, сообщение) -> еще не отправленное изменение
+        self._edits = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._loop = None
+        self._sending = set()
+        self._unqueued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failed = 0
+
+    # ---- постановка в очередь ----
+
+    def submit(self, chat_id, method, call, priority=USER, key=None, queued=True):
+        """Поставить запрос (call - функция без аргументов, возвращающая корутину)
+
+        queued=False - отправить сразу, без очереди чата и лимитов.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Новый цикл событий (перезапуск): прежняя задача отправки мертва
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = None
+        future = loop.create_future()
+
+        pending = self._edits.get(key) if key is not None else None
+        if pending is not None:
+            # Прежнее изменение еще не ушло: отправим только новое
+            pending.call = call
+            pending.priority = min(pending.priority, priority)
+            pending.futures.append(future)
+            self.coalesced += 1
+            metrics.OUTBOUND_COALESCED.inc()
+            return future
+
+        request = _Request(chat_id, method, call, priority, next(self._seq), key, future)
+        if not queued:
+            self._unqueued += 1
+            self._spawn(self._send_now(request))
+            return future
+
+        self._queues.setdefault(chat_id, deque()).append(request)
+        if key is not None:
+            self._edits[key] = request
+        self._schedule(chat_id)
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+        return future
+
+    def _schedule(self, chat_id):
+        """Поставить голову очереди чата в кандидаты на отправку"""
+        if chat_id in self._scheduled or chat_id in self._busy:
+            return
+        queue = self._queues.get(chat_id)
+        if not queue:
+            return
+        head = queue[0]
+        self._scheduled.add(chat_id)
+        heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._wakeup.set()
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                for idle in [c for c, b in self._buckets.items() if c not in self._queues and b.full(now)]:
+                    del self._buckets[idle]
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    # ---- отправка ----
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._sleeping and self._sleeping[0][0] <= now:
+                _, chat_id = heapq.heappop(self._sleeping)
+                head = self._queues[chat_id][0]
+                heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+            if not self._ready:
+                timeout = self._sleeping[0][0] - now if self._sleeping else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            wait = self._global.delay(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            bucket = self._bucket(chat_id)
+            wait = bucket.delay(now)
+            if wait > 0:
+                heapq.heappush(self._sleeping, (now + wait, chat_id))
+                continue
+            bucket.take()
+            self._global.take()
+
+            request = self._queues[chat_id].popleft()
+            if request.key is not None and self._edits.get(request.key) is request:
+                del self._edits[request.key]
+            self._scheduled.discard(chat_id)
+            self._busy.add(chat_id)
+            self._spawn(self._send(request))
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _perform(self, request):
+        """Выполнить запрос; вернуть паузу перед повтором или None"""
+        metrics.OUTBOUND_WAIT.observe(time.monotonic() - request.submitted, str(request.priority))
+        try:
+            result = await request.call()
+        except RetryAfter as e:
+            self.retried += 1
+            metrics.OUTBOUND_RETRY_AFTER.inc()
+            if request.retries < self.max_retries:
+                request.retries += 1
+                return float(e.retry_after)
+            self._fail(request, e)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                # Склеенное изменение совпало с текущим текстом
+                self._resolve(request, None)
+            else:
+                self._fail(request, e)
+        except Exception as e:
+            self._fail(request, e)
+        else:
+            self._resolve(request, result)
+        return None
+
+    async def _send_now(self, request):
+        try:
+            while (pause := await self._perform(request)) is not None:
+                await asyncio.sleep(pause)
+        finally:
+            self._unqueued -= 1
+
+    async def _send(self, request):
+        chat_id = request.chat_id
+        try:
+            pause = await self._perform(request)
+            if pause is not None:
+                # По ответу не понять, какой лимит превышен: ждут все чаты
+                now = time.monotonic()
+                self._global.pause(now, pause)
+                self._bucket(chat_id).pause(now, pause)
+                self._requeue(request)
+        finally:
+            self._busy.discard(chat_id)
+            if self._queues.get(chat_id):
+                self._schedule(chat_id)
+            elif chat_id in self._queues:
+                del self._queues[chat_id]
+
+    def _requeue(self, request):
+        """Вернуть запрос в начало очереди чата (после RetryAfter)"""
+        newer = self._edits.get(request.key) if request.key is not None else None
+        if newer is not None:
+            # За время отправки пришло новое изменение: отправим его
+            newer.futures.extend(request.futures)
+            return
+        self._queues.setdefault(request.chat_id, deque()).appendleft(request)
+        if request.key is not None:
+            self._edits[request.key] = request
+
+    def _resolve(self, request, result):
+        self.sent += 1
+        for future in request.futures:
+            if not future.done():
+                future.set_result(result)
+
+    def _fail(self, request, error):
+        self.failed += 1
+        metrics.OUTBOUND_FAILED.inc(request.method)
+        logger.error(f"Outbound {request.method} to chat {request.chat_id} failed: {error}")
+        for future in request.futures:
+            if not future.done():
+                future.set_exception(error)
+                # Ошибка уже в логе: не ругаться, если результат никто не ждет
+                future.exception()
+
+    # ---- состояние ----
+
+    def pending(self) -> int:
+        """Запросы в очереди и в отправке"""
+        return sum(len(q) for q in self._queues.values()) + len(self._busy) + self._unqueued
+
+    async def drain(self, timeout=10.0):
+        """Дождаться отправки всех запросов (при остановке бота)"""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        left = self.pending()
+        if left:
+            logger.warning(f"Outbound queue stopped with {left} unsent requests")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending(),
+            "chats": len(self._queues),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+scheduler = Scheduler()
+
+
+async def _submit(chat_id, method, call, priority, key=None, queued=True, wait=False):
+    future = scheduler.submit(chat_id, method, call, priority, key, queued)
+    return await future if wait else future
+
+
+def _chat_id(query):
+    return query.message.chat.id if query.message else query.from_user.id
+
+
+async def answer(query, text=None, show_alert=False, priority=USER, wait=False):
+    """Ответить на нажатие кнопки (query.answer)"""
+    if not OUTBOUND_ENABLED:
+        return await query.answer(text, show_alert=show_alert)
+    return await _submit(
+        _chat_id(query), "answerCallbackQuery", lambda: query.answer(text, show_alert=show_alert),
+        priority, queued=False, wait=wait,
+    )
+
+
+async def edit_text(query, text, reply_markup=None, priority=USER, wait=False):
+    """Изменить сообщение с кнопкой; неотправленное прежнее изменение отменяется"""
+    if not OUTBOUND_ENABLED:
+        return await query.edit_message_text(text, reply_markup=reply_markup)
+    key = (query.message.chat.id, query.message.message_id) if query.message else None
+    return await _submit(
+        _chat_id(query), "editMessageText",
+        lambda: query.edit_message_text(text, reply_markup=reply_markup),
+        priority, key=key, wait=wait,
+    )
+
+
+async def reply_text(message, text, reply_markup=None, priority=USER, wait=False):
+    """Отправить сообщение в чат message"""
+    if not OUTBOUND_ENABLED:
+        return await message.reply_text(text, reply_markup=reply_markup)
+    return await _submit(
+        message.chat.id, "sendMessage",
+        lambda: message.reply_text(text, reply_markup=reply_markup),
+        priority, wait=wait,
+    )
+
+
+async def drain(timeout=10.0):
+    """Дождаться отправки очереди"""
+    await scheduler.drain(timeout)
+
+
+def get_outbound_stats() -> dict:
+    return scheduler.stats()
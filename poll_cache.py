@@ -0,0 +1,95 @@
+"""
+Кэш определений опросов в памяти процесса
+
+Опросы меняются редко, а читаются на каждом экране вопроса и в каждом
+отчете, поэтому декодированный опрос хранится в LRU-кэше с TTL.
+Возвращаемые объекты неизменяемы: один экземпляр безопасно отдавать
+всем обработчикам.
+"""
+import os
+import threading
+from types import MappingProxyType
+
+from cachetools import TTLCache
+
+POLL_CACHE_SIZE = int(os.getenv("POLL_CACHE_SIZE", "256"))
+POLL_CACHE_TTL = int(os.getenv("POLL_CACHE_TTL", "3600"))
+
+
+def freeze(value):
+    """Рекурсивно превратить dict/list в неизменяемые MappingProxyType/tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class PollCache:
+    """LRU/TTL-кэш опросов с подсчетом попаданий"""
+
+    def __init__(self, loader, maxsize=POLL_CACHE_SIZE, ttl=POLL_CACHE_TTL):
+        self._loader = loader
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Растет при каждой инвалидации: загруженный до нее опрос не кладем
+        self._generation = 0
+
+    def get(self, poll_id):
+        """Получить опрос из кэша или загрузить его"""
+        with self._lock:
+            poll = self._cache.get(poll_id)
+            if poll is not None:
+                self.hits += 1
+                return poll
+            self.misses += 1
+            generation = self._generation
+
+        poll = self._loader(poll_id)
+        if poll is None:
+            return None
+
+        frozen = freeze(poll)
+        with self._lock:
+            if generation == self._generation:
+                self._cache[poll_id] = frozen
+        return frozen
+
+    def peek(self, poll_id):
+        """Опрос из кэша без загрузки и без учета в статистике (None, если его нет)"""
+        with self._lock:
+            return self._cache.get(poll_id)
+
+    def put(self, poll_id, poll):
+        """Положить опрос в кэш; вернуть неизменяемую копию"""
+        frozen = freeze(poll)
+        with self._lock:
+            self._cache[poll_id] = frozen
+        return frozen
+
+    def invalidate(self, poll_id=None):
+        """Сбросить один опрос или весь кэш"""
+        with self._lock:
+            if poll_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(poll_id, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Статистика попаданий и промахов"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "maxsize": int(self._cache.maxsize),
+                "ttl": self._cache.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,180 @@
+"""
+Готовые клавиатуры и тексты экранов бота
+
+Экран вопроса (текст и InlineKeyboardMarkup) строится один раз на опрос
+и дальше отдается всем обработчикам: объекты telegram неизменяемы, их
+можно переиспользовать между обновлениями. Кэш опроса сбрасывается,
+когда save_poll меняет опрос, и перестраивается, если обработчику
+передан другой экземпляр опроса (например, сессия начата до изменения).
+Экраны хранятся в LRU-кэше того же размера, что и кэш опросов: редко
+открываемые опросы вытесняются, а не копятся до перезапуска.
+"""
+import os
+import threading
+from typing import NamedTuple, Optional
+
+from cachetools import LRUCache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callback_router
+import database
+
+RENDER_CACHE = os.getenv("RENDER_CACHE", "1") == "1"
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", os.getenv("POLL_CACHE_SIZE", "256")))
+
+NO_POLLS_TEXT = "Пока нет доступных опросов."
+POLL_LIST_TEXT = "Выберите опрос:"
+SESSION_EXPIRED_TEXT = "⌛ Сессия опроса истекла. Начните опрос заново."
+
+
+class Screen(NamedTuple):
+    """Текст сообщения и клавиатура"""
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup]
+
+
+class _PollScreens(NamedTuple):
+    poll: object
+    questions: tuple
+    restart: Screen
+
+
+# poll_id -> экраны опроса; общий список опросов и меню /start
+_polls = LRUCache(maxsize=RENDER_CACHE_SIZE)
+# invalidate вызывается и из потоков БД (save_poll)
+_lock = threading.Lock()
+_poll_list = None
+_start_markup = None
+# Растет при каждом сбросе: список, загруженный до сброса, не кладем
+_generation = 0
+
+
+def _build_start_markup():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Начать опрос", callback_data=callback_router.encode("start_poll"))],
+        [InlineKeyboardButton("Результаты", callback_data=callback_router.encode("show_results"))],
+    ])
+
+
+def _build_poll_list(polls):
+    if not polls:
+        return Screen(NO_POLLS_TEXT, None)
+    return Screen(POLL_LIST_TEXT, InlineKeyboardMarkup([
+        [InlineKeyboardButton(poll["title"], callback_data=callback_router.encode("poll", poll["poll_id"]))]
+        for poll in polls
+    ]))
+
+
+def _build_question(poll, question_idx):
+    poll_id = poll["poll_id"]
+    questions = poll["questions"]
+    question = questions[question_idx]
+    return Screen(
+        f"{poll['title']}\n\n"
+        f"Вопрос {question_idx + 1}/{len(questions)}:\n{question['text']}",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton(option, callback_data=callback_router.encode("answer", poll_id, question_idx, a_idx))]
+            for a_idx, option in enumerate(question["options"])
+        ]),
+    )
+
+
+def _build_restart(poll_id):
+    return Screen(SESSION_EXPIRED_TEXT, InlineKeyboardMarkup([
+        [InlineKeyboardButton("Начать заново", callback_data=callback_router.encode("poll", poll_id))]
+    ]))
+
+
+def _poll_screens(poll) -> _PollScreens:
+    """Экраны опроса из кэша (строятся все вопросы сразу)"""
+    with _lock:
+        entry = _polls.get(poll["poll_id"])
+    if entry is None or entry.poll is not poll:
+        entry = _PollScreens(
+            poll,
+            tuple(_build_question(poll, idx) for idx in range(len(poll["questions"]))),
+            _build_restart(poll["poll_id"]),
+        )
+        with _lock:
+            _polls[poll["poll_id"]] = entry
+    return entry
+
+
+def start_markup() -> InlineKeyboardMarkup:
+    """Клавиатура главного меню (/start)"""
+    global _start_markup
+    if not RENDER_CACHE:
+        return _build_start_markup()
+    if _start_markup is None:
+        _start_markup = _build_start_markup()
+    return _start_markup
+
+
+def question_screen(poll, question_idx) -> Screen:
+    """Экран вопроса опроса"""
+    if not RENDER_CACHE:
+        return _build_question(poll, question_idx)
+    return _poll_screens(poll).questions[question_idx]
+
+
+def restart_screen(poll_id) -> Screen:
+    """Экран истекшей сессии с кнопкой повторного начала"""
+    if not RENDER_CACHE:
+        return _build_restart(poll_id)
+    with _lock:
+        entry = _polls.get(poll_id)
+    return entry.restart if entry is not None else _build_restart(poll_id)
+
+
+async def poll_list_screen(load_polls) -> Screen:
+    """Экран списка опросов; load_polls - корутина загрузки списка"""
+    global _poll_list
+    if RENDER_CACHE and _poll_list is not None:
+        return _poll_list
+    generation = _generation
+    screen = _build_poll_list(await load_polls())
+    if RENDER_CACHE and generation == _generation:
+        _poll_list = screen
+    return screen
+
+
+def invalidate(poll_id=None):
+    """Сбросить экраны опроса (или все) и список опросов"""
+    global _poll_list, _generation
+    _generation += 1
+    _poll_list = None
+    with _lock:
+        if poll_id is None:
+            _polls.clear()
+        else:
+            _polls.pop(poll_id, None)
+
+
+def warm() -> int:
+    """Построить экраны всех опросов из кэша опросов (при старте бота)"""
+    global _poll_list
+    if not RENDER_CACHE:
+        return 0
+    polls = database.get_all_polls()
+    _poll_list = _build_poll_list(polls)
+    for item in polls:
+        poll = database.get_poll(item["poll_id"])
+        if poll:
+            _poll_screens(poll)
+    return len(polls)
+
+
+def stats() -> dict:
+    """Число закэшированных опросов и экранов"""
+    with _lock:
+        entries = list(_polls.values())
+    return {
+        "enabled": RENDER_CACHE,
+        "polls": len(entries),
+        "max_polls": _polls.maxsize,
+        "screens": sum(len(entry.questions) for entry in entries),
+        "poll_list": _poll_list is not None,
+    }
+
+
+database.on_poll_changed(invalidate)
@@ -0,0 +1,230 @@
+"""
+Постраничные отчеты под ограничение Telegram в 4096 символов
+
+Отчет - генератор строк. PagedReport собирает из строк страницы не
+длиннее PAGE_LIMIT, не разрывая строки, и только по мере просмотра:
+первая страница готова, когда набраны ее строки, остальные строятся
+при нажатии «дальше».
+
+Построенные отчеты кэшируются по (отчет, опрос, версия данных), где
+версия - id последней записи в таблице, из которой строится отчет.
+Пока новых кликов или ответов нет, повторный просмотр и листание
+берут готовые страницы. Кнопки листания несут версию, поэтому все
+страницы одного сообщения показываются из одного среза данных.
+
+Настройки (.env):
+    REPORT_CACHE_SIZE   сколько построенных отчетов хранить (32)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callback_router
+import database
+import metrics
+from analitycs import report_lines
+from click_analytics import click_report_lines
+from db_pool import get_connection
+
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "32"))
+# Ограничение Telegram на длину сообщения (в UTF-16, как считает Telegram)
+PAGE_LIMIT = 4096
+NO_POLL = "-"
+
+
+def _length(text) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+class PagedReport:
+    """Страницы отчета, которые строятся по мере просмотра"""
+
+    def __init__(self, lines, limit=PAGE_LIMIT):
+        self.limit = limit
+        self._lines = iter(lines)
+        self._carry = []
+        self._pages = []
+        self._done = False
+
+    def _split(self, line):
+        """Слишком длинная строка режется на куски по limit"""
+        chunks = []
+        while _length(line) > self.limit:
+            cut = self.limit
+            while _length(line[:cut]) > self.limit:
+                cut -= 1
+            chunks.append(line[:cut])
+            line = line[cut:]
+        chunks.append(line)
+        return chunks
+
+    def _next_line(self):
+        if self._carry:
+            return self._carry.pop()
+        line = next(self._lines, None)
+        if line is not None and _length(line) > self.limit:
+            chunks = self._split(line)
+            line = chunks[0]
+            self._carry = chunks[:0:-1]
+        return line
+
+    def _render_next(self):
+        page = []
+        size = 0
+        while True:
+            line = self._next_line()
+            if line is None:
+                self._done = True
+                break
+            added = _length(line) + (1 if page else 0)
+            if page and size + added > self.limit:
+                self._carry.append(line)
+                break
+            page.append(line)
+            size += added
+        # Пустые строки в конце страницы не нужны
+        while page and not page[-1].strip():
+            page.pop()
+        if page:
+            self._pages.append("\n".join(page))
+
+    def page(self, number):
+        """Текст страницы (с 0) или None, если ее нет"""
+        while len(self._pages) <= number and not self._done:
+            self._render_next()
+        return self._pages[number] if number < len(self._pages) else None
+
+    def has_next(self, number) -> bool:
+        return self.page(number + 1) is not None
+
+    @property
+    def total(self):
+        """Число страниц; None, пока отчет построен не до конца"""
+        return len(self._pages) if self._done else None
+
+
+class Report(NamedTuple):
+    """Отчет: строки и версия данных"""
+    lines: Callable
+    version: Callable
+
+
+_reports = {}
+_cache = OrderedDict()
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def register(kind, lines, version):
+    """Зарегистрировать отчет
+
+    lines(poll_id) читает данные и возвращает итератор строк: строки
+    выдаются лениво, но уже без запросов к БД, чтобы все страницы были
+    из одного среза. version(conn, poll_id) - текущая версия данных (> 0,
+    если данные есть).
+    """
+    _reports[kind] = Report(lines, version)
+
+
+def _cached(key):
+    global _hits
+    with _lock:
+        paged = _cache.get(key)
+        if paged is not None:
+            _cache.move_to_end(key)
+            _hits += 1
+    if paged is not None:
+        metrics.REPORT_CACHE.inc("hit")
+    return paged
+
+
+def _get(kind, poll_id, version):
+    """Отчет из кэша или построенный заново: (PagedReport, версия)"""
+    global _misses
+    report = _reports[kind]
+    # Листание: страницы той же версии, пока они в кэше
+    paged = _cached((kind, poll_id, version)) if version else None
+    if paged is not None:
+        return paged, version
+    version = report.version(get_connection(database.DB_NAME), None if poll_id == NO_POLL else poll_id)
+    paged = _cached((kind, poll_id, version))
+    if paged is not None:
+        return paged, version
+
+    metrics.REPORT_CACHE.inc("miss")
+    paged = PagedReport(report.lines(None if poll_id == NO_POLL else poll_id))
+    with _lock:
+        _misses += 1
+        _cache[kind, poll_id, version] = paged
+        while len(_cache) > REPORT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return paged, version
+
+
+def _markup(kind, poll_id, version, number, paged):
+    buttons = []
+    if number > 0:
+        buttons.append(InlineKeyboardButton(
+            f"◀️ стр. {number}",
+            callback_data=callback_router.encode("report_page", kind, poll_id, version, number - 1)
+        ))
+    if paged.has_next(number):
+        buttons.append(InlineKeyboardButton(
+            f"стр. {number + 2} ▶️",
+            callback_data=callback_router.encode("report_page", kind, poll_id, version, number + 1)
+        ))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def render_page(kind, poll_id=None, number=0, version=0):
+    """Страница отчета и кнопки листания: (текст, клавиатура)
+
+    Синхронная: читает БД при построении отчета, вызывать через run_db.
+    version=0 - текущие данные.
+    """
+    started = time.perf_counter()
+    poll_id = poll_id or NO_POLL
+    paged, version = _get(kind, poll_id, version)
+    # Генератор строк нельзя продолжать из двух потоков сразу
+    with _lock:
+        text = paged.page(number)
+        if text is None:
+            number = max((paged.total or 1) - 1, 0)
+            text = paged.page(number) or "Нет данных."
+        markup = _markup(kind, poll_id, version, number, paged)
+    metrics.REPORT_RENDER.observe(time.perf_counter() - started, kind)
+    return text, markup
+
+
+def invalidate(poll_id=None):
+    """Сбросить построенные отчеты опроса (или все)"""
+    with _lock:
+        for key in [key for key in _cache if poll_id is None or key[1] == poll_id]:
+            del _cache[key]
+
+
+def stats() -> dict:
+    with _lock:
+        return {"reports": len(_cache), "hits": _hits, "misses": _misses}
+
+
+database.on_poll_changed(invalidate)
+
+
+def _clicks_version(conn, poll_id):
+    return conn.execute("SELECT MAX(id) FROM clicks").fetchone()[0] or 0
+
+
+def _responses_version(conn, poll_id):
+    return conn.execute(
+        "SELECT MAX(id) FROM responses WHERE poll_id = ?", (poll_id,)
+    ).fetchone()[0] or 0
+
+
+register("clicks", click_report_lines, _clicks_version)
+register("poll", report_lines, _responses_version)
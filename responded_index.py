@@ -0,0 +1,197 @@
+"""
+Индекс "пользователь уже ответил на опрос"
+
+Для каждого опроса при первой проверке загружаются user_id ответивших
+(по покрывающему индексу idx_responses_poll_user), дальше проверки идут
+в памяти, а save_response добавляет пользователя после коммита.
+
+Режимы (RESPONDED_INDEX):
+    set    точное множество user_id (по умолчанию)
+    bloom  фильтр Блума: "нет" - окончательный ответ, "возможно да"
+           перепроверяется запросом к БД; память - около 1.2 байта
+           на пользователя при доле ложных срабатываний 1%
+    off    всегда запрос к БД
+"""
+import math
+import os
+import sys
+import threading
+
+RESPONDED_INDEX = os.getenv("RESPONDED_INDEX", "set")
+BLOOM_FP_RATE = float(os.getenv("RESPONDED_BLOOM_FP_RATE", "0.01"))
+# Минимальная емкость фильтра (пользователей на опрос)
+BLOOM_MIN_CAPACITY = int(os.getenv("RESPONDED_BLOOM_MIN_CAPACITY", "100000"))
+
+_MASK64 = (1 << 64) - 1
+
+
+class BloomFilter:
+    """Фильтр Блума по целым ключам (двойное хеширование splitmix64)"""
+
+    def __init__(self, capacity, fp_rate=BLOOM_FP_RATE):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        h = (key + 0x9E3779B97F4A7C15) & _MASK64
+        h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _MASK64
+        h ^= h >> 31
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+
+def _set_nbytes(users) -> int:
+    """Оценка памяти множества вместе с объектами int (по 28 байт)"""
+    return sys.getsizeof(users) + 28 * len(users)
+
+
+class RespondedIndex:
+    """Проверки "уже ответил" по опросам с ленивой загрузкой из БД
+
+    loader(poll_id) - итератор user_id ответивших на опрос,
+    exists(user_id, poll_id) - точная проверка в БД.
+    """
+
+    def __init__(self, loader, exists, mode=RESPONDED_INDEX):
+        if mode not in ("set", "bloom", "off"):
+            raise ValueError(f"Unknown responded index mode: {mode}")
+        self._loader = loader
+        self._exists = exists
+        self.mode = mode
+        self._polls = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.memory_hits = 0
+        self.db_checks = 0
+        self.false_positives = 0
+        self.loads = 0
+
+    def _build(self, poll_id):
+        users = list(self._loader(poll_id))
+        if self.mode == "set":
+            return set(users)
+        bloom = BloomFilter(max(BLOOM_MIN_CAPACITY, 2 * len(users)))
+        for user_id in users:
+            bloom.add(user_id)
+        return bloom
+
+    def _members(self, poll_id):
+        """Загруженный индекс опроса (загрузка под блокировкой)"""
+        members = self._polls.get(poll_id)
+        if members is None:
+            # Пока загрузка держит блокировку, add() из save_response ждет
+            # и попадает уже в загруженный индекс
+            members = self._polls[poll_id] = self._build(poll_id)
+            self.loads += 1
+        elif self.mode == "bloom" and members.count > members.capacity:
+            # Фильтр переполнен: доля ложных срабатываний растет, пересобираем
+            members = self._polls[poll_id] = self._build(poll_id)
+            self.loads += 1
+        return members
+
+    def peek(self, user_id, poll_id):
+        """Ответ без обращения к БД: True/False или None, если нужен запрос
+
+        Не ждет блокировку, поэтому безопасен для цикла событий.
+        """
+        if self.mode == "off" or not self._lock.acquire(blocking=False):
+            return None
+        try:
+            members = self._polls.get(poll_id)
+            if members is None:
+                return None
+            if user_id not in members:
+                self.lookups += 1
+                self.memory_hits += 1
+                return False
+            if self.mode == "set":
+                self.lookups += 1
+                self.memory_hits += 1
+                return True
+            return None
+        finally:
+            self._lock.release()
+
+    def contains(self, user_id, poll_id) -> bool:
+        """Ответил ли пользователь на опрос"""
+        if self.mode == "off":
+            with self._lock:
+                self.lookups += 1
+                self.db_checks += 1
+            return self._exists(user_id, poll_id)
+
+        with self._lock:
+            self.lookups += 1
+            found = user_id in self._members(poll_id)
+            if not found or self.mode == "set":
+                self.memory_hits += 1
+                return found
+            self.db_checks += 1
+
+        # Bloom: "возможно да" подтверждаем в БД
+        if self._exists(user_id, poll_id):
+            return True
+        with self._lock:
+            self.false_positives += 1
+        return False
+
+    def add(self, user_id, poll_id):
+        """Учесть сохраненный ответ (после коммита)"""
+        if self.mode == "off":
+            return
+        with self._lock:
+            members = self._polls.get(poll_id)
+            if members is not None:
+                members.add(user_id)
+
+    def invalidate(self, poll_id=None):
+        """Сбросить индекс опроса (или все): перечитается при проверке"""
+        with self._lock:
+            if poll_id is None:
+                self._polls.clear()
+            else:
+                self._polls.pop(poll_id, None)
+
+    def stats(self) -> dict:
+        """Память и частота проверок без запроса к БД"""
+        with self._lock:
+            if self.mode == "bloom":
+                memory = sum(m.nbytes for m in self._polls.values())
+                users = sum(m.count for m in self._polls.values())
+            else:
+                memory = sum(_set_nbytes(m) for m in self._polls.values())
+                users = sum(len(m) for m in self._polls.values())
+            return {
+                "mode": self.mode,
+                "polls": len(self._polls),
+                "users": users,
+                "memory_bytes": memory,
+                "lookups": self.lookups,
+                "memory_hit_rate": round(self.memory_hits / self.lookups, 4) if self.lookups else 0.0,
+                "db_checks": self.db_checks,
+                "false_positives": self.false_positives,
+                "loads": self.loads,
+            }
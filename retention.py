@@ -0,0 +1,284 @@
+"""
+Хранение кликов: горячие данные в БД, старые - в архивах по месяцам
+
+Клики старше CLICK_RETENTION_DAYS переносятся из clicks в отдельные
+файлы SQLite по месяцу клика (CLICK_ARCHIVE_DIR/clicks_YYYY-MM.db, та
+же таблица clicks с теми же id). Переносятся только клики, уже
+учтенные всеми агрегатами (id не больше наименьшего водяного знака
+свертки, воронки, скетчей и click_users), поэтому отчеты по агрегатам
+не меняются.
+
+Всю историю хранят агрегаты: click_rollups (клики по кнопкам, по
+вопросам и по времени, в том числе хронология get_clicks_timeline),
+воронка, скетчи и click_users (аудитории рассылок). Только по горячему
+окну (последние CLICK_RETENTION_DAYS) работают get_user_clicks и
+get_user_engagement без history=True: они читают саму таблицу clicks.
+Точное число уникальных пользователей читает архивы через iter_history.
+
+Пересчитать агрегаты с нуля (сбросив водяной знак) после первого
+переноса нельзя: clicks уже не содержит всей истории, поэтому
+обработчики в этом случае падают с RuntimeError (check_full_history).
+
+Перенос идет небольшими пачками: пачка сначала записывается в архив
+(INSERT OR IGNORE, повтор безопасен), затем удаляется из clicks одной
+короткой транзакцией. Запись кликов из буфера ждет не дольше одной
+пачки, чтения в WAL не блокируются совсем.
+
+Освободившиеся страницы возвращаются файлу через PRAGMA
+incremental_vacuum (тоже по частям). Для этого в БД должен быть
+auto_vacuum=INCREMENTAL: новые БД создаются так сразу (см. db_pool),
+существующую нужно один раз перестроить VACUUM'ом (--setup-vacuum).
+
+Запросы по истории (iter_history) выполняются по clicks и по каждому
+архиву через соединение к файлу архива, открываемое по требованию.
+Во время переноса одна строка может оказаться и в clicks, и в архиве,
+поэтому результаты объединяются по id.
+
+Настройки (.env):
+    CLICK_RETENTION_DAYS   сколько дней клики хранятся в БД (90)
+    CLICK_ARCHIVE_DIR      каталог архивов (click_archive)
+    CLICK_ARCHIVE_BATCH    кликов в пачке переноса (2000)
+    CLICK_ARCHIVE_PAUSE_MS пауза между пачками (20)
+"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import database
+import funnel
+import hll
+from click_rollups import ROLLUP_STATE, USERS_STATE, get_watermark
+from db_pool import get_connection, transaction
+from logger import logger
+
+CLICK_RETENTION_DAYS = int(os.getenv("CLICK_RETENTION_DAYS", "90"))
+CLICK_ARCHIVE_DIR = os.getenv("CLICK_ARCHIVE_DIR", "click_archive")
+CLICK_ARCHIVE_BATCH = int(os.getenv("CLICK_ARCHIVE_BATCH", "2000"))
+CLICK_ARCHIVE_PAUSE_MS = int(os.getenv("CLICK_ARCHIVE_PAUSE_MS", "20"))
+
+# Страниц за один шаг incremental_vacuum
+VACUUM_STEP_PAGES = 1000
+
+_COLUMNS = "id, user_id, button_name, callback_data, poll_id, question_idx, clicked_at"
+
+_ARCHIVE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS clicks (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        button_name TEXT NOT NULL,
+        callback_data TEXT,
+        poll_id TEXT,
+        question_idx INTEGER,
+        clicked_at TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_clicks_user ON clicks(user_id, button_name)",
+    "CREATE INDEX IF NOT EXISTS idx_clicks_poll_user ON clicks(poll_id, user_id)",
+)
+
+# Архивы, схема которых уже создана в этом процессе
+_ready = set()
+
+
+def archive_path(month) -> str:
+    """Файл архива месяца 'YYYY-MM'"""
+    return os.path.join(CLICK_ARCHIVE_DIR, f"clicks_{month}.db")
+
+
+def _archive_connection(month):
+    path = archive_path(month)
+    conn = get_connection(path)
+    if path not in _ready:
+        for statement in _ARCHIVE_SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        _ready.add(path)
+    return conn
+
+
+def safe_click_id(conn) -> int:
+    """Наибольший id клика, уже учтенного всеми агрегатами"""
+    return min(
+        get_watermark(conn, name)
+        for name in (ROLLUP_STATE, USERS_STATE, funnel.FUNNEL_STATE, hll.SKETCH_STATE)
+    )
+
+
+def _cutoff(days) -> str:
+    """Граница хранения в формате clicked_at (UTC)"""
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def pending(db_path=None, days=None) -> dict:
+    """Сколько кликов будет перенесено, по месяцам"""
+    conn = get_connection(db_path or database.DB_NAME)
+    days = CLICK_RETENTION_DAYS if days is None else days
+    rows = conn.execute("""
+        SELECT substr(clicked_at, 1, 7), COUNT(*) FROM clicks
+        WHERE clicked_at < ? AND id <= ?
+        GROUP BY 1 ORDER BY 1
+    """, (_cutoff(days), safe_click_id(conn))).fetchall()
+    return dict(rows)
+
+
+def _write_archive(rows) -> dict:
+    """Записать пачку в архивы; вернуть {месяц: (кликов, первый id, последний id)}"""
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(row[6][:7], []).append(row)
+
+    written = {}
+    for month, month_rows in by_month.items():
+        conn = _archive_connection(month)
+        with conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO clicks ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                month_rows
+            )
+        written[month] = (len(month_rows), month_rows[0][0], month_rows[-1][0])
+    return written
+
+
+def archive_clicks(db_path=None, days=None, batch=None, pause_ms=None, limit=None) -> dict:
+    """Перенести старые клики в архивы по месяцам
+
+    Возвращает {месяц: перенесено кликов}. limit - не больше стольких
+    кликов за вызов (для запуска по расписанию небольшими порциями).
+    """
+    db_path = db_path or database.DB_NAME
+    days = CLICK_RETENTION_DAYS if days is None else days
+    batch = batch or CLICK_ARCHIVE_BATCH
+    pause = (CLICK_ARCHIVE_PAUSE_MS if pause_ms is None else pause_ms) / 1000
+    os.makedirs(CLICK_ARCHIVE_DIR, exist_ok=True)
+
+    conn = get_connection(db_path)
+    cutoff = _cutoff(days)
+    # Верхняя граница по индексу clicked_at, дальше - по диапазону id
+    last_old = conn.execute("SELECT MAX(id) FROM clicks WHERE clicked_at < ?", (cutoff,)).fetchone()[0]
+    upper = min(last_old or 0, safe_click_id(conn))
+
+    moved = {}
+    total = 0
+    last_id = 0
+    while last_id < upper and (limit is None or total < limit):
+        size = batch if limit is None else min(batch, limit - total)
+        rows = conn.execute(f"""
+            SELECT {_COLUMNS} FROM clicks
+            WHERE id > ? AND id <= ? AND +clicked_at < ?
+            ORDER BY id LIMIT ?
+        """, (last_id, upper, cutoff, size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        written = _write_archive(rows)
+        with transaction(db_path) as conn:
+            conn.executemany("DELETE FROM clicks WHERE id = ?", [(row[0],) for row in rows])
+            conn.executemany("""
+                INSERT INTO click_archives (month, clicks, first_id, last_id) VALUES (?, ?, ?, ?)
+                ON CONFLICT (month) DO UPDATE SET
+                    clicks = clicks + excluded.clicks,
+                    first_id = MIN(first_id, excluded.first_id),
+                    last_id = MAX(last_id, excluded.last_id),
+                    archived_at = CURRENT_TIMESTAMP
+            """, [(month, *info) for month, info in written.items()])
+
+        for month, (count, _, _) in written.items():
+            moved[month] = moved.get(month, 0) + count
+        total += len(rows)
+        if pause:
+            time.sleep(pause)
+
+    if total:
+        logger.info(f"Archived {total} clicks older than {cutoff}: {moved}")
+    return moved
+
+
+def list_archives(conn) -> list:
+    """Архивы: [{month, clicks, first_id, last_id, archived_at, path}]"""
+    rows = conn.execute(
+        "SELECT month, clicks, first_id, last_id, archived_at FROM click_archives ORDER BY month"
+    ).fetchall()
+    return [
+        {"month": month, "clicks": clicks, "first_id": first_id, "last_id": last_id,
+         "archived_at": archived_at, "path": archive_path(month)}
+        for month, clicks, first_id, last_id, archived_at in rows
+    ]
+
+
+def has_archives(conn) -> bool:
+    return conn.execute("SELECT 1 FROM click_archives LIMIT 1").fetchone() is not None
+
+
+def iter_history(conn, sql, params=(), since=None, until=None):
+    """Строки запроса sql по clicks и по архивам месяцев since..until ('YYYY-MM')
+
+    Запрос выполняется отдельно по каждому источнику, объединять
+    результаты (и убирать повторы по id) - дело вызывающего.
+    """
+    yield from conn.execute(sql, params)
+    for archive in list_archives(conn):
+        month = archive["month"]
+        if (since and month < since) or (until and month > until):
+            continue
+        if not os.path.exists(archive["path"]):
+            logger.warning(f"Click archive {archive['path']} is missing")
+            continue
+        yield from _archive_connection(month).execute(sql, params)
+
+
+def vacuum_status(conn) -> dict:
+    """Режим auto_vacuum и свободные страницы файла БД"""
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    return {
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(mode, mode),
+        "page_size": conn.execute("PRAGMA page_size").fetchone()[0],
+        "page_count": conn.execute("PRAGMA page_count").fetchone()[0],
+        "freelist_count": conn.execute("PRAGMA freelist_count").fetchone()[0],
+    }
+
+
+def incremental_vacuum(db_path=None, step=VACUUM_STEP_PAGES, pause_ms=None) -> int:
+    """Вернуть файлу свободные страницы по step за транзакцию; вернуть число страниц"""
+    db_path = db_path or database.DB_NAME
+    pause = (CLICK_ARCHIVE_PAUSE_MS if pause_ms is None else pause_ms) / 1000
+    conn = get_connection(db_path)
+    status = vacuum_status(conn)
+    if status["auto_vacuum"] != "incremental":
+        if status["freelist_count"]:
+            logger.warning(
+                f"{db_path}: auto_vacuum={status['auto_vacuum']}, "
+                f"{status['freelist_count']} free pages are not reclaimed (run --setup-vacuum once)"
+            )
+        return 0
+
+    freed = 0
+    free = status["freelist_count"]
+    while free:
+        # executescript: через execute() шаг освобождает только одну страницу
+        conn.executescript(f"PRAGMA incremental_vacuum({step});")
+        left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if left >= free:
+            break
+        freed += free - left
+        free = left
+        if pause:
+            time.sleep(pause)
+    # Контрольная точка WAL, чтобы файл БД действительно уменьшился
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return freed
+
+
+def enable_incremental_vacuum(db_path=None) -> bool:
+    """Перевести БД в auto_vacuum=INCREMENTAL (однократно, перестраивает файл)
+
+    VACUUM блокирует запись на все время перестройки: запускать, когда
+    бот остановлен.
+    """
+    conn = get_connection(db_path or database.DB_NAME)
+    if vacuum_status(conn)["auto_vacuum"] == "incremental":
+        return False
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
@@ -0,0 +1,204 @@
+"""
+Сессии прохождения опросов в памяти процесса
+
+Пока пользователь проходит опрос, текущий вопрос и частичные ответы
+хранятся здесь, а не в БД: в SQLite пишется только завершенный ответ.
+Сессии без активности дольше SESSION_IDLE_TIMEOUT удаляются, при
+переполнении вытесняются самые давние. При остановке бота незавершенные
+сессии сохраняются в файл и загружаются при следующем старте.
+"""
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from logger import logger
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))
+SESSION_SNAPSHOT_PATH = os.getenv("SESSION_SNAPSHOT_PATH", "sessions.json")
+
+
+@dataclass
+class Session:
+    """Незавершенное прохождение опроса"""
+    user_id: int
+    poll_id: str
+    question_idx: int = 0
+    answers: dict = field(default_factory=dict)
+    started_at: float = field(default_factory=time.time)
+    touched_at: float = field(default_factory=time.time)
+    # Определение опроса на время прохождения (в снимок не попадает)
+    poll: Optional[object] = field(default=None, repr=False, compare=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "poll_id": self.poll_id,
+            "question_idx": self.question_idx,
+            "answers": self.answers,
+            "started_at": self.started_at,
+            "touched_at": self.touched_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data) -> "Session":
+        """Сессия из записи снимка; лишние ключи отбрасываются
+
+        TypeError/KeyError/ValueError - запись повреждена.
+        """
+        session = cls(**{key: data[key] for key in _SNAPSHOT_FIELDS if key in data})
+        session.user_id = int(session.user_id)
+        session.question_idx = int(session.question_idx)
+        session.started_at = float(session.started_at)
+        session.touched_at = float(session.touched_at)
+        if not isinstance(session.poll_id, str) or not isinstance(session.answers, dict):
+            raise ValueError("poll_id must be a string and answers a dict")
+        return session
+
+
+# Поля, которые сохраняются в снимок (to_dict)
+_SNAPSHOT_FIELDS = ("user_id", "poll_id", "question_idx", "answers", "started_at", "touched_at")
+
+
+class SessionStore:
+    """Сессии по user_id: вытеснение по простою и по размеру
+
+    Используется из цикла событий бота, поэтому без блокировок.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()
+        self.started = 0
+        self.completed = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expired(self, session, now):
+        return now - session.touched_at > self.idle_timeout
+
+    def get(self, user_id) -> Optional[Session]:
+        """Активная сессия пользователя (продлевает ее)"""
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        now = time.time()
+        if self._expired(session, now):
+            del self._sessions[user_id]
+            self.expired += 1
+            return None
+        session.touched_at = now
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def start(self, user_id, poll_id, poll=None) -> Session:
+        """Начать опрос заново (прежняя сессия пользователя сбрасывается)"""
+        self._sessions.pop(user_id, None)
+        self.evict_idle()
+        while len(self._sessions) >= self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+        session = Session(user_id=user_id, poll_id=poll_id, poll=poll)
+        self._sessions[user_id] = session
+        self.started += 1
+        return session
+
+    def finish(self, user_id) -> Optional[Session]:
+        """Завершить сессию и вернуть ее"""
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self.completed += 1
+        return session
+
+    def evict_idle(self) -> int:
+        """Удалить сессии без активности дольше idle_timeout"""
+        now = time.time()
+        removed = 0
+        # Порядок OrderedDict - по последней активности
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if not self._expired(session, now):
+                break
+            del self._sessions[user_id]
+            removed += 1
+        self.expired += removed
+        return removed
+
+    def save(self, path=SESSION_SNAPSHOT_PATH) -> int:
+        """Записать активные сессии в файл; вернуть их число"""
+        self.evict_idle()
+        sessions = [session.to_dict() for session in self._sessions.values()]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(sessions, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return len(sessions)
+
+    def load(self, path=SESSION_SNAPSHOT_PATH) -> int:
+        """Восстановить сессии из файла и удалить его; вернуть их число"""
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                sessions = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot read session snapshot {path}: {e}")
+            return 0
+        if not isinstance(sessions, list):
+            logger.error(f"Cannot read session snapshot {path}: expected a list")
+            return 0
+
+        # Поврежденные записи пропускаются, остальные сессии восстанавливаются
+        parsed = []
+        for data in sessions:
+            try:
+                parsed.append(Session.from_dict(data))
+            except (TypeError, KeyError, ValueError) as e:
+                logger.warning(f"Skipping bad session in {path}: {data!r:.200} ({e})")
+
+        now = time.time()
+        restored = 0
+        for session in sorted(parsed, key=lambda s: s.touched_at):
+            if self._expired(session, now) or len(self._sessions) >= self.max_sessions:
+                continue
+            self._sessions[session.user_id] = session
+            restored += 1
+        os.remove(path)
+        return restored
+
+    def stats(self) -> dict:
+        """Число активных сессий и счетчики жизненного цикла"""
+        return {
+            "active": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "started": self.started,
+            "completed": self.completed,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+store = SessionStore()
+
+
+def save_snapshot(path=SESSION_SNAPSHOT_PATH):
+    """Сохранить незавершенные сессии (при остановке бота)"""
+    saved = store.save(path)
+    logger.info(f"Saved {saved} poll sessions to {path}")
+    return saved
+
+
+def load_snapshot(path=SESSION_SNAPSHOT_PATH):
+    """Загрузить сессии, сохраненные при прошлой остановке"""
+    restored = store.load(path)
+    if restored:
+        logger.info(f"Restored {restored} poll sessions from {path}")
+    return restored
@@ -0,0 +1,96 @@
+"""
+Счетчики ответов по опросу, вопросу и варианту
+
+save_response обновляет answer_tallies в той же транзакции, что и
+вставку ответа, поэтому отчеты читают готовые счетчики, а не
+пересчитывают все ответы.
+"""
+from collections import Counter
+
+import answer_codec
+
+UPSERT_TALLY_SQL = """
+    INSERT INTO answer_tallies (poll_id, question_idx, answer, count)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (poll_id, question_idx, answer)
+    DO UPDATE SET count = count + excluded.count
+"""
+
+
+def _question_idx(key):
+    """Номер вопроса из ключа q_N (None для посторонних ключей)"""
+    if not key.startswith("q_"):
+        return None
+    try:
+        return int(key[2:])
+    except ValueError:
+        return None
+
+
+def iter_answers(answers):
+    """Пары (question_idx, answer) из словаря ответов {"q_N": ...}"""
+    for key, answer in answers.items():
+        q_idx = _question_idx(key)
+        if q_idx is not None and answer:
+            yield q_idx, answer
+
+
+def apply_response(conn, poll_id, answers):
+    """Учесть один ответ в счетчиках (внутри транзакции save_response)"""
+    conn.executemany(UPSERT_TALLY_SQL, [
+        (poll_id, q_idx, answer, 1) for q_idx, answer in iter_answers(answers)
+    ])
+
+
+def count_responses(conn, poll_id=None) -> Counter:
+    """Пересчитать счетчики по сырым ответам"""
+    if poll_id:
+        rows = conn.execute(
+            "SELECT poll_id, answers FROM responses WHERE poll_id = ?", (poll_id,)
+        )
+    else:
+        rows = conn.execute("SELECT poll_id, answers FROM responses")
+
+    counts = Counter()
+    for row_poll_id, raw in rows:
+        for q_idx, answer in iter_answers(answer_codec.decode(conn, row_poll_id, raw)):
+            counts[(row_poll_id, q_idx, answer)] += 1
+    return counts
+
+
+def load_tallies(conn, poll_id=None) -> Counter:
+    """Прочитать сохраненные счетчики"""
+    if poll_id:
+        rows = conn.execute("""
+            SELECT poll_id, question_idx, answer, count FROM answer_tallies
+            WHERE poll_id = ?
+        """, (poll_id,))
+    else:
+        rows = conn.execute(
+            "SELECT poll_id, question_idx, answer, count FROM answer_tallies"
+        )
+    return Counter({(p, q, a): c for p, q, a, c in rows if c})
+
+
+def rebuild(conn, poll_id=None) -> int:
+    """Заменить счетчики пересчитанными; вернуть число строк"""
+    counts = count_responses(conn, poll_id)
+    if poll_id:
+        conn.execute("DELETE FROM answer_tallies WHERE poll_id = ?", (poll_id,))
+    else:
+        conn.execute("DELETE FROM answer_tallies")
+    conn.executemany(UPSERT_TALLY_SQL, [
+        (p, q, a, c) for (p, q, a), c in counts.items()
+    ])
+    return len(counts)
+
+
+def diff(conn, poll_id=None) -> list:
+    """Расхождения (poll_id, question_idx, answer, сохранено, по ответам)"""
+    stored = load_tallies(conn, poll_id)
+    actual = count_responses(conn, poll_id)
+    return [
+        (*key, stored.get(key, 0), actual.get(key, 0))
+        for key in sorted(stored.keys() | actual.keys(), key=str)
+        if stored.get(key, 0) != actual.get(key, 0)
+    ]
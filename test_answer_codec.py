@@ -0,0 +1,96 @@
+"""
+Тесты компактного хранения ответов (answer_codec)
+"""
+import json
+import os
+import tempfile
+import unittest
+
+import answer_codec
+from db_pool import close_all, get_connection, transaction
+from migrations import migrate
+
+POLL_ID = "poll_1"
+OPTIONS = [["Никогда", "Редко", "Часто"], ["Да", "Нет"], ["1", "2", "3", "4"]]
+
+
+class AnswerCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self._tmp.name, "test.db")
+        migrate(self.db_path)
+        self.conn = get_connection(self.db_path)
+        answer_codec._layouts.clear()
+
+    def tearDown(self):
+        close_all()
+        self._tmp.cleanup()
+
+    def _register(self, options):
+        with transaction(self.db_path) as conn:
+            return answer_codec.register_layout(conn, POLL_ID, options)
+
+    def test_round_trip(self):
+        self._register(OPTIONS)
+        answers = {"q_0": "Часто", "q_1": "Нет", "q_2": "1"}
+        blob = answer_codec.encode(OPTIONS, answers)
+
+        self.assertIsInstance(blob, bytes)
+        self.assertEqual(len(blob), answer_codec.HEADER.size + len(OPTIONS))
+        self.assertEqual(answer_codec.decode(self.conn, POLL_ID, blob), answers)
+
+    def test_skipped_questions(self):
+        self._register(OPTIONS)
+        blob = answer_codec.encode(OPTIONS, {"q_1": "Да"})
+        self.assertEqual(answer_codec.decode(self.conn, POLL_ID, blob), {"q_1": "Да"})
+
+    def test_unencodable_answers(self):
+        self.assertIsNone(answer_codec.encode(OPTIONS, {"q_0": "Всегда"}))
+        self.assertIsNone(answer_codec.encode(OPTIONS, {"q_9": "Да"}))
+        self.assertIsNone(answer_codec.encode(OPTIONS, {"comment": "Да"}))
+
+    def test_json_passthrough(self):
+        answers = {"q_0": "Свой вариант"}
+        self.assertEqual(answer_codec.decode(self.conn, POLL_ID, json.dumps(answers)), answers)
+
+    def test_old_answers_after_layout_change(self):
+        self._register(OPTIONS)
+        old = answer_codec.encode(OPTIONS, {"q_0": "Редко", "q_1": "Да"})
+
+        changed = [["Никогда", "Иногда", "Редко", "Часто"], ["Да", "Нет"]]
+        self._register(changed)
+        new = answer_codec.encode(changed, {"q_0": "Редко", "q_1": "Да"})
+
+        self.assertNotEqual(old, new)
+        answer_codec._layouts.clear()
+        self.assertEqual(answer_codec.decode(self.conn, POLL_ID, old), {"q_0": "Редко", "q_1": "Да"})
+        self.assertEqual(answer_codec.decode(self.conn, POLL_ID, new), {"q_0": "Редко", "q_1": "Да"})
+
+    def test_layout_conflict(self):
+        fp = answer_codec.fingerprint(OPTIONS)
+        with transaction(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO poll_layouts (poll_id, fingerprint, options) VALUES (?, ?, ?)",
+                (POLL_ID, fp, json.dumps([["Другой"]]))
+            )
+        with self.assertRaises(answer_codec.LayoutConflict):
+            self._register(OPTIONS)
+        self.assertNotIn((POLL_ID, answer_codec.FORMAT_VERSION, fp), answer_codec._layouts)
+
+    def test_unknown_layout(self):
+        blob = answer_codec.encode(OPTIONS, {"q_0": "Редко"})
+        with self.assertRaises(ValueError):
+            answer_codec.decode(self.conn, POLL_ID, blob)
+
+    def test_version_1_blob(self):
+        self._register(OPTIONS)
+        fp = answer_codec.fingerprint(OPTIONS) & 0xFFFF
+        blob = answer_codec.HEADER_V1.pack(1, fp) + bytes([2, 0, 4])
+
+        answer_codec._layouts.clear()
+        self.assertEqual(answer_codec.decode(self.conn, POLL_ID, blob), {"q_0": "Редко", "q_2": "4"})
+
+
+if __name__ == "__main__":
+    unittest.main()
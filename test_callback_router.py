@@ -0,0 +1,100 @@
+"""
+Тесты маршрутизации кнопок (callback_router)
+"""
+import unittest
+
+import callback_router
+
+
+async def _plain(query, context, user_id):
+    pass
+
+
+async def _answer(query, context, user_id, poll_id, question_idx, answer_idx):
+    pass
+
+
+async def _page(query, context, user_id, poll_id, number):
+    pass
+
+
+# Таблицы маршрутов модуля: тесты регистрируют свои маршруты на время теста
+_TABLES = ("_routes", "_routes_by_name", "_legacy_routes", "_legacy_exact")
+
+
+class CallbackRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self._saved = {name: getattr(callback_router, name) for name in _TABLES}
+        for name, table in self._saved.items():
+            setattr(callback_router, name, type(table)())
+        callback_router.route("T", "test_plain")(_plain)
+        callback_router.route("U", "test_answer", "sii", legacy="test_answer_{0}_{1}_{2}")(_answer)
+        callback_router.route("V", "test_page", "si")(_page)
+
+    def tearDown(self):
+        for name, table in self._saved.items():
+            setattr(callback_router, name, table)
+
+    def test_round_trip(self):
+        data = callback_router.encode("test_answer", "poll_1", 2, 35)
+        self.assertEqual(data, "1U|poll_1|2|z")
+        entry, args = callback_router.decode(data)
+        self.assertIs(entry.handler, _answer)
+        self.assertEqual(args, ["poll_1", 2, 35])
+
+    def test_plain_route(self):
+        data = callback_router.encode("test_plain")
+        self.assertEqual(callback_router.decode(data), (callback_router.get_route("test_plain"), ()))
+        self.assertIsNone(callback_router.decode(data + "|x"))
+
+    def test_large_numbers(self):
+        data = callback_router.encode("test_page", "p", 36 ** 4 + 7)
+        self.assertEqual(callback_router.decode(data)[1], ["p", 36 ** 4 + 7])
+
+    def test_legacy_format(self):
+        entry, args = callback_router.decode("test_answer_my_poll_3_1")
+        self.assertIs(entry.handler, _answer)
+        self.assertEqual(args, ["my_poll", 3, 1])
+        self.assertIs(callback_router.decode("test_plain")[0].handler, _plain)
+
+    def test_no_legacy_format(self):
+        self.assertIsNone(callback_router.decode("test_page_my_poll_3"))
+        route = callback_router.get_route("test_page")
+        self.assertEqual(route.label(["my_poll", 3]), "test_page_my_poll_3")
+
+    def test_callback_limit(self):
+        limit = callback_router.MAX_CALLBACK_BYTES
+        prefix = len("1V||0")
+        data = callback_router.encode("test_page", "a" * (limit - prefix), 0)
+        self.assertEqual(len(data.encode("utf-8")), limit)
+        self.assertIsNotNone(callback_router.decode(data))
+
+        with self.assertRaises(ValueError):
+            callback_router.encode("test_page", "a" * (limit - prefix + 1), 0)
+        # Кириллица - по два байта на символ
+        with self.assertRaises(ValueError):
+            callback_router.encode("test_page", "я" * ((limit - prefix) // 2 + 1), 0)
+        self.assertIsNone(callback_router.decode(data + "0"))
+
+    def test_invalid_fields(self):
+        with self.assertRaises(ValueError):
+            callback_router.encode("test_page", "a|b", 0)
+        with self.assertRaises(ValueError):
+            callback_router.encode("test_page", "", 0)
+        with self.assertRaises(ValueError):
+            callback_router.encode("test_page", "p", -1)
+        with self.assertRaises(ValueError):
+            callback_router.encode("test_page", "p")
+
+    def test_garbage(self):
+        for data in ("", "1", "1?", "1U|poll", "1U|poll|x!|1", "unknown_button"):
+            self.assertIsNone(callback_router.decode(data), data)
+
+    def test_duplicate_code(self):
+        with self.assertRaises(ValueError):
+            callback_router.route("T", "test_other")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Тесты почасовых и посуточных агрегатов кликов (click_rollups)
+
+Клики пишутся пачками с обновлением агрегатов после каждой, как из
+буфера кликов; результат сверяется с точным пересчетом по всем кликам.
+ClickDataMixin - общие данные и БД для тестов других агрегатов кликов.
+"""
+import json
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click_rollups
+import funnel
+import hll
+from db_pool import close_all, get_connection, transaction
+from migrations import migrate
+
+POLLS = {"poll_1": 3, "poll_2": 2}
+START = datetime(2026, 1, 1)
+
+
+def _clicks(rnd, count):
+    """Случайные клики: прохождения опросов и прочие кнопки, по времени"""
+    rows = []
+    at = START
+    while len(rows) < count:
+        user_id = rnd.randint(1, 300)
+        poll_id = rnd.choice(list(POLLS))
+        at += timedelta(seconds=rnd.randint(1, 600))
+        rows.append((user_id, f"started_poll_{poll_id}", poll_id, None, at))
+        for q_idx in range(rnd.randint(0, POLLS[poll_id])):
+            at += timedelta(seconds=rnd.randint(1, 120))
+            rows.append((user_id, f"answer_q{q_idx}", poll_id, q_idx, at))
+        if rnd.random() < 0.3:
+            rows.append((user_id, "view_results", None, None, at))
+    return [(*row[:4], row[4].strftime("%Y-%m-%d %H:%M:%S")) for row in rows]
+
+
+class ClickDataMixin:
+    """Случайные клики и временные БД с агрегатами"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.rows = _clicks(random.Random(1), 3000)
+
+    def tearDown(self):
+        close_all()
+        self._tmp.cleanup()
+
+    def _db(self, name):
+        path = os.path.join(self._tmp.name, name)
+        migrate(path)
+        with transaction(path) as conn:
+            conn.executemany(
+                "INSERT INTO polls (poll_id, title, questions) VALUES (?, ?, ?)",
+                [(poll_id, poll_id, json.dumps([{"text": "?", "options": ["a"]}] * n))
+                 for poll_id, n in POLLS.items()]
+            )
+        return path
+
+    def _write(self, path, rows, fold=True):
+        """Пачка кликов; fold - обновить агрегаты (как click_analytics._after_write)"""
+        with transaction(path) as conn:
+            conn.executemany(
+                "INSERT INTO clicks (user_id, button_name, poll_id, question_idx, clicked_at) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+            if fold:
+                click_rollups.compact(conn)
+                click_rollups.update_users(conn)
+                funnel.update(conn)
+                hll.update(conn)
+
+    def _incremental(self, batch=97, tail=150):
+        """БД с агрегатами по пачкам и хвостом еще не учтенных кликов"""
+        path = self._db("incremental.db")
+        split = len(self.rows) - tail
+        for i in range(0, split, batch):
+            self._write(path, self.rows[i:min(i + batch, split)])
+        if tail:
+            self._write(path, self.rows[split:], fold=False)
+        return get_connection(path)
+
+    def _one_pass(self):
+        """БД, где все клики учтены одним проходом"""
+        path = self._db("one_pass.db")
+        self._write(path, self.rows)
+        return get_connection(path)
+
+
+class ClickRollupsTest(ClickDataMixin, unittest.TestCase):
+
+    def test_counts_by_button(self):
+        conn = self._incremental()
+        for poll_id in (None, *POLLS):
+            exact = Counter(row[1] for row in self.rows if poll_id is None or row[2] == poll_id)
+            self.assertEqual(click_rollups.counts_by_button(conn, poll_id), exact, poll_id)
+
+    def test_counts_by_bucket(self):
+        conn = self._incremental()
+        since = self.rows[len(self.rows) // 3][4][:10]
+        for granularity, poll_id in (("day", None), ("day", "poll_1"), ("hour", "poll_2")):
+            fmt = dict(click_rollups.GRANULARITIES)[granularity]
+            exact = Counter(
+                datetime.strptime(row[4], "%Y-%m-%d %H:%M:%S").strftime(fmt)
+                for row in self.rows
+                if (poll_id is None or row[2] == poll_id) and row[4] >= since
+            )
+            self.assertEqual(
+                click_rollups.counts_by_bucket(conn, granularity, since, poll_id), exact,
+                (granularity, poll_id)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
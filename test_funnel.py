@@ -0,0 +1,23 @@
+"""
+Тесты воронки по сессиям (funnel): агрегаты по пачкам против одного прохода
+"""
+import unittest
+
+import funnel
+from test_click_rollups import POLLS, ClickDataMixin
+
+
+class FunnelTest(ClickDataMixin, unittest.TestCase):
+
+    def test_funnel(self):
+        incremental = self._incremental(tail=0)
+        one_pass = self._one_pass()
+        for poll_id in POLLS:
+            result = funnel.get_funnel(incremental, poll_id)
+            self.assertEqual(result, funnel.get_funnel(one_pass, poll_id), poll_id)
+            starts = sum(1 for row in self.rows if row[1] == f"started_poll_{poll_id}")
+            self.assertEqual(result["steps"][0]["sessions"], starts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+"""
+Тесты скетчей уникальных пользователей (hll) против точного подсчета
+"""
+import unittest
+
+import hll
+from test_click_rollups import ClickDataMixin
+
+
+class SketchesTest(ClickDataMixin, unittest.TestCase):
+
+    def test_sketches(self):
+        conn = self._incremental()
+        for scope, key, rows in (
+            ("all", "", self.rows),
+            ("poll", "poll_1", [row for row in self.rows if row[2] == "poll_1"]),
+            ("question", "poll_2:1", [row for row in self.rows if row[2] == "poll_2" and row[3] == 1]),
+        ):
+            exact = hll.Sketch()
+            for row in rows:
+                exact.add(row[0])
+            # Объединение скетчей без потерь: оценка та же, что по всем кликам сразу
+            estimate = hll.count_distinct(conn, scope, [key])
+            self.assertEqual(estimate, exact.estimate(), (scope, key))
+            users = len({row[0] for row in rows})
+            self.assertLessEqual(abs(estimate - users), max(2, users * 0.033), (scope, key))
+
+
+if __name__ == "__main__":
+    unittest.main()
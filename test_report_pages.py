@@ -0,0 +1,78 @@
+"""
+Тесты постраничных отчетов (report_pages.PagedReport)
+"""
+import unittest
+
+from report_pages import PAGE_LIMIT, PagedReport, _length
+
+
+def _all_pages(paged):
+    pages = []
+    while True:
+        page = paged.page(len(pages))
+        if page is None:
+            return pages
+        pages.append(page)
+
+
+class PagedReportTest(unittest.TestCase):
+
+    def test_pages_within_limit(self):
+        lines = [f"Вопрос {i}: " + "█" * (i % 70) for i in range(2000)]
+        pages = _all_pages(PagedReport(lines))
+
+        self.assertGreater(len(pages), 1)
+        self.assertTrue(all(_length(page) <= PAGE_LIMIT for page in pages))
+        # Строки не разорваны и вместе дают весь отчет
+        self.assertEqual([line for page in pages for line in page.split("\n")], lines)
+
+    def test_exact_boundary(self):
+        paged = PagedReport(["aaaa", "bbbbb", "c"], limit=10)
+        self.assertEqual(paged.page(0), "aaaa\nbbbbb")
+        self.assertEqual(paged.page(1), "c")
+        self.assertIsNone(paged.page(2))
+        self.assertEqual(paged.total, 2)
+
+    def test_utf16_length(self):
+        # Эмодзи вне BMP - две единицы UTF-16: 3 символа, но длина 6
+        self.assertEqual(_length("😀😀😀"), 6)
+        paged = PagedReport(["😀😀😀", "😀😀"], limit=8)
+        self.assertEqual(paged.page(0), "😀😀😀")
+        self.assertEqual(paged.page(1), "😀😀")
+
+    def test_long_line_split(self):
+        line = "😀" * 5000
+        pages = _all_pages(PagedReport([line, "конец"]))
+
+        self.assertTrue(all(_length(page) <= PAGE_LIMIT for page in pages))
+        self.assertEqual("".join(pages[:-1]) + pages[-1].split("\n")[0], line)
+        self.assertTrue(pages[-1].endswith("конец"))
+
+    def test_lazy(self):
+        pulled = []
+
+        def lines():
+            for i in range(1000):
+                pulled.append(i)
+                yield "x" * 100
+
+        paged = PagedReport(lines())
+        paged.page(0)
+        self.assertLess(len(pulled), 100)
+        self.assertIsNone(paged.total)
+        self.assertTrue(paged.has_next(0))
+
+    def test_trailing_blank_lines(self):
+        paged = PagedReport(["a", "", "", "b", ""], limit=3)
+        self.assertEqual(paged.page(0), "a")
+        self.assertEqual(paged.page(1), "b")
+        self.assertIsNone(paged.page(2))
+
+    def test_empty(self):
+        paged = PagedReport([])
+        self.assertIsNone(paged.page(0))
+        self.assertEqual(paged.total, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+"""
+Тесты того, что переживает перенос кликов в архивы (retention)
+"""
+import os
+import unittest
+
+import click_rollups
+from db_pool import transaction
+from test_click_rollups import ClickDataMixin
+
+
+class RetentionTest(ClickDataMixin, unittest.TestCase):
+
+    def test_click_users(self):
+        conn = self._incremental(tail=0)
+        exact = {}
+        for user_id, _, _, _, at in self.rows:
+            first, last = exact.get(user_id, (at, at))
+            exact[user_id] = (min(first, at), max(last, at))
+        stored = {
+            user_id: (first, last)
+            for user_id, first, last in conn.execute(
+                "SELECT user_id, first_click_at, last_click_at FROM click_users"
+            )
+        }
+        self.assertEqual(stored, exact)
+
+    def test_rebuild_refused_with_archives(self):
+        self._incremental(tail=0)
+        path = os.path.join(self._tmp.name, "incremental.db")
+        with transaction(path) as conn:
+            conn.execute("INSERT INTO click_archives (month, clicks) VALUES ('2025-12', 1)")
+            conn.execute("DELETE FROM rollup_state WHERE name = ?", (click_rollups.ROLLUP_STATE,))
+        with self.assertRaises(RuntimeError):
+            with transaction(path) as conn:
+                click_rollups.compact(conn)
+
+
+if __name__ == "__main__":
+    unittest.main()
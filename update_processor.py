@@ -0,0 +1,90 @@
+"""
+Параллельная обработка обновлений с сохранением порядка по пользователю
+
+Обновления разных пользователей обрабатываются одновременно (не больше
+UPDATE_CONCURRENCY за раз), обновления одного пользователя - строго по
+очереди поступления: следующий ответ не обгонит предыдущий. Ожидающие
+своей очереди обновления не занимают рабочие слоты, поэтому серия
+нажатий одного пользователя не задерживает остальных.
+
+Всего в обработке (в ожидании и в работе) не больше MAX_IN_FLIGHT
+обновлений; вебхук сверх этого отвечает 429, и Telegram повторяет
+доставку позже.
+"""
+import asyncio
+import os
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "1000"))
+
+
+def _ordering_key(update):
+    """Пользователь (или чат), в пределах которого важен порядок"""
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обработчик обновлений: параллельно между пользователями, по порядку внутри"""
+
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, max_in_flight=MAX_IN_FLIGHT):
+        # Семафор базового класса ограничивает число обновлений в обработке
+        super().__init__(max_in_flight)
+        self.concurrency = concurrency
+        self._workers = None
+        # ключ -> [Lock, число обновлений пользователя в обработке]
+        self._keys = {}
+        self.in_flight = 0
+        self.max_in_flight_seen = 0
+        self.processed = 0
+
+    async def initialize(self):
+        self._workers = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self):
+        self._keys.clear()
+
+    async def do_process_update(self, update, coroutine):
+        self.in_flight += 1
+        self.max_in_flight_seen = max(self.max_in_flight_seen, self.in_flight)
+        key = _ordering_key(update)
+        try:
+            if key is None:
+                async with self._workers:
+                    await coroutine
+                return
+
+            entry = self._keys.get(key)
+            if entry is None:
+                entry = self._keys[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            try:
+                # Lock будит ожидающих в порядке прихода
+                async with entry[0]:
+                    async with self._workers:
+                        await coroutine
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._keys[key]
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+
+    def stats(self) -> dict:
+        """Обновления в обработке и число пользователей с очередью"""
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight_seen": self.max_in_flight_seen,
+            "max_in_flight": self.max_concurrent_updates,
+            "concurrency": self.concurrency,
+            "active_users": len(self._keys),
+            "processed": self.processed,
+        }
@@ -0,0 +1,113 @@
+"""
+Режим вебхука: обновления принимает локальный aiohttp-сервер
+
+Настройки (.env):
+    WEBHOOK_LISTEN   адрес сервера (по умолчанию 127.0.0.1)
+    WEBHOOK_PORT     порт (8080)
+    WEBHOOK_PATH     путь запросов Telegram (/telegram)
+    WEBHOOK_SECRET   секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_URL      публичный https-адрес; если задан, при старте
+                     вызывается setWebhook на WEBHOOK_URL + WEBHOOK_PATH
+
+Сервер только кладет обновление в очередь приложения и сразу отвечает
+200; обработка идет параллельно (см. update_processor). Если в работе
+уже MAX_IN_FLIGHT обновлений, ответ 429 - Telegram доставит позже.
+"""
+import asyncio
+import json
+import os
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+from logger import logger
+
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def _in_flight(app) -> int:
+    """Обновления в очереди приложения и в обработке"""
+    processor = app.update_processor
+    return app.update_queue.qsize() + getattr(processor, "in_flight", 0)
+
+
+def make_web_app(app, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET) -> web.Application:
+    """aiohttp-приложение, принимающее обновления для app"""
+    limit = app.update_processor.max_concurrent_updates
+    rejected = {"count": 0}
+
+    async def receive(request):
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=403)
+        if _in_flight(app) >= limit:
+            rejected["count"] += 1
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        try:
+            data = await request.json()
+            update = Update.de_json(data, app.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error(f"Bad webhook payload: {e}")
+            return web.Response(status=400)
+
+        await app.update_queue.put(update)
+        return web.Response()
+
+    async def health(request):
+        stats = {"rejected": rejected["count"], "queue": app.update_queue.qsize()}
+        if hasattr(app.update_processor, "stats"):
+            stats.update(app.update_processor.stats())
+        return web.Response(text=json.dumps(stats), content_type="application/json")
+
+    web_app = web.Application()
+    web_app.router.add_post(path, receive)
+    web_app.router.add_get("/healthz", health)
+    return web_app
+
+
+async def serve(app, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, stop_event=None):
+    """Запустить приложение в режиме вебхука до сигнала остановки"""
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+
+    if WEBHOOK_URL:
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+
+    runner = web.AppRunner(make_web_app(app), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, listen, port).start()
+    await app.start()
+    logger.info(f"Webhook server on http://{listen}:{port}{WEBHOOK_PATH}")
+
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await stop_event.wait()
+    finally:
+        # Сначала перестаем принимать запросы, затем дорабатываем очередь
+        await runner.cleanup()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run(app):
+    """Синхронная точка входа (аналог app.run_polling)"""
+    asyncio.run(serve(app))